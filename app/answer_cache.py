@@ -0,0 +1,221 @@
+"""Semantic answer cache in front of the conversational retrieval chain.
+
+Answers are keyed by the normalized question (lower-cased, punctuation
+dropped, codes such as "12.3.4" kept whole) within a scope naming the index
+and metadata filter. Follow-ups are condensed with the chat history first and
+keyed by the resulting standalone question. On an exact miss the question embedding is compared
+with the cached questions of the same scope, and an answer whose question is
+at least ``ANSWER_CACHE_SIMILARITY`` cosine-similar is reused. Entries expire
+after ``ANSWER_CACHE_TTL`` seconds and the least recently used entry is
+evicted beyond ``ANSWER_CACHE_SIZE``.
+
+Rebuilding any index bumps the index epoch (see ``index_manifest``) and
+calls ``invalidate()``; caches in other processes, e.g. the Streamlit app,
+notice the new epoch and drop their entries on their next lookup.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from bm25_index import tokenize
+from index_manifest import index_epoch
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(tokenize(question))
+
+
+def _embed_question(question: str) -> np.ndarray:
+    from embedding_utils import embed_texts
+    return embed_texts([question])[0]
+
+
+class AnswerCache:
+    """Thread-safe TTL/LRU cache of chain answers with an embedding-similarity fallback."""
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        similarity: float = ANSWER_CACHE_SIMILARITY,
+        embed: Callable[[str], np.ndarray] = _embed_question,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._embed = embed
+        self._lock = threading.Lock()
+        # (scope, normalized question) -> entry dict, least recently used first
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._epoch = index_epoch()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _vector(self, question: str) -> np.ndarray:
+        vector = np.asarray(self._embed(question), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _sync_epoch(self):
+        # Another process rebuilt an index since we last looked
+        epoch = index_epoch()
+        if epoch != self._epoch:
+            self._entries.clear()
+            self._epoch = epoch
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, question: str, scope: str = "") -> Optional[Dict[str, Any]]:
+        """Cached ``{"answer", "source_documents", "match"}`` for ``question``, or None."""
+        start = time.perf_counter()
+        key = (scope, normalize_question(question))
+        with self._lock:
+            self._sync_epoch()
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            if entry is not None:
+                return self._hit(key, entry, "exact", start)
+            semantic = self.similarity <= 1.0 and any(k[0] == scope for k in self._entries)
+        # Embedding may load or call the model: other sessions keep using the cache meanwhile
+        vector = self._vector(question) if semantic else None
+        with self._lock:
+            if vector is not None:
+                candidates = [(k, e) for k, e in self._entries.items() if k[0] == scope]
+                if candidates:
+                    scores = np.stack([e["vector"] for _, e in candidates]) @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity:
+                        return self._hit(*candidates[best], "semantic", start)
+            self.misses += 1
+            metrics.incr("answer_cache_lookups", result="miss")
+            return None
+
+    def _hit(self, key: Tuple[str, str], entry: Dict[str, Any], match: str, start: float) -> Dict[str, Any]:
+        # Called with the lock held
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if match == "semantic":
+            self.semantic_hits += 1
+        metrics.incr("answer_cache_lookups", result=match)
+        self.saved_seconds += max(0.0, entry["seconds"] - (time.perf_counter() - start))
+        return {"answer": entry["answer"], "source_documents": entry["source_documents"], "match": match}
+
+    def put(self, question: str, answer: str, source_documents: List[Any], seconds: float, scope: str = ""):
+        """Store an answer that took ``seconds`` to compute."""
+        vector = self._vector(question)
+        with self._lock:
+            self._sync_epoch()
+            key = (scope, normalize_question(question))
+            self._entries[key] = {
+                "answer": answer,
+                "source_documents": list(source_documents),
+                "vector": vector,
+                "seconds": seconds,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch = index_epoch()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+
+class CachedChain:
+    """Wraps a ``ConversationalRetrievalChain`` so repeated questions skip retrieval and the LLM.
+
+    With chat history the cache is keyed on the condensed standalone question,
+    since that (not the raw follow-up) is what retrieval and the answer see.
+    Hits are still written to the chain's memory so follow-up questions see them.
+    """
+
+    def __init__(self, chain, cache: AnswerCache, scope: str = ""):
+        self.chain = chain
+        self.cache = cache
+        self.scope = scope
+
+    def cacheable(self, history: str) -> bool:
+        """False when the answer prompt also sees ``history``, so no question alone can key it."""
+        return not history or self.chain.rephrase_question
+
+    def __call__(self, inputs: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        from retrieval_chain_utils import condense_question, format_history
+
+        question = inputs["question"]
+        memory = getattr(self.chain, "memory", None)
+        chat_history = inputs.get("chat_history", [])
+        if memory is not None:
+            chat_history = memory.load_memory_variables(inputs).get("chat_history", [])
+        history = format_history(self.chain, chat_history)
+        if not self.cacheable(history):
+            return self.chain(inputs, **kwargs)
+        standalone = condense_question(self.chain, question, history, kwargs.get("callbacks"))
+        cached = self.cache.get(standalone, self.scope)
+        if cached is not None:
+            if memory is not None:
+                memory.save_context({"question": question}, {"answer": cached["answer"]})
+            return {**inputs, "answer": cached["answer"], "source_documents": cached["source_documents"],
+                    "cached": cached["match"]}
+        start = time.perf_counter()
+        if history and memory is None:
+            # Already condensed: the chain answers the standalone question directly
+            result = {**self.chain({"question": standalone, "chat_history": []}, **kwargs), **inputs}
+        else:
+            # A chain with memory reloads its history and condenses the question itself
+            result = self.chain(inputs, **kwargs)
+        self.cache.put(standalone, result["answer"], result.get("source_documents", []),
+                       time.perf_counter() - start, self.scope)
+        return result
+
+    invoke = __call__
+
+    def __getattr__(self, name):
+        return getattr(self.chain, name)
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Process-wide answer cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
+
+
+def invalidate():
+    """Called after an index rebuild: cached answers may cite stale chunks."""
+    get_answer_cache().invalidate()
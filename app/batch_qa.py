@@ -0,0 +1,251 @@
+"""Batch question answering for large question sets (e.g. nightly compliance runs).
+
+    python app/batch_qa.py questions.jsonl --backend local --output answers.jsonl
+
+Questions come from a ``.txt`` file (one per line) or ``.jsonl`` with
+``{"id": ..., "question": ...}`` records. The run:
+
+1. embeds every question in one ``embed_texts`` call (cache hits are free);
+2. retrieves the top-k chunks for all of them at once: the local index
+   scores blocks of queries with one matrix product, remote stores are
+   queried from a thread pool; with ``--hybrid``, BM25 results are fused in;
+3. generates answers with up to ``--concurrency`` LLM calls in flight,
+   started no faster than ``--rpm`` per minute, retrying transient failures
+   with exponential backoff and jitter;
+4. appends one JSON line per question to ``--output`` as soon as it is
+   answered, with per-item timings. Re-running with the same output skips
+   questions already answered without error.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import metrics
+
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))
+# LLM requests started per minute across all threads
+BATCH_QA_RPM = float(os.getenv("BATCH_QA_RPM", "600"))
+BATCH_QA_RETRIES = int(os.getenv("BATCH_QA_RETRIES", "4"))
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+RETRIEVAL_THREADS = 16
+FETCH_K = 20
+
+
+class RateLimiter:
+    """Spaces calls at least ``60 / per_minute`` seconds apart, across threads."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until the next slot; returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """``[{"id", "question", ...}]`` from a .jsonl file or a one-question-per-line text file."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                record.setdefault("id", str(number))
+            else:
+                record = {"id": str(number), "question": line}
+            record["id"] = str(record["id"])
+            questions.append(record)
+    return questions
+
+
+def _answered_ids(output: str) -> set:
+    if not os.path.exists(output):
+        return set()
+    done = set()
+    with open(output, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if not record.get("error"):
+                done.add(str(record["id"]))
+    return done
+
+
+def retrieve_batch(vectorstore, vectors: np.ndarray, questions: List[str], k: int = 4,
+                   filter: Optional[Dict[str, Any]] = None, lexical=None) -> List[List[Any]]:
+    """Top-k documents for every question, batched where the store allows it."""
+    from metadata_filters import search_kwargs_for
+
+    fetch_k = max(k, FETCH_K) if lexical is not None else k
+    if hasattr(vectorstore, "similarity_search_by_vectors"):
+        vector_docs = vectorstore.similarity_search_by_vectors(vectors, fetch_k, filter)
+    else:
+        kwargs = search_kwargs_for(vectorstore, fetch_k, filter)
+        with ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS) as pool:
+            vector_docs = list(pool.map(lambda v: vectorstore.similarity_search_by_vector(v.tolist(), **kwargs),
+                                        vectors))
+    if lexical is None:
+        return vector_docs
+    from hybrid_retriever import reciprocal_rank_fusion
+    return [reciprocal_rank_fusion([docs, lexical.similarity_search(q, fetch_k, filter)], k)
+            for docs, q in zip(vector_docs, questions)]
+
+
+def _source(doc) -> Dict[str, Any]:
+    return {key: doc.metadata[key] for key in ("source", "page", "sheet", "row") if key in doc.metadata}
+
+
+class BatchAnswerer:
+    """Answers retrieved questions concurrently under a rate limit, with retries."""
+
+    def __init__(self, chain, llm, concurrency: int = BATCH_QA_CONCURRENCY, rpm: float = BATCH_QA_RPM,
+                 retries: int = BATCH_QA_RETRIES, backoff: float = BACKOFF_SECONDS):
+        self.chain = chain
+        self.llm = llm
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rpm)
+        self.retries = retries
+        self.backoff = backoff
+
+    def answer(self, question: str, docs: List[Any]) -> Dict[str, Any]:
+        from retrieval_chain_utils import answer_messages
+        from upsert_engine import is_retryable
+
+        messages = answer_messages(self.chain, docs, question)
+        waited = 0.0
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            waited += self.limiter.acquire()
+            try:
+                with metrics.timer("generate"):
+                    response = self.llm.invoke(messages)
+                break
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                metrics.incr("batch_qa_retries")
+                pause = random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** attempt))
+                waited += pause
+                time.sleep(pause)
+        return {"answer": getattr(response, "content", str(response)), "attempts": attempt + 1,
+                "wait_ms": waited * 1000, "generate_ms": (time.perf_counter() - start - waited) * 1000}
+
+
+def run_batch(
+    questions: List[Dict[str, Any]],
+    vectorstore,
+    answerer: BatchAnswerer,
+    output: str,
+    k: int = 4,
+    filter: Optional[Dict[str, Any]] = None,
+    lexical=None,
+    embed=None,
+) -> Dict[str, Any]:
+    """Answer ``questions`` and append the results to ``output``; returns run statistics."""
+    if embed is None:
+        from embedding_utils import embed_texts as embed
+    done = _answered_ids(output)
+    todo = [q for q in questions if q["id"] not in done]
+    stats = {"questions": len(questions), "skipped": len(questions) - len(todo), "answered": 0, "failed": 0}
+    start = time.perf_counter()
+    if not todo:
+        stats["seconds"] = 0.0
+        print("All questions are already answered.")
+        return stats
+    texts = [q["question"] for q in todo]
+
+    with metrics.span("batch_embed", questions=len(todo)):
+        embed_start = time.perf_counter()
+        vectors = np.asarray(embed(texts), dtype=np.float32)
+        embed_ms = (time.perf_counter() - embed_start) * 1000 / len(todo)
+    with metrics.span("batch_retrieve", questions=len(todo)):
+        retrieve_start = time.perf_counter()
+        retrieved = retrieve_batch(vectorstore, vectors, texts, k, filter, lexical)
+        retrieve_ms = (time.perf_counter() - retrieve_start) * 1000 / len(todo)
+    print(f"Retrieved context for {len(todo)} questions in {time.perf_counter() - start:.1f}s")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=answerer.concurrency, thread_name_prefix="batch-qa") as pool:
+        futures = {pool.submit(answerer.answer, q["question"], docs): (q, docs) for q, docs in zip(todo, retrieved)}
+        for future in as_completed(futures):
+            q, docs = futures[future]
+            record = {"id": q["id"], "question": q["question"], "sources": [_source(d) for d in docs],
+                      "timings": {"embed_ms": embed_ms, "retrieve_ms": retrieve_ms}}
+            try:
+                result = future.result()
+                record["answer"] = result["answer"]
+                record["attempts"] = result["attempts"]
+                record["timings"].update(wait_ms=result["wait_ms"], generate_ms=result["generate_ms"])
+                stats["answered"] += 1
+            except Exception as e:
+                record["answer"] = None
+                record["error"] = f"{type(e).__name__}: {e}"
+                stats["failed"] += 1
+            metrics.incr("batch_qa_questions", status="failed" if record.get("error") else "answered")
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            finished = stats["answered"] + stats["failed"]
+            if finished % 100 == 0:
+                print(f"{finished}/{len(todo)} answered ({time.perf_counter() - start:.0f}s)")
+    stats["seconds"] = time.perf_counter() - start
+    stats["questions_per_minute"] = len(todo) / stats["seconds"] * 60
+    print(f"Batch: {stats['answered']} answered, {stats['failed']} failed, {stats['skipped']} skipped "
+          f"in {stats['seconds']:.1f}s ({stats['questions_per_minute']:.0f} questions/min)")
+    return stats
+
+
+def main():
+    import resources
+    from retrieval_chain_utils import build_conversational_chain
+
+    parser = argparse.ArgumentParser(description="Answer a file of questions against the knowledge base")
+    parser.add_argument("questions", help=".jsonl ({\"id\", \"question\"}) or .txt (one question per line)")
+    parser.add_argument("--output", default="answers.jsonl", help="JSON-lines file results are appended to")
+    parser.add_argument("--backend", choices=list(resources.VECTORSTORES), default="pinecone")
+    parser.add_argument("--index", default="bank-kb")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--hybrid", action="store_true", help="fuse BM25 results into retrieval")
+    parser.add_argument("--filter", type=json.loads, default=None,
+                        help='metadata filter as JSON, e.g. \'{"document_type": "pdf"}\'')
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=BATCH_QA_RPM, help="LLM requests per minute")
+    parser.add_argument("--retries", type=int, default=BATCH_QA_RETRIES)
+    args = parser.parse_args()
+
+    llm = resources.get_llm()
+    if llm is None:
+        sys.exit("No LLM configured (set GOOGLE_API_KEY).")
+    vectorstore = resources.get_vectorstore(args.backend, args.index)
+    lexical = resources.get_lexical_index(args.backend, args.index) if args.hybrid else None
+    chain = build_conversational_chain(vectorstore=vectorstore, llm=llm, verbose=False)
+    answerer = BatchAnswerer(chain, llm, args.concurrency, args.rpm, args.retries)
+    run_batch(load_questions(args.questions), vectorstore, answerer, args.output, args.k, args.filter, lexical)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,338 @@
+"""Offline, reproducible performance benchmarks.
+
+Stages:
+- ``loaders``: load_pdf / load_docx / load_excel throughput on generated fixtures
+- ``embeddings``: embed_texts cold (empty cache) vs. warm
+- ``index``: pipeline index build time into a LocalVectorStore plus BM25
+- ``query``: semantic_query p50/p95/p99 at several corpus sizes (exact and IVF), and BM25
+- ``chain``: end-to-end conversational chain latency with a deterministic fake LLM
+
+Everything runs against generated data in a temporary directory, with a
+fixed seed. Except for the ``embeddings`` stage, vectors come from a hash
+based stand-in embedder, so no model download or network access is needed.
+Each run appends one JSON record (git commit, environment, config, results)
+to ``--output``, so regressions can be tracked across commits:
+
+    python app/benchmark.py --quick --output benchmark_results.jsonl
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+STAGES = ("loaders", "embeddings", "index", "query", "chain")
+DIM = 384
+WORDS = ("loan amortization schedule interest rate account deposit KYC limit fee overdraft "
+         "regulation 12.3.4 customer branch transfer mortgage collateral compliance").split()
+
+
+class HashEmbedding(Embeddings):
+    """Deterministic stand-in for the sentence-transformer: same text, same unit vector."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    @staticmethod
+    def embed_array(texts: List[str]) -> np.ndarray:
+        out = np.empty((len(texts), DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            out[i] = np.random.default_rng(seed).standard_normal(DIM)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def _sentences(rng: np.random.Generator, n: int, words: int = 12) -> List[str]:
+    return [" ".join(rng.choice(WORDS, size=words)).capitalize() + "." for _ in range(n)]
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ms = np.array(samples) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean()), "n": len(samples)}
+
+
+@contextlib.contextmanager
+def _quiet():
+    # The loaders and the ingest pipeline print progress per file and run; keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# --- fixtures ----------------------------------------------------------------
+
+def write_pdf(path: Path, pages: List[str]):
+    """Minimal multi-page PDF with one Helvetica text line per page (no extra dependencies)."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = f"BT /F1 10 Tf 40 800 Td ({escaped}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+def write_docx(path: Path, paragraphs: List[str]):
+    """Minimal WordprocessingML package with plain paragraphs."""
+    body = "".join(f"<w:p><w:r><w:t>{p}</w:t></w:r></w:p>" for p in paragraphs)
+    ns = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+                   '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/word/document.xml" '
+                   'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        z.writestr("_rels/.rels",
+                   '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+                   'Target="word/document.xml"/></Relationships>')
+        z.writestr("word/document.xml",
+                   f'<?xml version="1.0" encoding="UTF-8"?><w:document {ns}><w:body>{body}</w:body></w:document>')
+
+
+def write_xlsx(path: Path, rows: int, rng: np.random.Generator):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Fees")
+    ws.append(["Product", "Fee", "Limit", "Notes"])
+    notes = _sentences(rng, rows, words=6)
+    for i in range(rows):
+        ws.append([f"P-{i:05d}", float(rng.integers(0, 500)), int(rng.integers(1000, 100000)), notes[i]])
+    wb.save(path)
+
+
+def make_fixtures(directory: Path, scale: int, seed: int) -> Dict[str, Path]:
+    rng = np.random.default_rng(seed)
+    fixtures = {"pdf": directory / "fixture.pdf", "docx": directory / "fixture.docx",
+                "excel": directory / "fixture.xlsx"}
+    write_pdf(fixtures["pdf"], [" ".join(_sentences(rng, 6)) for _ in range(20 * scale)])
+    write_docx(fixtures["docx"], _sentences(rng, 200 * scale, words=20))
+    write_xlsx(fixtures["excel"], 500 * scale, rng)
+    return fixtures
+
+
+# --- stages --------------------------------------------------------------------
+
+def bench_loaders(config: Dict[str, Any], workdir: Path) -> Dict[str, Any]:
+    import load_documents
+    fixtures = make_fixtures(workdir, config["scale"], config["seed"])
+    loaders = {"pdf": load_documents.load_pdf, "docx": load_documents.load_docx,
+               "excel": load_documents.load_excel}
+    results = {}
+    for fmt, path in fixtures.items():
+        start = time.perf_counter()
+        with _quiet():
+            chunks = loaders[fmt](path)
+        seconds = time.perf_counter() - start
+        size = path.stat().st_size
+        results[fmt] = {"chunks": len(chunks), "bytes": size, "seconds": seconds,
+                        "chunks_per_s": len(chunks) / seconds if seconds else None,
+                        "mb_per_s": size / 1e6 / seconds if seconds else None}
+    return results
+
+
+def bench_embeddings(config: Dict[str, Any], workdir: Path) -> Dict[str, Any]:
+    import embedding_utils
+    texts = _sentences(np.random.default_rng(config["seed"]), config["embed_texts"], words=40)
+    start = time.perf_counter()
+    embedding_utils.get_model()
+    model_load = time.perf_counter() - start
+    # Cold means an empty cache: point the lazily opened cache at the work directory, even if
+    # embedding_utils was imported (and its default cache opened) before this stage
+    saved = embedding_utils.EMBEDDING_CACHE_DIR, embedding_utils._cache
+    embedding_utils.EMBEDDING_CACHE_DIR, embedding_utils._cache = str(workdir / "embedding_cache"), None
+    runs = {}
+    try:
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            with _quiet():
+                embedding_utils.embed_texts(texts)
+            seconds = time.perf_counter() - start
+            runs[label] = {"seconds": seconds, "texts_per_s": len(texts) / seconds}
+    finally:
+        embedding_utils.EMBEDDING_CACHE_DIR, embedding_utils._cache = saved
+    return {"model": embedding_utils.EMBEDDING_MODEL_NAME, "texts": len(texts),
+            "model_load_seconds": model_load, **runs}
+
+
+def _corpus(n: int, seed: int) -> List[Dict[str, Any]]:
+    texts = _sentences(np.random.default_rng(seed), n, words=30)
+    return [{"text": t, "metadata": {"source": f"doc-{i // 50}.pdf", "page": i % 50 + 1, "document_type": "pdf"}}
+            for i, t in enumerate(texts)]
+
+
+def bench_index(config: Dict[str, Any], workdir: Path) -> Dict[str, Any]:
+    from bm25_index import BM25Index
+    from ingest_pipeline import run_pipeline
+    from local_index import LocalVectorStore, make_local_writer
+    results = {}
+    for n in config["corpus_sizes"]:
+        chunks = _corpus(n, config["seed"])
+        store, lexical = LocalVectorStore(HashEmbedding()), BM25Index()
+        vector_writer = make_local_writer(store)
+
+        def write(batch, vectors):
+            vector_writer(batch, vectors)
+            lexical.add_chunks(batch)
+        with _quiet():
+            stats = run_pipeline(chunks, write, embed=HashEmbedding.embed_array)
+        start = time.perf_counter()
+        store.build_ivf()
+        ivf = time.perf_counter() - start
+        results[str(n)] = {"seconds": stats["seconds"], "chunks_per_s": n / stats["seconds"],
+                           "ivf_build_seconds": ivf}
+    return results
+
+
+def bench_query(config: Dict[str, Any], workdir: Path) -> Dict[str, Any]:
+    from bm25_index import BM25Index
+    from chroma_utils import semantic_query
+    from local_index import LocalVectorStore
+    rng = np.random.default_rng(config["seed"] + 1)
+    queries = _sentences(rng, config["queries"], words=8)
+    results = {}
+    for n in config["corpus_sizes"]:
+        chunks = _corpus(n, config["seed"])
+        texts = [c["text"] for c in chunks]
+        store = LocalVectorStore(HashEmbedding())
+        store.add_embeddings(texts, HashEmbedding.embed_array(texts), [c["metadata"] for c in chunks])
+        lexical = BM25Index()
+        lexical.add_chunks(chunks)
+        timings: Dict[str, Callable[[str], Any]] = {
+            # The documented query entry point (docs/retrieval.md); it works with any vector store
+            "exact": lambda q: semantic_query(q, store, top_k=4),
+            "bm25": lambda q: lexical.similarity_search(q, k=4),
+        }
+        results[str(n)] = {}
+        for name, search in timings.items():
+            results[str(n)][name] = _time_queries(search, queries)
+        store.build_ivf()
+        store.mode = "ivf"
+        results[str(n)]["ivf"] = _time_queries(lambda q: semantic_query(q, store, top_k=4), queries)
+    return results
+
+
+def _time_queries(search: Callable[[str], Any], queries: List[str]) -> Dict[str, float]:
+    search(queries[0])  # warm-up
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        search(q)
+        samples.append(time.perf_counter() - start)
+    return _percentiles(samples)
+
+
+def bench_chain(config: Dict[str, Any], workdir: Path) -> Dict[str, Any]:
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from local_index import LocalVectorStore
+    from retrieval_chain_utils import build_conversational_chain, stream_conversational_chain
+    chunks = _corpus(config["corpus_sizes"][0], config["seed"])
+    texts = [c["text"] for c in chunks]
+    store = LocalVectorStore(HashEmbedding())
+    store.add_embeddings(texts, HashEmbedding.embed_array(texts), [c["metadata"] for c in chunks])
+    # Fixed replies and no sleep: measures everything except real generation time
+    llm = FakeListChatModel(responses=["Standalone question about fees?",
+                                       "The monthly fee is waived above the minimum balance."])
+    chain = build_conversational_chain(vectorstore=store, llm=llm, verbose=False)
+    questions = _sentences(np.random.default_rng(config["seed"] + 2), config["queries"], words=8)
+    results = {}
+    for label, history in (("first_turn", []), ("follow_up", [("What is the fee?", "It is 5 USD.")])):
+        totals, ttfts = [], []
+        for q in questions:
+            llm.i = 1 if not history else 0
+            for event, value in stream_conversational_chain(chain, q, history):
+                if event == "done":
+                    totals.append(value["seconds"])
+                    ttfts.append(value["ttft"])
+        results[label] = {"total": _percentiles(totals), "ttft": _percentiles(ttfts)}
+    return results
+
+
+BENCHMARKS = {"loaders": bench_loaders, "embeddings": bench_embeddings, "index": bench_index,
+              "query": bench_query, "chain": bench_chain}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run(stages: List[str], config: Dict[str, Any]) -> Dict[str, Any]:
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "config": config,
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        for stage in stages:
+            print(f"Running {stage} benchmark...")
+            try:
+                record["results"][stage] = BENCHMARKS[stage](config, Path(tmp))
+            except Exception as e:
+                # e.g. no sentence-transformers model available offline; keep the other stages
+                record["results"][stage] = {"error": f"{type(e).__name__}: {e}"}
+            print(json.dumps(record["results"][stage], indent=2))
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion/embedding/query benchmarks")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--quick", action="store_true", help="small sizes, for smoke runs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.jsonl",
+                        help="JSON-lines file the run record is appended to")
+    args = parser.parse_args()
+    config = {
+        "seed": args.seed,
+        "scale": 1 if args.quick else 5,
+        "embed_texts": 200 if args.quick else 2000,
+        "corpus_sizes": [1000, 5000] if args.quick else [1000, 10000, 50000],
+        "queries": 50 if args.quick else 200,
+    }
+    record = run(args.stages, config)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Appended results for commit {record['commit'][:12]} to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,207 @@
+"""Inverted-index BM25 retrieval over the chunk dicts produced by load_documents.
+
+Exact tokens such as regulation numbers ("12.3.4"), product codes and account
+types are kept as single tokens, which embeddings tend to blur. Postings are
+per-term arrays of (row, term frequency), scored with NumPy. The index is
+updated incrementally alongside the vector store and persisted in CSR form
+(``bm25.npz``) next to a JSON-lines file of the chunks themselves.
+"""
+import json
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from metadata_filters import matches
+
+LEXICAL_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lexical_index")
+POSTINGS_FILE = "bm25.npz"
+DOCS_FILE = "docs.jsonl"
+# Keeps dotted/dashed/slashed codes together: "12.3.4", "kyc-2", "reg/5"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Incrementally updatable Okapi BM25 index."""
+
+    def __init__(self, directory: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._doc_len = array("i")
+        self._alive = array("b")
+        self._row_of: Dict[str, int] = {}
+        # term -> (rows, term frequencies)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._df: Counter = Counter()
+        self._total_len = 0
+        if directory and os.path.exists(os.path.join(directory, POSTINGS_FILE)):
+            self._load()
+
+    @classmethod
+    def for_index(cls, backend: str, index_name: str) -> "BM25Index":
+        return cls(os.path.join(LEXICAL_INDEX_DIR, f"{backend}-{index_name}"))
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    # --- writes ----------------------------------------------------------
+
+    def add_chunks(self, chunks: Iterable[Dict[str, Any]]):
+        """Add chunk dicts (``text``, ``metadata`` and optional ``id``); an existing ID is replaced."""
+        with self._lock:
+            for chunk in chunks:
+                doc_id = chunk.get("id") or str(len(self._ids))
+                self.delete([doc_id])
+                row = len(self._ids)
+                counts = Counter(tokenize(chunk["text"]))
+                self._ids.append(doc_id)
+                self._texts.append(chunk["text"])
+                self._metadatas.append(chunk["metadata"])
+                self._doc_len.append(sum(counts.values()))
+                self._alive.append(1)
+                self._row_of[doc_id] = row
+                self._total_len += self._doc_len[row]
+                for term, tf in counts.items():
+                    rows, tfs = self._postings.setdefault(term, (array("i"), array("i")))
+                    rows.append(row)
+                    tfs.append(tf)
+                    self._df[term] += 1
+
+    def delete(self, ids: Iterable[str]):
+        """Tombstone documents; their postings are dropped on the next save."""
+        with self._lock:
+            for doc_id in ids:
+                row = self._row_of.pop(doc_id, None)
+                if row is None:
+                    continue
+                self._alive[row] = 0
+                self._total_len -= self._doc_len[row]
+                for term in set(tokenize(self._texts[row])):
+                    self._df[term] -= 1
+                    if self._df[term] <= 0:
+                        del self._df[term]
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]]):
+        """Merge fields into the metadata of stored chunks (chunk ID -> fields)."""
+        with self._lock:
+            for doc_id, fields in updates.items():
+                row = self._row_of.get(doc_id)
+                if row is not None:
+                    self._metadatas[row] = {**self._metadatas[row], **fields}
+
+    # --- search ----------------------------------------------------------
+
+    def search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-k ``(row, score)`` pairs for ``query``, restricted to rows matching ``filter``."""
+        with self._lock:
+            n_docs = len(self._row_of)
+            if n_docs == 0:
+                return []
+            avgdl = self._total_len / n_docs
+            doc_len = np.frombuffer(self._doc_len, dtype=np.int32)
+            alive = np.frombuffer(self._alive, dtype=np.int8).astype(bool)
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                df = self._df.get(term, 0)
+                if postings is None or df == 0:
+                    continue
+                rows = np.frombuffer(postings[0], dtype=np.int32)
+                tfs = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+                idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * doc_len[rows] / avgdl)
+                # Rows are unique within a posting list, so plain fancy-index add is safe
+                scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+            scores[~alive] = 0.0
+            hits = np.flatnonzero(scores > 0)
+            if filter:
+                # Only rows sharing a query term are checked, before the top-k cut
+                hits = np.array([row for row in hits if matches(self._metadatas[row], filter)], dtype=np.int64)
+            if len(hits) == 0:
+                return []
+            k = min(k, len(hits))
+            top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(int(row), float(scores[row])) for row in top]
+
+    def document(self, row: int) -> Document:
+        return Document(id=self._ids[row], page_content=self._texts[row], metadata=dict(self._metadatas[row]))
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return [self.document(row) for row, _ in self.search(query, k, filter)]
+
+    # --- persistence -----------------------------------------------------
+
+    def compact(self):
+        """Rebuild without tombstoned rows."""
+        with self._lock:
+            if all(self._alive):
+                return
+            live = [
+                {"id": self._ids[row], "text": self._texts[row], "metadata": self._metadatas[row]}
+                for row in range(len(self._ids)) if self._alive[row]
+            ]
+            fresh = BM25Index(None, self.k1, self.b)
+            fresh.add_chunks(live)
+            for name in ("_ids", "_texts", "_metadatas", "_doc_len", "_alive",
+                         "_row_of", "_postings", "_df", "_total_len"):
+                setattr(self, name, getattr(fresh, name))
+
+    def save(self, directory: Optional[str] = None):
+        directory = directory or self.directory
+        if not directory:
+            raise ValueError("No directory set for BM25Index")
+        with self._lock:
+            self.compact()
+            os.makedirs(directory, exist_ok=True)
+            terms = sorted(self._postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(self._postings[t][0]) for t in terms])
+            rows = np.concatenate([np.frombuffer(self._postings[t][0], dtype=np.int32) for t in terms]) \
+                if terms else np.zeros(0, dtype=np.int32)
+            tfs = np.concatenate([np.frombuffer(self._postings[t][1], dtype=np.int32) for t in terms]) \
+                if terms else np.zeros(0, dtype=np.int32)
+            path = os.path.join(directory, POSTINGS_FILE)
+            # np.savez appends ".npz" to names without it, so write to "<tmp>.npz"
+            np.savez_compressed(path + ".tmp.npz", terms=np.array(terms, dtype=str), offsets=offsets,
+                                rows=rows, tfs=tfs.astype(np.uint16 if tfs.size and tfs.max() < 65536 else np.int32),
+                                doc_len=np.frombuffer(self._doc_len, dtype=np.int32))
+            with open(os.path.join(directory, DOCS_FILE + ".tmp"), "w", encoding="utf-8") as f:
+                for doc_id, text, meta in zip(self._ids, self._texts, self._metadatas):
+                    f.write(json.dumps({"id": doc_id, "text": text, "metadata": meta}) + "\n")
+            os.replace(path + ".tmp.npz", path)
+            os.replace(os.path.join(directory, DOCS_FILE + ".tmp"), os.path.join(directory, DOCS_FILE))
+
+    def _load(self):
+        data = np.load(os.path.join(self.directory, POSTINGS_FILE))
+        with open(os.path.join(self.directory, DOCS_FILE), "r", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                record = json.loads(line)
+                self._ids.append(record["id"])
+                self._texts.append(record["text"])
+                self._metadatas.append(record["metadata"])
+                self._row_of[record["id"]] = row
+        self._doc_len = array("i", data["doc_len"].astype(np.int32).tobytes())
+        self._alive = array("b", [1]) * len(self._ids)
+        self._total_len = int(data["doc_len"].sum())
+        offsets = data["offsets"]
+        rows = data["rows"].astype(np.int32)
+        tfs = data["tfs"].astype(np.int32)
+        for i, term in enumerate(data["terms"].tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            self._postings[term] = (array("i", rows[start:end].tobytes()), array("i", tfs[start:end].tobytes()))
+            self._df[term] = int(end - start)
@@ -1,16 +1,15 @@
 from langchain_community.vectorstores import Chroma
 from langchain.docstore.document import Document
-from langchain_community.vectorstores.utils import filter_complex_metadata
-from embedding_utils import embed_texts
-
-class CustomEmbedding:
-    def embed_documents(self, texts):
-        return embed_texts(texts)
-    def embed_query(self, text):
-        return embed_texts([text])[0]
+from embedding_utils import CustomEmbedding
+from chunk_batch import ChunkBatch
+from index_manifest import IndexManifest
+from bm25_index import BM25Index
+from ingest_pipeline import index_chunks, index_files as run_index_files, simple_metadata
 
 import os
-from typing import List, Dict, Any
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 CHROMA_PATH = os.path.join(os.path.dirname(__file__), "..", "chroma_db")
 
@@ -18,24 +17,50 @@ CHROMA_PATH = os.path.join(os.path.dirname(__file__), "..", "chroma_db")
 def dicts_to_documents(chunk_dicts: List[Dict[str, Any]]) -> List[Document]:
     docs = []
     for d in chunk_dicts:
-        filtered_metadata = filter_complex_metadata(d["metadata"])
+        filtered_metadata = simple_metadata(d["metadata"])
         docs.append(Document(page_content=d["text"], metadata=filtered_metadata))
     return docs
 
-def build_chroma_collection(chunks: List[Dict[str, Any]], collection_name="bank-kb"):
-    # Prepare documents
-    docs = dicts_to_documents(chunks)
-    # Use Chroma vector store (latest API)
-    embedding = CustomEmbedding()
-    vectorstore = Chroma.from_documents(
-        docs,
-        embedding=embedding,
-        persist_directory=CHROMA_PATH,
-        collection_name=collection_name
-    )
+def make_chroma_writer(vectorstore):
+    # Write precomputed embeddings straight to the underlying collection, column by column
+    def write(batch: ChunkBatch, vectors) -> None:
+        vectorstore._collection.upsert(
+            ids=[cid or str(uuid.uuid4()) for cid in batch.ids],
+            embeddings=vectors.tolist(),
+            metadatas=[simple_metadata(meta) for meta in batch.metadatas()],
+            documents=batch.texts(),
+        )
+
+    def update_metadata(updates: Dict[str, Dict[str, Any]]) -> None:
+        # Chroma replaces metadata on update, so merge with what is stored
+        found = vectorstore._collection.get(ids=list(updates), include=["metadatas"])
+        if found["ids"]:
+            vectorstore._collection.update(
+                ids=found["ids"],
+                metadatas=[{**(meta or {}), **updates[cid]} for cid, meta in zip(found["ids"], found["metadatas"])],
+            )
+    write.update_metadata = update_metadata
+    return write
+
+def build_chroma_collection(chunks: Iterable[Dict[str, Any]], collection_name="bank-kb"):
+    # Stream chunks through the batched embed/upsert pipeline, skipping ones already indexed
+    vectorstore = get_chroma_vectorstore(collection_name)
+    manifest = IndexManifest.for_index("chroma", collection_name)
+    index_chunks(chunks, manifest, make_chroma_writer(vectorstore),
+                 lambda ids: vectorstore._collection.delete(ids=ids),
+                 BM25Index.for_index("chroma", collection_name))
     vectorstore.persist()
     return vectorstore
 
+def index_files(paths: Iterable[Path], collection_name="bank-kb",
+                failures: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Any]:
+    # Parse and index only the files that changed since the last run
+    vectorstore = get_chroma_vectorstore(collection_name)
+    manifest = IndexManifest.for_index("chroma", collection_name)
+    return run_index_files(paths, manifest, make_chroma_writer(vectorstore),
+                           lambda ids: vectorstore._collection.delete(ids=ids), failures,
+                           BM25Index.for_index("chroma", collection_name))
+
 def get_chroma_vectorstore(collection_name="bank-kb"):
     # Load from persisted vector store (latest API)
     embedding = CustomEmbedding()
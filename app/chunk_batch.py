@@ -0,0 +1,225 @@
+"""Columnar batches of chunks for the ingestion path.
+
+A ``ChunkBatch`` keeps the texts of many chunks in one string with an
+offsets array, the common metadata fields in typed columns (``int32``
+arrays, or codes into a table of interned strings) and only rare fields in
+per-row dicts. Compared with one ``{"text", "metadata"}`` dict per chunk,
+that is a handful of objects per batch: cheaper to pickle from parse workers,
+to hold in the pipeline queues and for the garbage collector to scan.
+
+Indexing a batch gives a ``ChunkView``, a two-slot record that reads like the
+old chunk dict (``view["text"]``, ``view["metadata"]``, ``view.get("id")``),
+so per-chunk code such as the manifest, dedup and BM25 keeps working.
+Metadata dicts and LangChain ``Document`` objects are only built on access.
+"""
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+# Integer metadata fields stored as int32 columns (-1 when absent)
+INT_FIELDS = ("page", "chunk", "element", "row", "row_end", "total_pages")
+# String metadata fields stored as codes into an interned table (-1 when absent)
+STR_FIELDS = ("source", "document_type", "sheet")
+_MISSING = -1
+
+
+class ChunkView(Mapping):
+    """Read-only record view of one row of a ``ChunkBatch`` (only ``id`` can be set)."""
+
+    __slots__ = ("batch", "row")
+    _KEYS = ("text", "metadata", "id")
+
+    def __init__(self, batch: "ChunkBatch", row: int):
+        self.batch = batch
+        self.row = row
+
+    @property
+    def text(self) -> str:
+        return self.batch.text(self.row)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.batch.metadata(self.row)
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.batch.ids[self.row]
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "text":
+            return self.text
+        if key == "metadata":
+            return self.metadata
+        if key == "id" and self.id is not None:
+            return self.id
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key != "id":
+            raise TypeError("Only the id of a chunk view can be assigned")
+        self.batch.ids[self.row] = value
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key in self._KEYS if key != "id" or self.id is not None)
+
+    def __len__(self) -> int:
+        return 2 if self.id is None else 3
+
+    def __repr__(self) -> str:
+        return f"ChunkView(row={self.row}, id={self.id!r}, metadata={self.metadata!r})"
+
+
+class ChunkBatch:
+    """Texts, IDs and metadata of many chunks in contiguous columns."""
+
+    __slots__ = ("_text", "offsets", "ids", "ints", "codes", "tables", "extras")
+
+    def __init__(self, text: str, offsets: np.ndarray, ids: List[Optional[str]],
+                 ints: Dict[str, np.ndarray], codes: Dict[str, np.ndarray],
+                 tables: Dict[str, List[str]], extras: List[Optional[Dict[str, Any]]]):
+        self._text = text
+        self.offsets = offsets
+        self.ids = ids
+        self.ints = ints
+        self.codes = codes
+        self.tables = tables
+        self.extras = extras
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Mapping]) -> "ChunkBatch":
+        """Build a batch from chunk dicts or views (views of one batch are taken without copying)."""
+        chunks = chunks if isinstance(chunks, Sequence) else list(chunks)
+        if chunks and all(isinstance(c, ChunkView) for c in chunks):
+            source = chunks[0].batch
+            if all(c.batch is source for c in chunks):
+                return source.take([c.row for c in chunks])
+        n = len(chunks)
+        texts: List[str] = []
+        ids: List[Optional[str]] = []
+        ints = {field: np.full(n, _MISSING, dtype=np.int32) for field in INT_FIELDS}
+        codes = {field: np.full(n, _MISSING, dtype=np.int32) for field in STR_FIELDS}
+        tables: Dict[str, List[str]] = {field: [] for field in STR_FIELDS}
+        lookup: Dict[str, Dict[str, int]] = {field: {} for field in STR_FIELDS}
+        extras: List[Optional[Dict[str, Any]]] = []
+        for row, chunk in enumerate(chunks):
+            texts.append(chunk["text"])
+            ids.append(chunk.get("id"))
+            extra = None
+            for key, value in chunk["metadata"].items():
+                if key in ints and type(value) is int and -2 ** 31 < value < 2 ** 31 and value != _MISSING:
+                    ints[key][row] = value
+                elif key in codes and type(value) is str:
+                    seen = lookup[key]
+                    if value not in seen:
+                        seen[value] = len(tables[key])
+                        tables[key].append(sys.intern(value))
+                    codes[key][row] = seen[value]
+                else:
+                    if extra is None:
+                        extra = {}
+                    extra[key] = value
+            extras.append(extra)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=offsets[1:])
+        return cls("".join(texts), offsets, ids, ints, codes, tables, extras)
+
+    # --- rows ------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> ChunkView:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return ChunkView(self, row)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        return (ChunkView(self, row) for row in range(len(self)))
+
+    def text(self, row: int) -> str:
+        return self._text[self.offsets[row]:self.offsets[row + 1]]
+
+    def texts(self) -> List[str]:
+        text, bounds = self._text, self.offsets.tolist()
+        return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        meta: Dict[str, Any] = {}
+        for field in STR_FIELDS:
+            code = self.codes[field][row]
+            if code != _MISSING:
+                meta[field] = self.tables[field][code]
+        for field in INT_FIELDS:
+            value = self.ints[field][row]
+            if value != _MISSING:
+                meta[field] = int(value)
+        if self.extras[row]:
+            meta.update(self.extras[row])
+        return meta
+
+    def metadatas(self) -> List[Dict[str, Any]]:
+        # Column by column: one tolist() per field instead of numpy scalar access per cell
+        metas: List[Dict[str, Any]] = [{} for _ in range(len(self))]
+        for field in STR_FIELDS:
+            table = self.tables[field]
+            for meta, code in zip(metas, self.codes[field].tolist()):
+                if code != _MISSING:
+                    meta[field] = table[code]
+        for field in INT_FIELDS:
+            for meta, value in zip(metas, self.ints[field].tolist()):
+                if value != _MISSING:
+                    meta[field] = value
+        for meta, extra in zip(metas, self.extras):
+            if extra:
+                meta.update(extra)
+        return metas
+
+    def sources(self) -> List[str]:
+        table, codes = self.tables["source"], self.codes["source"].tolist()
+        return [table[code] if code != _MISSING else "" for code in codes]
+
+    # --- selection -------------------------------------------------------
+
+    def slice(self, start: int, stop: int) -> "ChunkBatch":
+        """Rows ``start:stop`` sharing this batch's text buffer and column arrays.
+
+        The whole text buffer stays referenced, so do not pickle small slices of large batches.
+        """
+        stop = min(stop, len(self))
+        return ChunkBatch(self._text, self.offsets[start:stop + 1], self.ids[start:stop],
+                          {k: v[start:stop] for k, v in self.ints.items()},
+                          {k: v[start:stop] for k, v in self.codes.items()},
+                          self.tables, self.extras[start:stop])
+
+    def take(self, rows: Sequence[int]) -> "ChunkBatch":
+        """Batch of the given rows; a contiguous run is a zero-copy ``slice``."""
+        if len(rows) and list(rows) == list(range(rows[0], rows[0] + len(rows))):
+            return self.slice(rows[0], rows[0] + len(rows))
+        index = np.asarray(rows, dtype=np.int64)
+        texts = [self.text(row) for row in rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(self.offsets[index + 1] - self.offsets[index], out=offsets[1:])
+        return ChunkBatch("".join(texts), offsets, [self.ids[row] for row in rows],
+                          {k: v[index] for k, v in self.ints.items()},
+                          {k: v[index] for k, v in self.codes.items()},
+                          self.tables, [self.extras[row] for row in rows])
+
+    # --- conversions -----------------------------------------------------
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        chunks = []
+        for row in range(len(self)):
+            chunk = {"text": self.text(row), "metadata": self.metadata(row)}
+            if self.ids[row] is not None:
+                chunk["id"] = self.ids[row]
+            chunks.append(chunk)
+        return chunks
+
+    def documents(self) -> List[Any]:
+        """LangChain ``Document`` objects, built only when asked for."""
+        from langchain.docstore.document import Document
+        return [Document(page_content=self.text(row), metadata=self.metadata(row)) for row in range(len(self))]
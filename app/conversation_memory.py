@@ -0,0 +1,115 @@
+"""Per-session, token-budgeted conversation memory and prompt token accounting.
+
+Each Streamlit session owns a ``SessionMemory``; the shared chain itself is
+stateless and receives the history as ``chat_history`` on every call. Only
+the most recent turns that fit in ``max_tokens`` are kept. With
+``summarize=True``, turns pushed out of the window are folded into a running
+summary by the LLM, one eviction at a time, so the condense-question prompt
+stays roughly constant in size however long the conversation runs.
+"""
+import os
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1000"))
+# Rough tokens-per-character ratio for English text with Gemini/SentencePiece tokenizers
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a bank employee and an assistant, \
+adding onto the previous summary. Keep facts, figures and document references; be brief.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+def count_tokens(text: str) -> int:
+    """Cheap, offline token estimate (no tokenizer download or API call)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class SessionMemory:
+    """Sliding window of recent turns within a token budget, plus an optional running summary."""
+
+    def __init__(self, max_tokens: int = CHAT_HISTORY_TOKENS, summarize: bool = False, llm=None):
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.llm = llm
+        self.summary = ""
+        self.turns: List[Tuple[str, str]] = []
+
+    def chat_history(self) -> List[BaseMessage]:
+        """History in the form ``ConversationalRetrievalChain`` expects as ``chat_history``."""
+        messages: List[BaseMessage] = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of earlier conversation: {self.summary}"))
+        for question, answer in self.turns:
+            messages.append(HumanMessage(content=question))
+            messages.append(AIMessage(content=answer))
+        return messages
+
+    def tokens(self) -> int:
+        return count_tokens(self.summary) + sum(count_tokens(q) + count_tokens(a) for q, a in self.turns)
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append((question, answer))
+        evicted = []
+        # The newest turn always stays, even if it alone exceeds the budget
+        while len(self.turns) > 1 and self.tokens() > self.max_tokens:
+            evicted.append(self.turns.pop(0))
+        if evicted and self.summarize and self.llm is not None:
+            self._fold_into_summary(evicted)
+
+    def _fold_into_summary(self, turns: List[Tuple[str, str]]):
+        lines = "\n".join(f"Human: {q}\nAssistant: {a}" for q, a in turns)
+        try:
+            response = self.llm.invoke(SUMMARY_PROMPT.format(summary=self.summary or "(none)", lines=lines))
+            self.summary = getattr(response, "content", str(response)).strip()
+        except Exception as e:
+            print(f"Could not summarize earlier turns, dropping them: {e}")
+        # A summary that outgrows half the budget is cut to its most recent part
+        limit = self.max_tokens // 2 * CHARS_PER_TOKEN
+        if len(self.summary) > limit:
+            self.summary = self.summary[-limit:]
+
+    def clear(self):
+        self.summary = ""
+        self.turns = []
+
+
+class PromptTokenCounter(BaseCallbackHandler):
+    """Records the prompt size of every LLM call made while answering one question.
+
+    Uses the provider's reported input tokens when available and the local
+    estimate otherwise. Pass it as ``chain(inputs, callbacks=[counter])``.
+    """
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+
+    def on_llm_start(self, serialized, prompts: List[str], **kwargs):
+        self.calls.append({"prompt_tokens": sum(count_tokens(p) for p in prompts), "exact": False})
+
+    def on_chat_model_start(self, serialized, messages: List[List[BaseMessage]], **kwargs):
+        text = "".join(str(m.content) for batch in messages for m in batch)
+        self.calls.append({"prompt_tokens": count_tokens(text), "exact": False})
+
+    def on_llm_end(self, response, **kwargs):
+        if not self.calls:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage and usage.get("input_tokens"):
+                    self.calls[-1] = {"prompt_tokens": usage["input_tokens"], "exact": True}
+                    return
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call["prompt_tokens"] for call in self.calls)
@@ -0,0 +1,256 @@
+"""Exact and near-duplicate chunk elimination between chunking and embedding.
+
+Banking documents repeat disclaimers, headers, footers and boilerplate
+clauses on every page and across versions. ``Deduplicator.filter`` passes
+through the first copy of each text (the representative) and drops later
+copies, so they are never embedded or stored:
+
+- Exact duplicates: same text after lowercasing and whitespace collapsing.
+- Near duplicates (PDF and DOCX only): MinHash signatures over word 5-gram
+  shingles, bucketed with LSH. A candidate counts only if its estimated
+  Jaccard similarity reaches ``threshold`` and it contains exactly the same
+  numbers, so two versions of a rate table are never merged.
+
+Excel rows are only deduplicated exactly; similar rows usually hold different data.
+Only the ID, source and location of a representative are kept, never the
+chunk itself. ``save``/``load`` carry the digests and signatures over to the
+next run, so a new version of a document is compared with the chunks already
+indexed. Dropped copies are reported in ``duplicates``; the manifest turns
+them into ``duplicates``/``locations`` metadata on the representative.
+"""
+
+import hashlib
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+
+import metrics
+
+# Off by default: a dropped copy is invisible to source/page filters (see docs/chunking-strategy.md)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "0") == "1"
+# Estimated Jaccard similarity of shingle sets above which chunks are merged
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.95"))
+NUM_PERM = 128
+SHINGLE_WORDS = 5
+NEAR_DUPLICATE_TYPES = ("pdf", "docx")
+# Locations listed in a representative's metadata (the count is always exact)
+MAX_LOCATIONS = 50
+
+_MASK_64 = (1 << 64) - 1
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """CRC32 hashes of the word ``size``-grams of normalized ``text``."""
+    words = normalize(text).split()
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve midpoint is the highest one not above ``threshold``.
+
+    Erring low costs only extra candidate checks; erring high would miss duplicates.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+def location(metadata: Dict[str, Any]) -> str:
+    """Short human-readable position of a chunk, e.g. ``policy.pdf p.3``."""
+    parts = [os.path.basename(str(metadata.get("source", "")))]
+    if "page" in metadata:
+        parts.append(f"p.{metadata['page']}")
+    if "element" in metadata:
+        parts.append(f"el.{metadata['element']}")
+    if "sheet" in metadata:
+        parts.append(f"{metadata['sheet']}!{metadata.get('row', '')}")
+    return " ".join(parts)
+
+
+class MinHasher:
+    """MinHash signatures with multiply-shift hashing over uint64 (wrap-around is intended)."""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MASK_64, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, _MASK_64, size=num_perm, dtype=np.uint64, endpoint=True)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        with np.errstate(over="ignore"):
+            values = hashes[:, None] * self.a[None, :] + self.b[None, :]
+        return (values >> np.uint64(32)).astype(np.uint32).min(axis=0)
+
+
+def duplicate_metadata(rep_location: str, locations: List[str]) -> Dict[str, Any]:
+    """``duplicates`` count and ``locations`` listing for a representative."""
+    everywhere = ([rep_location] if rep_location else []) + sorted(locations)
+    listed = "; ".join(everywhere[:MAX_LOCATIONS])
+    if len(everywhere) > MAX_LOCATIONS:
+        listed += f"; +{len(everywhere) - MAX_LOCATIONS} more"
+    return {"duplicates": len(locations), "locations": listed}
+
+
+class Deduplicator:
+    """Streaming duplicate filter for index runs (see the module docstring)."""
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = NUM_PERM,
+                 near_types: Iterable[str] = NEAR_DUPLICATE_TYPES):
+        self.threshold = threshold
+        self.near_types = set(near_types)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self._hasher = MinHasher(self.bands * self.rows)
+        # Representatives as (chunk ID, source, location); indices below refer to this list
+        self._reps: List[Tuple[str, str, str]] = []
+        # Representatives before this index come from earlier runs (see ``load``)
+        self._loaded = 0
+        self._exact: Dict[bytes, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self._signatures: List[np.ndarray] = []
+        # Row of ``_signatures`` -> (representative, numbers in its text)
+        self._near_reps: List[Tuple[int, str]] = []
+        # duplicate chunk ID -> (representative ID, duplicate's source, its location, representative's location)
+        self.duplicates: Dict[str, Tuple[str, str, str, str]] = {}
+        self.counts = {"chunks_in": 0, "unique": 0, "exact_duplicates": 0, "near_duplicates": 0, "chars_saved": 0}
+        self._seconds = 0.0
+
+    def filter(self, chunks: Iterable[Mapping[str, Any]]) -> Iterator[Mapping[str, Any]]:
+        """Yield the first copy of every chunk; later copies are recorded and dropped."""
+        for chunk in chunks:
+            if not isinstance(chunk, Mapping) or "metadata" not in chunk or not str(chunk.get("text", "")).strip():
+                # Left for the pipeline's validation to report and skip
+                yield chunk
+                continue
+            metadata = chunk["metadata"]
+            start = time.perf_counter()
+            representative, kind = self._match(chunk, metadata)
+            self._seconds += time.perf_counter() - start
+            self.counts["chunks_in"] += 1
+            if representative is None:
+                self.counts["unique"] += 1
+                yield chunk
+                continue
+            self.counts[kind] += 1
+            self.counts["chars_saved"] += len(chunk["text"])
+            rep_id, _, rep_location = self._reps[representative]
+            if chunk.get("id"):
+                self.duplicates[chunk["id"]] = (rep_id, str(metadata.get("source", "")), location(metadata),
+                                                rep_location)
+        self._record_metrics()
+
+    def _usable(self, rep: int, source: str) -> bool:
+        # A file being re-indexed may no longer contain the copy an earlier run kept
+        return rep >= self._loaded or self._reps[rep][1] != source
+
+    def _match(self, chunk: Mapping[str, Any], metadata: Dict[str, Any]) -> Tuple[Optional[int], str]:
+        text = normalize(chunk["text"])
+        source = str(metadata.get("source", ""))
+        digest = hashlib.sha256(text.encode("utf-8")).digest()[:16]
+        if digest in self._exact and self._usable(self._exact[digest], source):
+            return self._exact[digest], "exact_duplicates"
+        rep = len(self._reps)
+        self._reps.append((chunk.get("id", ""), source, location(metadata)))
+        self._exact[digest] = rep
+        if metadata.get("document_type") not in self.near_types:
+            return None, ""
+        numbers = " ".join(_NUMBER.findall(text))
+        signature = self._hasher.signature(shingles(text))
+        keys = [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+        candidates = {row for band, key in zip(self._buckets, keys) for row in band.get(key, ())}
+        for row in sorted(candidates):
+            representative, rep_numbers = self._near_reps[row]
+            if rep_numbers == numbers and self._usable(representative, source) \
+                    and np.mean(self._signatures[row] == signature) >= self.threshold:
+                # Exact copies of this text now resolve straight to the representative
+                self._reps.pop()
+                self._exact[digest] = representative
+                return representative, "near_duplicates"
+        self._add_near(rep, numbers, signature, keys)
+        return None, ""
+
+    def _add_near(self, rep: int, numbers: str, signature: np.ndarray, keys: List[bytes]):
+        row = len(self._signatures)
+        self._signatures.append(signature)
+        self._near_reps.append((rep, numbers))
+        for band, key in zip(self._buckets, keys):
+            band.setdefault(key, []).append(row)
+
+    # --- persistence across runs ------------------------------------------
+
+    def save(self, path: str):
+        """Write the representatives' digests and signatures for the next run to ``load``."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        digests = list(self._exact)
+        signatures = np.stack(self._signatures) if self._signatures \
+            else np.zeros((0, self.bands * self.rows), dtype=np.uint32)
+        # np.savez appends ".npz" to names without it, so write to "<tmp>.npz"
+        np.savez_compressed(
+            path + ".tmp.npz",
+            rep_ids=np.array([rep[0] for rep in self._reps], dtype=str),
+            rep_sources=np.array([rep[1] for rep in self._reps], dtype=str),
+            rep_locations=np.array([rep[2] for rep in self._reps], dtype=str),
+            digests=np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(len(digests), 16),
+            digest_reps=np.array([self._exact[d] for d in digests], dtype=np.int64),
+            near_reps=np.array([rep for rep, _ in self._near_reps], dtype=np.int64),
+            near_numbers=np.array([numbers for _, numbers in self._near_reps], dtype=str),
+            signatures=signatures,
+            lsh=np.array([self.bands, self.rows]),
+        )
+        os.replace(path + ".tmp.npz", path)
+
+    def load(self, path: str, live: Set[str]):
+        """Compare this run's chunks with the representatives of earlier runs still in ``live``."""
+        if not os.path.exists(path):
+            return
+        data = np.load(path)
+        remap: Dict[int, int] = {}
+        for old, rep in enumerate(zip(data["rep_ids"].tolist(), data["rep_sources"].tolist(),
+                                      data["rep_locations"].tolist())):
+            if rep[0] in live:
+                remap[old] = len(self._reps)
+                self._reps.append(rep)
+        self._loaded = len(self._reps)
+        for digest, old in zip(data["digests"], data["digest_reps"].tolist()):
+            if old in remap:
+                self._exact[digest.tobytes()] = remap[old]
+        if tuple(data["lsh"].tolist()) != (self.bands, self.rows):
+            # Signatures from another threshold/permutation count: exact matching only
+            return
+        for old, numbers, signature in zip(data["near_reps"].tolist(), data["near_numbers"].tolist(),
+                                           data["signatures"]):
+            if old in remap:
+                keys = [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+                self._add_near(remap[old], numbers, signature, keys)
+
+    def report(self) -> Dict[str, Any]:
+        saved = self.counts["exact_duplicates"] + self.counts["near_duplicates"]
+        return {**self.counts, "embeddings_saved": saved,
+                "saved_ratio": saved / self.counts["chunks_in"] if self.counts["chunks_in"] else 0.0,
+                "seconds": self._seconds}
+
+    def _record_metrics(self):
+        metrics.incr("dedup_chunks", self.counts["exact_duplicates"], kind="exact")
+        metrics.incr("dedup_chunks", self.counts["near_duplicates"], kind="near")
+        metrics.incr("dedup_chunks", self.counts["unique"], kind="unique")
+        metrics.observe("latency_seconds", self._seconds, stage="dedup")
+        report = self.report()
+        print(f"Dedup: {report['chunks_in']} chunks -> {report['unique']} unique "
+              f"({report['exact_duplicates']} exact, {report['near_duplicates']} near duplicates; "
+              f"{report['embeddings_saved']} embeddings and {report['chars_saved']} characters saved)")
@@ -0,0 +1,215 @@
+"""Two-stage retrieval: over-fetch, diversify with MMR, merge neighbours, pack a token budget.
+
+Adjacent chunks overlap by ``CHUNK_OVERLAP`` characters, so a plain top-k
+often spends every slot on near-identical text. ``DiverseRetriever`` instead:
+
+1. takes ``fetch_k`` candidates from a base retriever (vector or hybrid);
+2. ranks them with maximal marginal relevance over their embeddings. For a
+   ``LocalVectorStore`` (also behind a hybrid retriever) these are the stored
+   rows; for remote stores they go through ``embed_texts``, a cache read for
+   chunks indexed on this machine and a local model pass otherwise. Relevance
+   and pairwise similarities come from two matrix products and each greedy
+   step is one vectorized update;
+3. walks that ranking, merging each chunk with already-chosen neighbours
+   from the same page/element/sheet (dropping the overlapping text) and
+   adding it only while the context stays within ``max_tokens``.
+
+The prompt therefore stays at a fixed size while covering more distinct content.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, PrivateAttr
+
+import metrics
+from conversation_memory import CHARS_PER_TOKEN, count_tokens
+from index_manifest import stored_number
+
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "20"))
+# 1.0 ranks by relevance only; lower values favour diversity
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1500"))
+# Longest chunk overlap looked for when merging neighbours (2 x the splitter overlap)
+MAX_OVERLAP_CHARS = 400
+_MIN_OVERLAP_CHARS = 20
+
+
+def mmr_order(query: np.ndarray, candidates: np.ndarray, lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """All candidate indices in maximal-marginal-relevance order."""
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    n = len(candidates)
+    chosen = np.zeros(n, dtype=bool)
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    order = []
+    for step in range(n):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * (redundancy if step else 0.0)
+        scores[chosen] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        chosen[best] = True
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return order
+
+
+def _unit(metadata: Dict[str, Any]) -> Tuple:
+    # Chunks that can be stitched together: same page (PDF), element (DOCX) or sheet (Excel)
+    return (metadata.get("source"), metadata.get("page"), metadata.get("element"), metadata.get("sheet"))
+
+
+def _position(metadata: Dict[str, Any]) -> Optional[int]:
+    position = stored_number(metadata.get("row") if "sheet" in metadata else metadata.get("chunk"))
+    return position if isinstance(position, int) and not isinstance(position, bool) else None
+
+
+def _stored_vectors(retriever: BaseRetriever, docs: List[Document]) -> Optional[np.ndarray]:
+    # Vectors of the candidates as stored, when the underlying store can return them by ID
+    retriever = getattr(retriever, "vector_retriever", retriever)
+    vectorstore = getattr(retriever, "vectorstore", None)
+    if not hasattr(vectorstore, "vectors_by_id") or not all(doc.id for doc in docs):
+        return None
+    return vectorstore.vectors_by_id([doc.id for doc in docs])
+
+
+def join_overlapping(first: str, second: str) -> str:
+    """Concatenate two consecutive chunks, keeping their shared overlap once."""
+    tail = first[-MAX_OVERLAP_CHARS:]
+    probe = second[:_MIN_OVERLAP_CHARS]
+    start = tail.find(probe) if len(probe) == _MIN_OVERLAP_CHARS else -1
+    while start != -1:
+        if second.startswith(tail[start:]):
+            return first + second[len(tail) - start:]
+        start = tail.find(probe, start + 1)
+    return f"{first}\n{second}"
+
+
+class _Group:
+    """Consecutive chunks of one unit, kept sorted by position."""
+
+    def __init__(self, doc: Document, rank: int):
+        self.docs = [doc]
+        self.rank = rank
+        self.text = doc.page_content
+
+    def first(self) -> Optional[int]:
+        return _position(self.docs[0].metadata)
+
+    def last(self) -> Optional[int]:
+        return _position(self.docs[-1].metadata)
+
+    def joined(self, doc: Document) -> Optional[str]:
+        """Merged text if ``doc`` directly precedes or follows this group, else None."""
+        position = _position(doc.metadata)
+        if position is None:
+            return None
+        if self.last() is not None and position == self.last() + 1:
+            return join_overlapping(self.text, doc.page_content)
+        if self.first() is not None and position == self.first() - 1:
+            return join_overlapping(doc.page_content, self.text)
+        return None
+
+    def add(self, doc: Document, text: str):
+        if _position(doc.metadata) < self.first():
+            self.docs.insert(0, doc)
+        else:
+            self.docs.append(doc)
+        self.text = text
+
+    def document(self) -> Document:
+        metadata = dict(self.docs[0].metadata)
+        if len(self.docs) > 1:
+            key = "row" if "sheet" in metadata else "chunk"
+            metadata[f"{key}_end"] = self.last()
+            metadata["merged_chunks"] = len(self.docs)
+        return Document(page_content=self.text, metadata=metadata)
+
+
+def pack_documents(ranked: List[Document], max_tokens: int = CONTEXT_TOKENS) -> List[Document]:
+    """Merge neighbouring chunks and keep, in rank order, what fits in ``max_tokens``.
+
+    A chunk that does not fit is skipped so a shorter, lower-ranked one can
+    still use the space. The top chunk is always kept, cut to the budget if needed.
+    """
+    groups: List[_Group] = []
+    used = 0
+    for rank, doc in enumerate(ranked):
+        unit = _unit(doc.metadata)
+        merged = None
+        for group in groups:
+            if _unit(group.docs[0].metadata) == unit:
+                text = group.joined(doc)
+                if text is not None:
+                    merged = (group, text)
+                    break
+        if merged is not None:
+            group, text = merged
+            cost = count_tokens(text) - count_tokens(group.text)
+            if used + cost <= max_tokens:
+                group.add(doc, text)
+                used += cost
+            continue
+        cost = count_tokens(doc.page_content)
+        if used + cost <= max_tokens:
+            groups.append(_Group(doc, rank))
+            used += cost
+        elif not groups:
+            cut = Document(page_content=doc.page_content[:max_tokens * CHARS_PER_TOKEN], metadata=dict(doc.metadata))
+            groups.append(_Group(cut, rank))
+            used = max_tokens
+    return [group.document() for group in sorted(groups, key=lambda g: g.rank)]
+
+
+class DiverseRetriever(BaseRetriever):
+    """Over-fetches from ``base``, reorders with MMR and packs a token budget (see module docstring)."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    base: BaseRetriever
+    lambda_mult: float = MMR_LAMBDA
+    max_tokens: int = CONTEXT_TOKENS
+    _local: threading.local = PrivateAttr(default_factory=threading.local)
+
+    @property
+    def last_timings(self) -> Dict[str, float]:
+        timings = dict(getattr(self.base, "last_timings", {}) or {})
+        timings.update(getattr(self._local, "timings", {}))
+        return timings
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        from embedding_utils import embed_texts
+
+        candidates = self.base.invoke(query, {"callbacks": run_manager.get_child()})
+        if not candidates:
+            return []
+        start = time.perf_counter()
+        # The query was embedded for the search just before: a cache read
+        stored = _stored_vectors(self.base, candidates)
+        if stored is None:
+            vectors = embed_texts([query] + [doc.page_content for doc in candidates])
+            query_vector, stored = vectors[0], vectors[1:]
+        else:
+            query_vector = embed_texts([query])[0]
+        ranked = [candidates[i] for i in mmr_order(query_vector, stored, self.lambda_mult)]
+        mmr_seconds = time.perf_counter() - start
+        packed = pack_documents(ranked, self.max_tokens)
+        pack_seconds = time.perf_counter() - start - mmr_seconds
+        self._local.timings = {"mmr_ms": mmr_seconds * 1000, "pack_ms": pack_seconds * 1000}
+        metrics.observe("latency_seconds", mmr_seconds, stage="retrieve_mmr")
+        metrics.observe("latency_seconds", pack_seconds, stage="retrieve_pack")
+        return packed
+
+
+def build_diverse_retriever(base: BaseRetriever, lambda_mult: float = MMR_LAMBDA,
+                            max_tokens: int = CONTEXT_TOKENS) -> DiverseRetriever:
+    """Wrap ``base``, which should already return ``MMR_FETCH_K`` candidates."""
+    return DiverseRetriever(base=base, lambda_mult=lambda_mult, max_tokens=max_tokens)
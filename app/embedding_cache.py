@@ -0,0 +1,331 @@
+"""Memory-mapped embedding cache.
+
+Vectors are stored in one append-only float32 matrix file (``vectors.f32``)
+with a parallel file of 16-byte keys (``keys.bin``): record ``i`` of the key
+file is the key of row ``i`` of the matrix, so the hash -> row index is
+rebuilt from a single sequential read on open. A small in-process LRU sits in
+front of the memory map for hot vectors (e.g. repeated queries).
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+
+KEY_BYTES = 16
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.bin"
+META_FILE = "meta.json"
+LOCK_FILE = "cache.lock"
+# Model that produced the legacy one-pickle-per-vector cache
+LEGACY_MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def content_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def cache_key(model_name: str, digest: bytes) -> bytes:
+    """Key for a text's sha256 digest under a given model.
+
+    The model name is part of the key, so switching models can never serve
+    vectors produced by another one.
+    """
+    return hashlib.sha256(model_name.encode("utf-8") + b"\0" + digest).digest()[:KEY_BYTES]
+
+
+class EmbeddingCache:
+    """Append-only, memory-mapped float32 vector store keyed by content hash.
+
+    Several processes (the Streamlit app, the ingest and batch CLIs) may share
+    one cache directory. Writes and compaction take an exclusive ``fcntl`` lock
+    on ``cache.lock`` and append at the row offset given by the key file's size
+    at that moment; reads take a shared lock. Under either lock a process first
+    picks up the rows others appended, or reloads its index if another process
+    compacted the files.
+    """
+
+    def __init__(self, cache_dir: str, max_rows: int = 1_000_000, lru_size: int = 4096):
+        self.cache_dir = cache_dir
+        self.max_rows = max_rows
+        self.lru_size = lru_size
+        self.dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        # Identity of the key file the index was read from; compaction replaces it
+        self._keys_inode: Optional[int] = None
+        self._mmap: Optional[np.memmap] = None
+        self._mapped_rows = 0
+        self._last_used = np.zeros(0, dtype=np.int64)
+        self._tick = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock_file = open(self._path(LOCK_FILE), "a+b")
+        with self._lock, self._file_lock(exclusive=True):
+            self._repair()
+            self._sync()
+
+    # --- paths and locking -----------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if fcntl is None:
+            # No advisory locks (Windows): only one process may use the directory
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    # --- loading ---------------------------------------------------------
+
+    def _read_dim(self):
+        meta_path = self._path(META_FILE)
+        if self.dim is None and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+    def _repair(self):
+        """Drop the tail a crash between the two appends left in one file (exclusive lock held)."""
+        self._read_dim()
+        if self.dim is None:
+            return
+        keys_path = self._path(KEYS_FILE)
+        vec_path = self._path(VECTORS_FILE)
+        key_rows = os.path.getsize(keys_path) // KEY_BYTES if os.path.exists(keys_path) else 0
+        vec_rows = os.path.getsize(vec_path) // (4 * self.dim) if os.path.exists(vec_path) else 0
+        rows = min(key_rows, vec_rows)
+        for path, row_bytes in ((keys_path, KEY_BYTES), (vec_path, 4 * self.dim)):
+            if os.path.exists(path) and os.path.getsize(path) != rows * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * row_bytes)
+
+    def _sync(self):
+        """Catch up with rows other processes appended or compacted (file lock held)."""
+        self._read_dim()
+        keys_path = self._path(KEYS_FILE)
+        if self.dim is None or not os.path.exists(keys_path):
+            return
+        with open(keys_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._keys_inode:
+                # First open, or another process compacted the cache: rebuild the index
+                self._keys_inode = stat.st_ino
+                self._index = {}
+                self._rows = 0
+                self._last_used = np.zeros(0, dtype=np.int64)
+                self._mmap = None
+            rows = stat.st_size // KEY_BYTES
+            if rows <= self._rows:
+                return
+            f.seek(self._rows * KEY_BYTES)
+            raw = f.read((rows - self._rows) * KEY_BYTES)
+        for i in range(rows - self._rows):
+            self._index[raw[i * KEY_BYTES:(i + 1) * KEY_BYTES]] = self._rows + i
+        self._last_used = np.concatenate([self._last_used, np.zeros(rows - self._rows, dtype=np.int64)])
+        self._rows = rows
+
+    def _ensure_dim(self, dim: int):
+        if self.dim is None:
+            self.dim = dim
+            with open(self._path(META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"dim": dim}, f)
+        elif self.dim != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match cache dimension {self.dim}")
+
+    def _matrix(self) -> np.memmap:
+        if self._mmap is None or self._mapped_rows != self._rows:
+            self._mmap = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r",
+                                   shape=(self._rows, self.dim))
+            self._mapped_rows = self._rows
+        return self._mmap
+
+    # --- public API ------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def get_many(self, keys: Sequence[bytes], out: np.ndarray) -> List[int]:
+        """Copy cached vectors for ``keys`` into ``out`` and return the rows that missed."""
+        misses = []
+        # Shared lock: no other process can compact the files while rows are read
+        with self._lock, self._file_lock(exclusive=False):
+            # Picks up rows other processes embedded since this one last looked
+            self._sync()
+            self._tick += 1
+            hit_rows = []
+            hit_positions = []
+            for pos, key in enumerate(keys):
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    out[pos] = vec
+                    row = self._index.get(key)
+                    if row is not None:
+                        self._last_used[row] = self._tick
+                    continue
+                row = self._index.get(key)
+                if row is None:
+                    misses.append(pos)
+                else:
+                    hit_positions.append(pos)
+                    hit_rows.append(row)
+            if hit_rows:
+                # One fancy-indexed read from the memory map for all hits
+                out[hit_positions] = self._matrix()[hit_rows]
+                self._last_used[hit_rows] = self._tick
+                for pos in hit_positions:
+                    self._remember(keys[pos], out[pos])
+        return misses
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray):
+        """Append vectors for keys that are not cached yet."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            self._ensure_dim(vectors.shape[1])
+            new_keys = []
+            new_rows = []
+            seen = set()
+            for key, row in zip(keys, range(len(vectors))):
+                if key in self._index or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(row)
+            if not new_keys:
+                return
+            if len(new_keys) > self.max_rows:
+                # Only the last max_rows fit; the rest would be evicted right away
+                new_keys = new_keys[len(new_keys) - self.max_rows:]
+                new_rows = new_rows[len(new_rows) - self.max_rows:]
+            if self._rows + len(new_keys) > self.max_rows:
+                self._evict(len(new_keys))
+            block = vectors[new_rows]
+            # Vectors first, keys second, each at the offset the key file gives:
+            # a partial write is cut off by the next writer or on reopen.
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.truncate(self._rows * 4 * self.dim)
+                f.write(block.tobytes())
+            with open(self._path(KEYS_FILE), "ab") as f:
+                f.truncate(self._rows * KEY_BYTES)
+                f.write(b"".join(new_keys))
+                if self._keys_inode is None:
+                    self._keys_inode = os.fstat(f.fileno()).st_ino
+            self._tick += 1
+            for i, key in enumerate(new_keys):
+                self._index[key] = self._rows + i
+                self._remember(key, block[i])
+            self._last_used = np.concatenate(
+                [self._last_used, np.full(len(new_keys), self._tick, dtype=np.int64)])
+            self._rows += len(new_keys)
+
+    def _remember(self, key: bytes, vec: np.ndarray):
+        if self.lru_size <= 0:
+            return
+        self._lru[key] = np.array(vec, dtype=np.float32, copy=True)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _evict(self, incoming: int):
+        """Compact the store, keeping the most recently used rows (exclusive lock held).
+
+        Keeps 90% of the cap (minus the incoming rows) so eviction amortizes
+        over many appends instead of rewriting the files on every insert.
+        """
+        keep_n = max(0, int(self.max_rows * 0.9) - incoming)
+        order = np.argsort(self._last_used, kind="stable")
+        keep = np.sort(order[len(order) - keep_n:]) if keep_n else np.zeros(0, dtype=np.int64)
+        keys_by_row = [None] * self._rows
+        for key, row in self._index.items():
+            keys_by_row[row] = key
+        kept_keys = [keys_by_row[row] for row in keep]
+        kept_vectors = np.array(self._matrix()[keep], dtype=np.float32) if len(keep) else \
+            np.zeros((0, self.dim), dtype=np.float32)
+        self._mmap = None
+        vec_tmp = self._path(VECTORS_FILE + ".tmp")
+        keys_tmp = self._path(KEYS_FILE + ".tmp")
+        with open(vec_tmp, "wb") as f:
+            f.write(kept_vectors.tobytes())
+        with open(keys_tmp, "wb") as f:
+            f.write(b"".join(kept_keys))
+        os.replace(vec_tmp, self._path(VECTORS_FILE))
+        os.replace(keys_tmp, self._path(KEYS_FILE))
+        self._keys_inode = os.stat(self._path(KEYS_FILE)).st_ino
+        self._index = {key: i for i, key in enumerate(kept_keys)}
+        self._last_used = self._last_used[keep]
+        self._rows = len(kept_keys)
+        self._lru = OrderedDict((k, v) for k, v in self._lru.items() if k in self._index)
+
+
+def migrate_pickle_cache(pickle_dir: str, cache: EmbeddingCache,
+                         model_name: str = LEGACY_MODEL_NAME, remove: bool = False) -> int:
+    """Import a legacy ``<sha256>.pkl``-per-vector directory into ``cache``.
+
+    The pickle file names are the sha256 of the chunk text, which is all that
+    is needed to derive the new model-scoped key. Returns the number of
+    vectors imported.
+    """
+    paths = sorted(glob.glob(os.path.join(pickle_dir, "*.pkl")))
+    imported = 0
+    batch_keys, batch_vecs, batch_paths = [], [], []
+
+    def flush():
+        nonlocal imported
+        if batch_keys:
+            cache.put_many(batch_keys, np.vstack(batch_vecs))
+            imported += len(batch_keys)
+            if remove:
+                for p in batch_paths:
+                    os.remove(p)
+            batch_keys.clear()
+            batch_vecs.clear()
+            batch_paths.clear()
+
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            digest = bytes.fromhex(name)
+            with open(path, "rb") as f:
+                vec = np.asarray(pickle.load(f), dtype=np.float32).reshape(1, -1)
+        except Exception as e:
+            print(f"Skipping legacy cache file {path}: {e}")
+            continue
+        batch_keys.append(cache_key(model_name, digest))
+        batch_vecs.append(vec)
+        batch_paths.append(path)
+        if len(batch_keys) >= 4096:
+            flush()
+    flush()
+    print(f"Migrated {imported} legacy embeddings from {pickle_dir}")
+    return imported
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate a pickle embedding cache to the memory-mapped store.")
+    parser.add_argument("pickle_dir")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--model", default=LEGACY_MODEL_NAME)
+    parser.add_argument("--remove", action="store_true", help="Delete pickle files after import")
+    args = parser.parse_args()
+    migrate_pickle_cache(args.pickle_dir, EmbeddingCache(args.cache_dir), args.model, args.remove)
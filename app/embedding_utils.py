@@ -1,41 +1,168 @@
-import hashlib
 import os
-import pickle
-from typing import List
-
-from sentence_transformers import SentenceTransformer
-
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
-EMBEDDING_CACHE_DIR = "embedding_cache"
-LOG_PATH = os.path.join(os.path.dirname(__file__), "..", "docs", "retrieval.md")
-
-os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
-
-model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-
-def _content_hash(text: str) -> str:
-    return hashlib.sha256(text.encode("utf-8")).hexdigest()
-
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    embeddings = []
-    cache_hits = 0
-    cache_misses = 0
-    for text in texts:
-        h = _content_hash(text)
-        cache_path = os.path.join(EMBEDDING_CACHE_DIR, f"{h}.pkl")
-        if os.path.exists(cache_path):
-            with open(cache_path, "rb") as f:
-                emb = pickle.load(f)
-            cache_hits += 1
-        else:
-            emb = model.encode([text], convert_to_tensor=False)[0]
-            with open(cache_path, "wb") as f:
-                pickle.dump(emb, f)
-            cache_misses += 1
-        embeddings.append(emb)
-    _log_embedding_run(len(texts), cache_hits, cache_misses)
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+import metrics
+from embedding_cache import EmbeddingCache, cache_key, content_digest
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# Anchored to the project root rather than the CWD the app happens to be started from
+EMBEDDING_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "embedding_cache"),
+)
+# CPU inference mode: "none" (fp32), "int8" (torch dynamic quantization) or "onnx"
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none").lower()
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "1000000"))
+EMBEDDING_LRU_SIZE = int(os.getenv("EMBEDDING_LRU_SIZE", "4096"))
+
+_lock = threading.Lock()
+_model = None
+_cache: Optional[EmbeddingCache] = None
+
+# Cold-start measurements, filled in as the model and first query run
+timings: Dict[str, Optional[float]] = {
+    "model_load_seconds": None,
+    "first_encode_seconds": None,
+}
+
+def _cache_namespace() -> str:
+    # Quantized models produce slightly different vectors, so they get their own keys
+    if EMBEDDING_QUANTIZATION == "none":
+        return EMBEDDING_MODEL_NAME
+    return f"{EMBEDDING_MODEL_NAME}@{EMBEDDING_QUANTIZATION}"
+
+def cache_dir() -> str:
+    """Return the cache directory of the configured model.
+
+    Each model (and quantization) gets its own store under
+    EMBEDDING_CACHE_DIR, so switching to a model with another dimension
+    starts an empty cache instead of failing on the old vectors' shape.
+    """
+    return os.path.join(EMBEDDING_CACHE_DIR, re.sub(r"[^\w.@-]+", "_", _cache_namespace()))
+
+def _load_model():
+    from sentence_transformers import SentenceTransformer
+
+    if EMBEDDING_QUANTIZATION == "onnx":
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx", device="cpu")
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if EMBEDDING_QUANTIZATION == "int8":
+        import torch
+
+        model = torch.quantization.quantize_dynamic(
+            model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif EMBEDDING_QUANTIZATION != "none":
+        raise ValueError(f"Unknown EMBEDDING_QUANTIZATION: {EMBEDDING_QUANTIZATION}")
+    return model
+
+def get_model():
+    """Return the shared SentenceTransformer, loading it on first use."""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                start = time.perf_counter()
+                _model = _load_model()
+                timings["model_load_seconds"] = time.perf_counter() - start
+    return _model
+
+def get_cache() -> EmbeddingCache:
+    """Return the shared embedding cache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    cache_dir(),
+                    max_rows=EMBEDDING_CACHE_MAX_ROWS,
+                    lru_size=EMBEDDING_LRU_SIZE,
+                )
+    return _cache
+
+def warm_up() -> Dict[str, Optional[float]]:
+    """Load the model and run one encode so the first real query is not slowed down."""
+    get_cache()
+    _encode_batched(["warm up"], 1)
+    return dict(timings)
+
+def _cache_key(text: str) -> bytes:
+    return cache_key(_cache_namespace(), content_digest(text))
+
+def _encode_batched(texts: List[str], batch_size: int) -> np.ndarray:
+    """Encode texts in length-bucketed batches and return rows in input order.
+
+    Sorting by length groups similarly sized texts into the same batch, so
+    each forward pass pads to a shorter maximum sequence length.
+    """
+    model = get_model()
+    start = time.perf_counter()
+    dim = model.get_sentence_embedding_dimension()
+    out = np.empty((len(texts), dim), dtype=np.float32)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for start_idx in range(0, len(order), batch_size):
+        idx = order[start_idx:start_idx + batch_size]
+        batch = model.encode(
+            [texts[i] for i in idx],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        out[idx] = batch
+    if timings["first_encode_seconds"] is None:
+        timings["first_encode_seconds"] = time.perf_counter() - start
+    return out
+
+def embed_texts(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+    """Embed texts, returning a contiguous float32 matrix of shape (len(texts), dim).
+
+    Cached vectors are read first; all cache misses are then encoded together
+    in batches of ``batch_size`` instead of one forward pass per text. The
+    model is only loaded if something actually misses the cache.
+    """
+    cache = get_cache()
+    dim = cache.dim or get_model().get_sentence_embedding_dimension()
+    embeddings = np.empty((len(texts), dim), dtype=np.float32)
+    keys = [_cache_key(text) for text in texts]
+    with metrics.timer("cache_lookup"):
+        miss_rows = cache.get_many(keys, embeddings)
+    metrics.incr("embedding_cache_hits", len(texts) - len(miss_rows))
+    metrics.incr("embedding_cache_misses", len(miss_rows))
+    if miss_rows:
+        with metrics.timer("embed"):
+            encoded = _encode_batched([texts[i] for i in miss_rows], batch_size)
+        embeddings[miss_rows] = encoded
+        cache.put_many([keys[i] for i in miss_rows], encoded)
     return embeddings
 
-def _log_embedding_run(num_texts, hits, misses):
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(f"\nEmbedding run: {num_texts} texts | Cache hits: {hits} | Cache misses: {misses}\n")
+class CustomEmbedding(Embeddings):
+    """LangChain embedding wrapper over embed_texts, shared by all vector stores."""
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # One .tolist() over the whole float32 matrix for vector store compatibility
+        return embed_texts(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return embed_texts([text])[0].tolist()
+
+if __name__ == "__main__":
+    # Cold-start report: python app/embedding_utils.py [query]
+    import sys
+
+    query = " ".join(sys.argv[1:]) or "What are the KYC limits for savings accounts?"
+    start = time.perf_counter()
+    embed_texts([query])
+    first_query = time.perf_counter() - start
+    start = time.perf_counter()
+    embed_texts([query + " (uncached)"])
+    second_query = time.perf_counter() - start
+    print(f"Quantization: {EMBEDDING_QUANTIZATION}")
+    print(f"Model load: {timings['model_load_seconds']}")
+    print(f"First query (cold): {first_query:.4f}s")
+    print(f"Next uncached query (warm model): {second_query:.4f}s")
@@ -0,0 +1,100 @@
+"""Hybrid lexical + semantic retrieval with reciprocal-rank fusion.
+
+The vector leg (any LangChain retriever) and the BM25 leg run concurrently;
+their rankings are fused with RRF, which needs no score calibration between
+cosine similarities and BM25 scores. Per-leg latency of the last query is
+kept in ``last_timings``, per thread, since one retriever is shared by every
+Streamlit session.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, PrivateAttr
+
+import metrics
+from bm25_index import BM25Index
+from index_manifest import chunk_id
+from metadata_filters import search_kwargs_for
+
+# Shared by all hybrid retrievers; each query needs one extra thread at most
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-retrieval")
+
+
+def _fusion_key(doc: Document) -> str:
+    # The ID the chunk was stored under (Pinecone, local index, BM25); Chroma
+    # returns none, so rebuild the same deterministic ID from text and metadata
+    return doc.id or chunk_id({"text": doc.page_content, "metadata": doc.metadata})
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """Fuse ranked lists: each document scores ``sum(1 / (rrf_k + rank))``."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _fusion_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """Runs a vector retriever and a BM25 index concurrently and fuses them with RRF."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_retriever: BaseRetriever
+    lexical: BM25Index
+    k: int = 4
+    # Candidates taken from each leg before fusion
+    fetch_k: int = 20
+    rrf_k: int = 60
+    # Pinecone-style metadata filter, applied inside both legs (see metadata_filters)
+    filter: Optional[Dict[str, Any]] = None
+    _local: threading.local = PrivateAttr(default_factory=threading.local)
+
+    @property
+    def last_timings(self) -> Dict[str, float]:
+        return getattr(self._local, "timings", {})
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        def timed(fn, *args):
+            start = time.perf_counter()
+            result = fn(*args)
+            return result, (time.perf_counter() - start) * 1000
+
+        lexical_future = _executor.submit(timed, self.lexical.similarity_search, query, self.fetch_k, self.filter)
+        vector_docs, vector_ms = timed(
+            self.vector_retriever.invoke, query, {"callbacks": run_manager.get_child()}
+        )
+        lexical_docs, lexical_ms = lexical_future.result()
+        start = time.perf_counter()
+        fused = reciprocal_rank_fusion([vector_docs, lexical_docs], self.k, self.rrf_k)
+        self._local.timings = {
+            "vector_ms": vector_ms,
+            "lexical_ms": lexical_ms,
+            "fusion_ms": (time.perf_counter() - start) * 1000,
+        }
+        for leg, ms in self._local.timings.items():
+            metrics.observe("latency_seconds", ms / 1000, stage=f"retrieve_{leg[:-3]}")
+        return fused
+
+
+def build_hybrid_retriever(vectorstore: Any, lexical: BM25Index, k: int = 4, fetch_k: int = 20,
+                           filter: Optional[Dict[str, Any]] = None) -> HybridRetriever:
+    """Hybrid retriever over ``vectorstore`` and the matching BM25 index."""
+    return HybridRetriever(
+        vector_retriever=vectorstore.as_retriever(search_kwargs=search_kwargs_for(vectorstore, fetch_k, filter)),
+        lexical=lexical,
+        k=k,
+        fetch_k=fetch_k,
+        filter=filter,
+    )
@@ -0,0 +1,319 @@
+"""Persisted manifest of indexed files and chunks for incremental re-indexing.
+
+Every chunk gets a deterministic ID derived from its source, its position in
+the source (page/element/sheet/row/chunk) and a hash of its text. The
+manifest remembers each file's fingerprint and the chunk IDs it produced, so
+an index run only parses changed files, only upserts chunks whose ID is new,
+and deletes IDs that a re-parsed file no longer produces. Files that were
+deleted from disk have all their chunks deleted and their entries dropped.
+
+Writers that acknowledge batches asynchronously record written IDs with
+``mark_written``; they go to a ``.progress`` file next to the manifest so a
+run interrupted before ``commit`` resumes without re-embedding them.
+
+Chunks dropped as duplicates (see ``dedup.py``) keep their ID in the
+manifest and map to the representative that was stored instead. On commit,
+representatives whose duplicates changed get their ``duplicates`` and
+``locations`` metadata rewritten from this mapping. If a representative is
+later deleted, the duplicate's file is marked for re-indexing.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+from dedup import duplicate_metadata
+
+MANIFEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "index_manifests")
+# Touched whenever an index run changes chunks, so other processes can drop stale state
+EPOCH_FILE = os.path.join(MANIFEST_DIR, "index.epoch")
+# Metadata fields that locate a chunk within its source document
+POSITION_KEYS = ("page", "element", "sheet", "row", "chunk")
+
+
+def stored_number(value: Any) -> Any:
+    """Undo the float conversion of metadata numbers by stores such as Pinecone."""
+    # Pinecone returns every number as a float: page 3 comes back as 3.0
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _position_value(value: Any) -> str:
+    return str(stored_number(value))
+
+
+def chunk_id(chunk: Mapping[str, Any]) -> str:
+    """Stable ID for a chunk: same source, position and text give the same ID."""
+    meta = chunk["metadata"]
+    position = "|".join(_position_value(meta.get(key, "")) for key in POSITION_KEYS)
+    text_hash = hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{meta.get('source', '')}|{position}|{text_hash}".encode("utf-8")).hexdigest()[:32]
+
+
+def index_epoch() -> int:
+    """Changes every time any index is modified (0 before the first change)."""
+    try:
+        return os.stat(EPOCH_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_epoch():
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    with open(EPOCH_FILE, "a"):
+        os.utime(EPOCH_FILE)
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IndexManifest:
+    """File fingerprints and chunk IDs for one vector index."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # duplicate chunk ID -> [representative ID, duplicate's source, its location, representative's location]
+        # (manifests written before locations were recorded hold only the first two)
+        self.duplicates: Dict[str, List[str]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.duplicates = data.get("duplicates", {})
+        # Sources touched by the current run -> (fingerprint, chunk IDs seen)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._seen: Dict[str, Set[str]] = {}
+        # Sources whose file was deleted; their entries are dropped on commit
+        self._removed: Set[str] = set()
+        # Set when failed sources changed ``files`` outside the seen/pending bookkeeping
+        self._dirty = False
+        # Representatives whose duplicates changed in this run -> their location
+        self._touched: Dict[str, str] = {}
+        # Chunk IDs acknowledged by the index during a run that has not been committed yet
+        self.progress_path = path + ".progress"
+        self._written: Set[str] = set()
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                self._written = {line.strip() for line in f if line.strip()}
+        self._progress_lock = threading.Lock()
+
+    @property
+    def dedup_path(self) -> str:
+        """Where ``dedup.Deduplicator`` keeps its state between runs of this index."""
+        return self.path + ".dedup.npz"
+
+    def indexed_ids(self) -> Set[str]:
+        """Chunk IDs of all committed sources, duplicates included."""
+        return {cid for entry in self.files.values() for cid in entry.get("chunk_ids", ())}
+
+    @classmethod
+    def for_index(cls, backend: str, index_name: str) -> "IndexManifest":
+        return cls(os.path.join(MANIFEST_DIR, f"{backend}-{index_name}.json"))
+
+    def changed_files(self, paths: Iterable[Path]) -> List[Path]:
+        """Return the paths whose content changed since they were last indexed.
+
+        Size and mtime are checked first; the file is only hashed when they
+        differ, so an unchanged corpus is skipped without reading it.
+        """
+        changed = []
+        for path in paths:
+            path = Path(path)
+            source = str(path)
+            stat = path.stat()
+            entry = self.files.get(source)
+            fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                continue
+            fingerprint["sha256"] = _file_sha256(path)
+            if entry and entry.get("sha256") == fingerprint["sha256"]:
+                # Touched but identical: remember the new mtime, nothing to index
+                entry.update(fingerprint)
+                self._pending.setdefault(source, {})
+                continue
+            self._pending[source] = fingerprint
+            self._seen.setdefault(source, set())
+            changed.append(path)
+        return changed
+
+    def mark_removed(self, paths: Iterable[Path]) -> List[str]:
+        """Mark indexed sources that are not in ``paths`` and no longer exist on disk.
+
+        Their chunks are deleted on commit, as if the file now produced none.
+        Sources missing from ``paths`` whose file still exists are left alone,
+        so indexing a subset of the corpus does not delete the rest.
+        """
+        given = {str(path) for path in paths}
+        removed = [source for source in self.files
+                   if source not in given and not os.path.exists(source)]
+        for source in removed:
+            self._pending.pop(source, None)
+            self._seen[source] = set()
+            self._removed.add(source)
+        return removed
+
+    def new_chunks(self, chunks: Iterable[Mapping[str, Any]],
+                   resumed: Optional[List[Mapping[str, Any]]] = None) -> Iterator[Mapping[str, Any]]:
+        """Assign each chunk its stable ``id`` and yield only those not yet indexed.
+
+        Chunks already written by an interrupted run are not yielded; they are
+        appended to ``resumed`` (if given) so e.g. the BM25 index can still add them.
+        """
+        indexed: Dict[str, Set[str]] = {}
+        for chunk in chunks:
+            if not isinstance(chunk, Mapping) or "metadata" not in chunk or not str(chunk.get("text", "")).strip():
+                # Left for the pipeline's validation to report and skip
+                yield chunk
+                continue
+            cid = chunk_id(chunk)
+            chunk["id"] = cid
+            source = str(chunk["metadata"].get("source", ""))
+            self._seen.setdefault(source, set()).add(cid)
+            if source not in indexed:
+                indexed[source] = set(self.files.get(source, {}).get("chunk_ids", ()))
+            if cid in indexed[source]:
+                continue
+            if cid in self._written:
+                if resumed is not None:
+                    resumed.append(chunk)
+                continue
+            yield chunk
+
+    def mark_written(self, ids: List[str]):
+        """Record chunk IDs the index has acknowledged (thread-safe)."""
+        with self._progress_lock:
+            os.makedirs(os.path.dirname(self.progress_path), exist_ok=True)
+            with open(self.progress_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{cid}\n" for cid in ids))
+            self._written.update(ids)
+
+    def add_duplicates(self, duplicates: Dict[str, Tuple[str, str, str, str]]):
+        """Record chunks that were not stored because a representative was.
+
+        ``duplicates`` maps each dropped chunk ID to (representative ID, source,
+        location, representative's location), as in ``Deduplicator.duplicates``.
+        """
+        for dup_id, (rep_id, source, where, rep_location) in duplicates.items():
+            self.duplicates[dup_id] = [rep_id, source, where, rep_location]
+            self._touched[rep_id] = rep_location
+
+    def mark_failed(self, source: str):
+        """Keep the previous chunks of ``source``, which failed to load in this run.
+
+        Chunks it produced before failing (e.g. from other PDF shards) may already
+        be in the index; they are recorded alongside the old ones and the file's
+        fingerprint is cleared, so the next run re-parses it and deletes whatever
+        that parse no longer produces.
+        """
+        self._pending.pop(source, None)
+        seen = self._seen.pop(source, set())
+        entry = self.files.get(source, {})
+        old = set(entry.get("chunk_ids", ()))
+        if seen - old:
+            self.files[source] = {**entry, "chunk_ids": sorted(old | seen),
+                                  "size": None, "mtime_ns": None, "sha256": None}
+            self._dirty = True
+
+    def commit(self, delete: Callable[[List[str]], None],
+               update_metadata: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None,
+               persist: Optional[Callable[[], None]] = None) -> Dict[str, int]:
+        """Delete stale chunks of the sources seen in this run and save the manifest.
+
+        Call only after the new chunks were written successfully. Representatives
+        whose duplicates changed are then passed to ``update_metadata``. If the
+        run changed the index, ``persist`` (e.g. saving a local store) runs before
+        the manifest is saved, so the manifest never lists chunks the store lost.
+        """
+        stale: List[str] = []
+        added = 0
+        for source, seen in self._seen.items():
+            entry = self.files.get(source, {})
+            old = set(entry.get("chunk_ids", ()))
+            stale.extend(old - seen)
+            added += len(seen - old)
+            if source in self._removed and not seen:
+                self.files.pop(source, None)
+                continue
+            entry = {**entry, **self._pending.get(source, {}), "chunk_ids": sorted(seen)}
+            self.files[source] = entry
+        orphaned = self._release_duplicates(set(stale))
+        if stale:
+            delete(stale)
+        updated = self._update_representatives(set(stale), update_metadata)
+        if persist is not None and (added or stale or updated or self._dirty):
+            persist()
+        if self._seen or self._pending or orphaned or self._dirty:
+            self.save()
+        with self._progress_lock:
+            if os.path.exists(self.progress_path):
+                os.remove(self.progress_path)
+            self._written = set()
+        self._pending = {}
+        self._seen = {}
+        self._removed = set()
+        self._dirty = False
+        print(f"Manifest: {added} new chunks, {len(stale)} stale chunks deleted")
+        return {"added": added, "deleted": len(stale)}
+
+    def _update_representatives(self, stale: Set[str],
+                                update_metadata: Optional[Callable[[Dict[str, Dict[str, Any]]], None]]) -> bool:
+        touched = {rep_id: where for rep_id, where in self._touched.items() if rep_id not in stale}
+        self._touched = {}
+        if not touched:
+            return False
+        if update_metadata is None:
+            print(f"Manifest: the writer cannot update metadata; {len(touched)} representatives "
+                  f"keep their old duplicate locations")
+            return False
+        locations: Dict[str, List[str]] = {rep_id: [] for rep_id in touched}
+        for entry in self.duplicates.values():
+            if entry[0] in locations:
+                locations[entry[0]].append(entry[2] if len(entry) > 2 else os.path.basename(entry[1]))
+                if len(entry) > 3 and not touched[entry[0]]:
+                    touched[entry[0]] = entry[3]
+        try:
+            update_metadata({rep_id: duplicate_metadata(where, locations[rep_id])
+                             for rep_id, where in touched.items()})
+        except Exception as e:
+            # The locations are informational; the index itself is consistent
+            print(f"Manifest: could not update duplicate locations: {e}")
+            return False
+        return True
+
+    def _release_duplicates(self, stale: Set[str]) -> int:
+        # A duplicate whose representative is gone has no vector left: forget its ID
+        # and the file fingerprint, so the next run re-parses the file and stores it
+        orphaned = 0
+        for dup_id, entry in list(self.duplicates.items()):
+            rep_id, source = entry[0], entry[1]
+            if dup_id in stale:
+                del self.duplicates[dup_id]
+                if rep_id not in stale:
+                    self._touched[rep_id] = entry[3] if len(entry) > 3 else self._touched.get(rep_id, "")
+            elif rep_id in stale:
+                del self.duplicates[dup_id]
+                entry = self.files.get(source)
+                if entry is not None and dup_id in entry.get("chunk_ids", ()):
+                    entry["chunk_ids"] = [cid for cid in entry["chunk_ids"] if cid != dup_id]
+                    entry.update(size=None, mtime_ns=None, sha256=None)
+                    orphaned += 1
+        if orphaned:
+            print(f"Manifest: {orphaned} duplicate chunks lost their representative; "
+                  f"their files will be re-indexed on the next run")
+        return orphaned
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "duplicates": self.duplicates}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,303 @@
+"""Streaming ingestion: parse -> chunk -> embed in batches -> upsert in batches.
+
+Each stage runs in its own thread and hands work to the next through a
+bounded queue, so a slow stage applies backpressure instead of letting
+chunks pile up in memory. The first batches are written to the vector store
+while later files are still being parsed. Batches travel as columnar
+``ChunkBatch`` objects; writers get zero-copy slices of them.
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+import answer_cache
+import metrics
+from chunk_batch import ChunkBatch
+from dedup import DEDUP_ENABLED, Deduplicator
+from embedding_utils import embed_texts
+from index_manifest import IndexManifest, bump_epoch
+from parallel_ingest import iter_files_parallel
+
+EMBED_BATCH_SIZE = 256
+UPSERT_BATCH_SIZE = 100
+QUEUE_SIZE = 4
+
+# writer(batch, vectors) persists one ChunkBatch and its embeddings (iterating the
+# batch yields dict-like chunk views). A writer that sends batches asynchronously
+# exposes ``close()``, which run_pipeline calls at the end to wait for outstanding
+# writes and raise any failure. A writer whose store can merge metadata into stored
+# chunks exposes ``update_metadata({chunk_id: fields})``, used for duplicate locations.
+# A writer whose store is saved explicitly (e.g. the local index) exposes ``persist()``;
+# it runs after the run's deletes and before the manifest is saved.
+Writer = Callable[[ChunkBatch, np.ndarray], None]
+
+_DONE = object()
+
+
+def simple_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the scalar metadata values vector stores accept."""
+    return {
+        key: value for key, value in metadata.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+
+
+def valid_chunks(chunks: Iterable[Any]) -> Iterator[Mapping[str, Any]]:
+    """Yield well-formed, non-empty chunk dicts (or views), skipping anything else."""
+    for i, chunk in enumerate(chunks):
+        if not (isinstance(chunk, Mapping) and 'text' in chunk and 'metadata' in chunk):
+            print(f"Skipping chunk {i}: invalid format (type: {type(chunk)})")
+            continue
+        if not chunk['text'] or not chunk['text'].strip():
+            print(f"Skipping chunk {i}: empty text content")
+            continue
+        yield chunk
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Stage(threading.Thread):
+    """Worker thread that forwards its failure to the pipeline instead of dying silently."""
+
+    def __init__(self, target, errors: List[BaseException], stop: threading.Event):
+        super().__init__(daemon=True)
+        self._target_fn = target
+        self._errors = errors
+        self._stop_event = stop
+
+    def run(self):
+        try:
+            self._target_fn()
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop_event.set()
+
+
+def _put(q: "queue.Queue", item, stop: threading.Event) -> bool:
+    # Blocking put that gives up once another stage has failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: "queue.Queue", stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(
+    chunks: Iterable[Mapping[str, Any]],
+    writer: Writer,
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    upsert_batch_size: int = UPSERT_BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+) -> Dict[str, Any]:
+    """Stream ``chunks`` through embedding into ``writer`` with bounded memory.
+
+    At most ``queue_size`` batches wait between any two stages, so peak
+    memory is independent of corpus size. ``embed`` defaults to
+    ``embed_texts``. Returns simple run statistics.
+    """
+    embed = embed or embed_texts
+    parsed: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    embedded: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    stats = {"chunks": 0, "batches": 0, "first_write_seconds": None}
+    start = time.perf_counter()
+
+    def parse_stage():
+        for batch in _batched(valid_chunks(chunks), embed_batch_size):
+            if not _put(parsed, ChunkBatch.from_chunks(batch), stop):
+                return
+        _put(parsed, _DONE, stop)
+
+    def embed_stage():
+        while True:
+            batch = _get(parsed, stop)
+            if batch is _DONE:
+                break
+            vectors = embed(batch.texts())
+            if not _put(embedded, (batch, vectors), stop):
+                return
+        _put(embedded, _DONE, stop)
+
+    stages = [_Stage(parse_stage, errors, stop), _Stage(embed_stage, errors, stop)]
+    for stage in stages:
+        stage.start()
+    try:
+        # Upsert stage runs on the calling thread
+        while True:
+            item = _get(embedded, stop)
+            if item is _DONE:
+                break
+            batch, vectors = item
+            for offset in range(0, len(batch), upsert_batch_size):
+                with metrics.timer("upsert"):
+                    writer(batch.slice(offset, offset + upsert_batch_size),
+                           vectors[offset:offset + upsert_batch_size])
+                stats["batches"] += 1
+                if stats["first_write_seconds"] is None:
+                    stats["first_write_seconds"] = time.perf_counter() - start
+            stats["chunks"] += len(batch)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for stage in stages:
+            stage.join()
+    if errors:
+        raise errors[0]
+    close = getattr(writer, "close", None)
+    if close is not None:
+        with metrics.timer("upsert_flush"):
+            close()
+    stats["seconds"] = time.perf_counter() - start
+    metrics.incr("chunks_indexed", stats["chunks"])
+    print(f"Pipeline indexed {stats['chunks']} chunks in {stats['batches']} batches "
+          f"({stats['seconds']:.1f}s, first write after {stats['first_write_seconds'] or 0:.1f}s)")
+    return stats
+
+
+def _commit(manifest: IndexManifest, writer: Writer, delete: Callable[[List[str]], None],
+            lexical) -> Dict[str, int]:
+    store_persist = getattr(writer, "persist", None)
+
+    def persist():
+        if store_persist is not None:
+            store_persist()
+        if lexical is not None:
+            lexical.save()
+    counts = manifest.commit(delete, getattr(writer, "update_metadata", None), persist)
+    if counts["added"] or counts["deleted"]:
+        # Cached answers and in-memory indexes elsewhere may now be stale
+        bump_epoch()
+        answer_cache.invalidate()
+    return counts
+
+
+def _add_resumed(resumed: List[Dict[str, Any]], lexical):
+    # Written to the vector store by an interrupted run, but the BM25 index was never saved
+    if resumed:
+        print(f"Resumed: {len(resumed)} chunks were already upserted by an interrupted run")
+        if lexical is not None:
+            lexical.add_chunks(resumed)
+
+
+def _index_deduplicated(chunks: Iterable[Dict[str, Any]], manifest: IndexManifest, writer: Writer,
+                        resumed: List[Dict[str, Any]], dedup: bool) -> Dict[str, Any]:
+    new = manifest.new_chunks(chunks, resumed)
+    if not dedup:
+        return run_pipeline(new, writer)
+    deduplicator = Deduplicator()
+    # Representatives of earlier runs that are still indexed; the commit drops any this run deletes
+    deduplicator.load(manifest.dedup_path, manifest.indexed_ids())
+    stats = run_pipeline(deduplicator.filter(new), writer)
+    deduplicator.save(manifest.dedup_path)
+    manifest.add_duplicates(deduplicator.duplicates)
+    stats["dedup"] = deduplicator.report()
+    return stats
+
+
+def _with_lexical(writer: Writer, delete: Callable[[List[str]], None], lexical):
+    # Mirror every vector store write/delete into the BM25 index
+    if lexical is None:
+        return writer, delete
+
+    def write(chunks, vectors):
+        writer(chunks, vectors)
+        lexical.add_chunks(chunks)
+    write.close = getattr(writer, "close", None)
+    write.persist = getattr(writer, "persist", None)
+    if hasattr(writer, "update_metadata"):
+        def update_metadata(updates):
+            writer.update_metadata(updates)
+            lexical.update_metadata(updates)
+        write.update_metadata = update_metadata
+
+    def remove(ids):
+        delete(ids)
+        lexical.delete(ids)
+    return write, remove
+
+
+def index_chunks(
+    chunks: Iterable[Dict[str, Any]],
+    manifest: IndexManifest,
+    writer: Writer,
+    delete: Callable[[List[str]], None],
+    lexical=None,
+    dedup: bool = DEDUP_ENABLED,
+) -> Dict[str, Any]:
+    """Incrementally index ``chunks``: upsert unseen chunk IDs, delete stale ones.
+
+    ``lexical`` is an optional ``BM25Index`` kept in sync with the vector store.
+    With ``dedup``, duplicate chunks are collapsed before embedding (see ``dedup.py``).
+    """
+    writer, delete = _with_lexical(writer, delete, lexical)
+    resumed: List[Dict[str, Any]] = []
+    stats = _index_deduplicated(chunks, manifest, writer, resumed, dedup)
+    _add_resumed(resumed, lexical)
+    stats.update(_commit(manifest, writer, delete, lexical))
+    return stats
+
+
+def index_files(
+    paths: Iterable[Path],
+    manifest: IndexManifest,
+    writer: Writer,
+    delete: Callable[[List[str]], None],
+    failures: Optional[List[Tuple[str, str]]] = None,
+    lexical=None,
+    dedup: bool = DEDUP_ENABLED,
+) -> Dict[str, Any]:
+    """Parse and index only the files that changed since the last run.
+
+    Unchanged files are skipped before parsing, so a no-op re-run makes no
+    writes to the vector store. Chunks of indexed files that were deleted from
+    disk are deleted too. Returns the pipeline stats plus manifest counts.
+    """
+    paths = list(paths)
+    changed = manifest.changed_files(paths)
+    removed = manifest.mark_removed(paths)
+    if removed:
+        print(f"{len(removed)} indexed files no longer exist; deleting their chunks.")
+    writer, delete = _with_lexical(writer, delete, lexical)
+    if not changed:
+        print("All files are up to date; nothing to index.")
+        return {"chunks": 0, "batches": 0, **_commit(manifest, writer, delete, lexical), "files": 0}
+    if failures is None:
+        failures = []
+    chunks = iter_files_parallel(changed, failures=failures)
+    resumed: List[Dict[str, Any]] = []
+    stats = _index_deduplicated(chunks, manifest, writer, resumed, dedup)
+    _add_resumed(resumed, lexical)
+    for source in {source for source, _ in failures}:
+        # Keep the previous chunks of files that failed to parse this time, and
+        # track any chunks they wrote before failing
+        manifest.mark_failed(source)
+    stats.update(_commit(manifest, writer, delete, lexical))
+    stats["files"] = len(changed)
+    return stats
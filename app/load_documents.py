@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 # LangChain text splitter for recursive chunking
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -21,10 +21,20 @@ except ImportError:
 
 # Unstructured for DOCX
 from unstructured.partition.docx import partition_docx
-# Pandas for Excel
+# Pandas for Excel (.xls) and vectorized row serialization; openpyxl streams .xlsx
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+
+import metrics
 
 DATA_DIR = Path("data")
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Rows read from a sheet per vectorized block
+EXCEL_BLOCK_ROWS = 5000
+# Rows packed (with the header line) into one Excel chunk; 1 keeps one chunk per row
+EXCEL_ROWS_PER_CHUNK = int(os.getenv("EXCEL_ROWS_PER_CHUNK", "1"))
 
 
 def normalize_text(text: str) -> str:
@@ -33,8 +43,8 @@ def normalize_text(text: str) -> str:
 
 # Initialize the recursive text splitter
 text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
     length_function=len,
     separators=["\n\n", "\n", ". ", " ", ""]
 )
@@ -45,75 +55,90 @@ def split_text_into_chunks(text: str, max_chunk_size: int = 1000, overlap: int =
         return []
     
     # Use LangChain's recursive splitter for better chunk quality
-    chunks = text_splitter.split_text(text)
+    with metrics.timer("chunk"):
+        chunks = text_splitter.split_text(text)
     
     # Filter out empty chunks
     return [chunk.strip() for chunk in chunks if chunk.strip()]
 
 
-def load_pdf(file_path: Path) -> List[Dict]:
-    """Load PDF using lightweight PyPDF2 approach to avoid memory issues."""
-    results = []
-    
+def iter_pdf(file_path: Path, page_range: Optional[Tuple[int, int]] = None,
+             raise_errors: bool = False) -> Iterator[Dict]:
+    """Yield PDF chunks page by page using lightweight PyPDF2.
+
+    ``page_range`` is a 0-based ``(start, end)`` slice of pages, used to shard
+    large PDFs across workers; page numbers in the metadata stay absolute.
+    ``raise_errors`` re-raises file-level failures instead of only printing them.
+    """
     # Use PyPDF2 for memory-efficient PDF reading (NO FALLBACK to avoid memory issues)
     if not PdfReader:
         print(f"PyPDF2 not available. Cannot process PDF: {file_path}")
-        return results
+        return
     
     try:
         print(f"Processing PDF with PyPDF2: {file_path}")
         reader = PdfReader(str(file_path))
         total_pages = len(reader.pages)
         print(f"PDF has {total_pages} pages")
+        start, end = page_range or (0, total_pages)
+        count = 0
         
-        for page_num, page in enumerate(reader.pages):
+        for page_num in range(start, min(end, total_pages)):
             try:
-                text = page.extract_text()
-                if text and text.strip():  # Only add non-empty pages
-                    print(f"Extracted text from page {page_num + 1} ({len(text)} characters)")
-                    # Split long pages into smaller chunks (max 1000 chars)
-                    chunks = split_text_into_chunks(text, max_chunk_size=1000)
-                    for chunk_idx, chunk in enumerate(chunks):
-                        if chunk.strip():  # Only add non-empty chunks
-                            results.append({
-                                "text": normalize_text(chunk),
-                                "metadata": {
-                                    "source": str(file_path),
-                                    "document_type": "pdf",
-                                    "page": page_num + 1,
-                                    "chunk": chunk_idx + 1,
-                                    "total_pages": total_pages,
-                                }
-                            })
-                else:
-                    print(f"Page {page_num + 1} is empty or has no extractable text")
-            except Exception as e:
-                print(f"Warning: Could not extract text from page {page_num + 1}: {e}")
+                text = reader.pages[page_num].extract_text()
+            except Exception:
+                metrics.incr("pages", document_type="pdf", status="failed")
                 continue
+            if text and text.strip():  # Only add non-empty pages
+                metrics.incr("pages", document_type="pdf", status="ok")
+                # Split long pages into smaller chunks (max 1000 chars)
+                chunks = split_text_into_chunks(text, max_chunk_size=1000)
+                for chunk_idx, chunk in enumerate(chunks):
+                    if chunk.strip():  # Only add non-empty chunks
+                        count += 1
+                        yield {
+                            "text": normalize_text(chunk),
+                            "metadata": {
+                                "source": str(file_path),
+                                "document_type": "pdf",
+                                "page": page_num + 1,
+                                "chunk": chunk_idx + 1,
+                                "total_pages": total_pages,
+                            }
+                        }
+            else:
+                metrics.incr("pages", document_type="pdf", status="empty")
         
-        print(f"Successfully processed PDF: {len(results)} chunks extracted")
-        return results
+        metrics.incr("chunks", count, document_type="pdf")
+        print(f"Successfully processed PDF: {count} chunks extracted")
         
     except Exception as e:
         print(f"PyPDF2 failed for {file_path}: {e}")
         print(f"Could not process PDF: {file_path}")
-        return []
+        if raise_errors:
+            raise
 
 
-def load_docx(file_path: Path) -> List[Dict]:
-    """Load DOCX using lightweight unstructured approach to avoid memory issues."""
+def load_pdf(file_path: Path) -> List[Dict]:
+    """Load PDF using lightweight PyPDF2 approach to avoid memory issues."""
+    return list(iter_pdf(file_path))
+
+
+def iter_docx(file_path: Path, raise_errors: bool = False) -> Iterator[Dict]:
+    """Yield DOCX chunks element by element using unstructured."""
     print(f"Processing DOCX with unstructured: {file_path}")
     try:
         # Use unstructured.partition.docx (lightweight approach)
         elements = partition_docx(filename=str(file_path))
-        results = []
+        count = 0
         for idx, el in enumerate(elements):
             if el.text and el.text.strip():
                 # Split long elements into smaller chunks
                 chunks = split_text_into_chunks(el.text, max_chunk_size=1000)
                 for chunk_idx, chunk in enumerate(chunks):
                     if chunk.strip():
-                        results.append({
+                        count += 1
+                        yield {
                             "text": normalize_text(chunk),
                             "metadata": {
                                 "source": str(file_path),
@@ -121,65 +146,195 @@ def load_docx(file_path: Path) -> List[Dict]:
                                 "element": idx + 1,
                                 "chunk": chunk_idx + 1,
                             }
-                        })
-        print(f"Successfully processed DOCX: {len(results)} chunks extracted")
-        return results
+                        }
+        metrics.incr("chunks", count, document_type="docx")
+        print(f"Successfully processed DOCX: {count} chunks extracted")
     except Exception as e:
         print(f"Failed to process DOCX {file_path}: {e}")
-        return []
+        if raise_errors:
+            raise
 
 
-def load_excel(file_path: Path) -> List[Dict]:
-    """Load Excel using lightweight pandas approach to avoid memory issues."""
-    print(f"Processing Excel with pandas: {file_path}")
+def load_docx(file_path: Path) -> List[Dict]:
+    """Load DOCX using lightweight unstructured approach to avoid memory issues."""
+    return list(iter_docx(file_path))
+
+
+def _iter_blocks(rows: Iterable[tuple], block_rows: int) -> Iterator[pd.DataFrame]:
+    block = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= block_rows:
+            yield pd.DataFrame.from_records(block)
+            block = []
+    if block:
+        yield pd.DataFrame.from_records(block)
+
+
+def _iter_sheets(file_path: Path, block_rows: int):
+    """Yield ``(sheet, header, blocks)`` with the data rows of each sheet in blocks.
+
+    .xlsx workbooks are streamed with openpyxl's read-only mode, so only one
+    block of rows is in memory at a time; legacy .xls files go through pandas.
+    """
+    if Path(file_path).suffix.lower() == ".xls":
+        workbook = pd.ExcelFile(file_path)
+        for sheet in workbook.sheet_names:
+            df = workbook.parse(sheet, header=None)
+            if df.empty:
+                continue
+            rows = df.itertuples(index=False, name=None)
+            yield sheet, next(rows), _iter_blocks(rows, block_rows)
+        return
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for ws in workbook.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            yield ws.title, header, _iter_blocks(rows, block_rows)
+    finally:
+        workbook.close()
+
+
+def _rows_to_text(block: pd.DataFrame) -> pd.Series:
+    """Serialize every row of ``block`` to ``'a | b | c'`` with column-wise array ops.
+
+    Empty cells are skipped, matching the per-row join this replaces; the
+    result is whitespace-normalized.
+    """
+    values = block.to_numpy(dtype=object)
+    present = pd.notna(values)
+    texts = np.full(len(values), "", dtype=object)
+    started = np.zeros(len(values), dtype=bool)
+    for j in range(values.shape[1]):
+        column = present[:, j]
+        if not column.any():
+            continue
+        cells = np.where(column, values[:, j].astype(str), "")
+        texts = texts + np.where(started & column, " | ", "") + cells
+        started |= column
+    return pd.Series(texts, dtype=object)
+
+
+def iter_excel(file_path: Path, raise_errors: bool = False,
+               rows_per_chunk: int = EXCEL_ROWS_PER_CHUNK) -> Iterator[Dict]:
+    """Yield Excel chunks by streaming each sheet in blocks of rows.
+
+    Rows shorter than ``CHUNK_SIZE`` become chunks directly without going
+    through the text splitter. With ``rows_per_chunk > 1`` consecutive rows
+    are packed under the sheet's header line into one chunk, whose metadata
+    records the first ``row`` and the last ``row_end``.
+    """
+    print(f"Processing Excel: {file_path}")
     try:
-        # Use pandas for Excel (lightweight approach)
-        dfs = pd.read_excel(file_path, sheet_name=None)
-        results = []
-        for sheet, df in dfs.items():
-            print(f"Processing sheet '{sheet}' with {len(df)} rows")
-            for idx, row in df.iterrows():
-                row_text = ' | '.join(str(cell) for cell in row.values if pd.notna(cell))
-                if row_text.strip():
-                    # Split long rows into smaller chunks if needed
-                    chunks = split_text_into_chunks(row_text, max_chunk_size=1000)
-                    for chunk_idx, chunk in enumerate(chunks):
-                        if chunk.strip():
-                            results.append({
+        count = 0
+        for sheet, header, blocks in _iter_sheets(file_path, EXCEL_BLOCK_ROWS):
+            metrics.incr("sheets", document_type="excel")
+            header_text = normalize_text(' | '.join(str(cell) for cell in header if pd.notna(cell)))
+            base_metadata = {
+                "source": str(file_path),
+                "document_type": "excel",
+                "sheet": sheet,
+            }
+            group = []
+
+            def flush_group():
+                text = "\n".join([header_text] + [t for _, t in group]) if header_text else \
+                    "\n".join(t for _, t in group)
+                chunk = {
+                    "text": text,
+                    "metadata": {**base_metadata, "row": group[0][0], "row_end": group[-1][0], "chunk": 1},
+                }
+                group.clear()
+                return chunk
+
+            first_row = 1
+            for block in blocks:
+                raw = _rows_to_text(block)
+                lengths = raw.str.len().to_numpy()
+                texts = raw.str.replace(r"\s+", " ", regex=True).str.strip().to_numpy()
+                for offset in np.flatnonzero(texts != ""):
+                    row_number = first_row + int(offset)
+                    text = texts[offset]
+                    if lengths[offset] > CHUNK_SIZE:
+                        # Long rows still go through the splitter
+                        if group:
+                            count += 1
+                            yield flush_group()
+                        chunks = split_text_into_chunks(raw[offset], max_chunk_size=CHUNK_SIZE)
+                        for chunk_idx, chunk in enumerate(chunks):
+                            count += 1
+                            yield {
                                 "text": normalize_text(chunk),
-                                "metadata": {
-                                    "source": str(file_path),
-                                    "document_type": "excel",
-                                    "sheet": sheet,
-                                    "row": idx + 1,
-                                    "chunk": chunk_idx + 1,
-                                }
-                            })
-        print(f"Successfully processed Excel: {len(results)} chunks extracted")
-        return results
+                                "metadata": {**base_metadata, "row": row_number, "chunk": chunk_idx + 1},
+                            }
+                    elif rows_per_chunk <= 1:
+                        count += 1
+                        yield {
+                            "text": text,
+                            "metadata": {**base_metadata, "row": row_number, "chunk": 1},
+                        }
+                    else:
+                        group_len = len(header_text) + sum(len(t) + 1 for _, t in group)
+                        if group and (len(group) >= rows_per_chunk or group_len + len(text) + 1 > CHUNK_SIZE):
+                            count += 1
+                            yield flush_group()
+                        group.append((row_number, text))
+                first_row += len(block)
+            if group:
+                count += 1
+                yield flush_group()
+        metrics.incr("chunks", count, document_type="excel")
+        print(f"Successfully processed Excel: {count} chunks extracted")
     except Exception as e:
         print(f"Failed to process Excel {file_path}: {e}")
-        return []
+        if raise_errors:
+            raise
+
+
+def load_excel(file_path: Path) -> List[Dict]:
+    """Load Excel with streaming, vectorized row serialization."""
+    return list(iter_excel(file_path))
+
+
+# Suffix -> streaming loader
+LOADERS = {
+    ".pdf": iter_pdf,
+    ".docx": iter_docx,
+    ".xls": iter_excel,
+    ".xlsx": iter_excel,
+}
+
+
+def iter_files(paths: Iterable[Path]) -> Iterator[Dict]:
+    """Stream chunks from every supported file in ``paths``, one file at a time."""
+    for path in paths:
+        path = Path(path)
+        loader = LOADERS.get(path.suffix.lower())
+        if loader is None:
+            print(f"Skipping unsupported file: {path}")
+            continue
+        print(f"Loading {path.suffix.lower()[1:].upper()}: {path}")
+        yield from loader(path)
 
 
 def main():
-    all_chunks = []
-    for file in DATA_DIR.iterdir():
-        if file.suffix.lower() == ".pdf":
-            print(f"Loading PDF: {file}")
-            all_chunks.extend(load_pdf(file))
-        elif file.suffix.lower() == ".docx":
-            print(f"Loading DOCX: {file}")
-            all_chunks.extend(load_docx(file))
-        elif file.suffix.lower() in [".xls", ".xlsx"]:
-            print(f"Loading Excel: {file}")
-            all_chunks.extend(load_excel(file))
-    print(f"\nLoaded {len(all_chunks)} chunks.")
-    # Print a summary of the first 3 chunks
-    for chunk in all_chunks[:3]:
-        print("\n--- Chunk ---")
-        print(f"Text: {chunk['text'][:200]}...")
-        print(f"Metadata: {chunk['metadata']}")
+    from parallel_ingest import iter_files_parallel
+
+    count = 0
+    failures = []
+    for chunk in iter_files_parallel(sorted(DATA_DIR.iterdir()), failures=failures):
+        # Print a summary of the first 3 chunks without keeping the rest in memory
+        if count < 3:
+            print("\n--- Chunk ---")
+            print(f"Text: {chunk['text'][:200]}...")
+            print(f"Metadata: {chunk['metadata']}")
+        count += 1
+    print(f"\nLoaded {count} chunks.")
+    for path, error in failures:
+        print(f"Failed: {path}: {error}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
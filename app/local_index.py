@@ -0,0 +1,448 @@
+"""In-process NumPy vector index usable as a LangChain vector store.
+
+Vectors are L2-normalized float32 rows of one matrix, so cosine similarity
+for a query is a single BLAS matrix-vector product followed by
+``argpartition`` for the top k. For large corpora an optional IVF mode
+clusters the rows with k-means and only scores the ``nprobe`` nearest
+clusters. The index persists to a directory as a raw float32 matrix that is
+memory-mapped on load, plus a JSON-lines file of texts and metadata.
+"""
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from embedding_utils import CustomEmbedding
+from index_manifest import IndexManifest
+from metadata_filters import MetadataIndex
+from bm25_index import BM25Index
+from chunk_batch import ChunkBatch
+from ingest_pipeline import index_chunks, index_files as run_index_files, simple_metadata
+
+LOCAL_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local_index")
+DEFAULT_INDEX_NAME = "bank-kb"
+VECTORS_FILE = "vectors.f32"
+DOCS_FILE = "docs.jsonl"
+META_FILE = "meta.json"
+IVF_FILE = "ivf.npz"
+# "exact" or "ivf"; IVF clusters are trained on load and retrained as the index grows
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact").lower()
+# Clusters (0: sqrt of the row count) and clusters scored per query in IVF mode
+LOCAL_IVF_NLIST = int(os.getenv("LOCAL_IVF_NLIST", "0"))
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "8"))
+# Retrain when the row count drifted this far from the one the clusters were trained on
+IVF_RETRAIN_DRIFT = 0.2
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalVectorStore(VectorStore):
+    """Exact (or IVF-approximate) cosine search over an in-memory float32 matrix."""
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        persist_directory: Optional[str] = None,
+        mode: str = "exact",
+        nprobe: int = LOCAL_IVF_NPROBE,
+        nlist: int = LOCAL_IVF_NLIST,
+    ):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown LocalVectorStore mode: {mode}")
+        self._embedding = embedding
+        self.persist_directory = persist_directory
+        self.mode = mode
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self._matrix: Optional[np.ndarray] = None
+        self._n = 0
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_of: Dict[str, int] = {}
+        self._meta_index = MetadataIndex()
+        # IVF state: centroids, per-row cluster assignment, and cached posting lists
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._trained_rows = 0
+        if persist_directory and os.path.exists(os.path.join(persist_directory, META_FILE)):
+            self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return int(self._alive[:self._n].sum())
+
+    # --- writes ----------------------------------------------------------
+
+    def _reserve(self, extra: int, dim: int):
+        needed = self._n + extra
+        if self._matrix is not None and isinstance(self._matrix, np.ndarray) \
+                and not isinstance(self._matrix, np.memmap) and len(self._matrix) >= needed:
+            return
+        capacity = max(needed, 2 * (len(self._matrix) if self._matrix is not None else 0), 1024)
+        grown = np.empty((capacity, dim), dtype=np.float32)
+        if self._n:
+            grown[:self._n] = self._matrix[:self._n]
+        self._matrix = grown
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._n] = self._alive[:self._n]
+        self._alive = alive
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Add precomputed embeddings; an existing ID is replaced."""
+        vectors = _normalize(vectors)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        self.delete(ids)
+        self._reserve(len(texts), vectors.shape[1])
+        start = self._n
+        self._matrix[start:start + len(texts)] = vectors
+        self._alive[start:start + len(texts)] = True
+        for offset, (doc_id, text, meta) in enumerate(zip(ids, texts, metadatas)):
+            self._ids.append(doc_id)
+            self._texts.append(text)
+            self._metadatas.append(meta)
+            self._row_of[doc_id] = start + offset
+        self._meta_index.add(metadatas)
+        self._n += len(texts)
+        if self._centroids is not None:
+            self._assign = np.concatenate([self._assign, self._nearest_centroid(vectors)])
+            self._lists = None
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        vectors = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+        return self.add_embeddings(texts, vectors, metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        for doc_id in ids or ():
+            row = self._row_of.pop(doc_id, None)
+            if row is not None:
+                self._alive[row] = False
+        return True
+
+    def vectors_by_id(self, ids: List[str]) -> Optional[np.ndarray]:
+        """Stored (normalized) vectors for ``ids``, or None if any of them is not in the store."""
+        rows = [self._row_of.get(doc_id) for doc_id in ids]
+        if any(row is None for row in rows):
+            return None
+        return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]]):
+        """Merge fields into the metadata of stored chunks (chunk ID -> fields).
+
+        Updated in place, so only fields outside the metadata index (e.g. ``locations``) may change.
+        """
+        for doc_id, fields in updates.items():
+            row = self._row_of.get(doc_id)
+            if row is not None:
+                self._metadatas[row].update(fields)
+
+    # --- search ----------------------------------------------------------
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows to score in IVF mode, or None to scan the whole matrix."""
+        if self.mode != "ivf" or self._centroids is None:
+            return None
+        if self._lists is None:
+            order = np.argsort(self._assign, kind="stable")
+            offsets = np.searchsorted(self._assign[order], np.arange(len(self._centroids) + 1))
+            self._lists = (order, offsets)
+        order, offsets = self._lists
+        nprobe = min(self.nprobe, len(self._centroids))
+        probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+
+    def search_vector(
+        self, query: np.ndarray, k: int = 4, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """Top-k ``(row, cosine score)`` pairs for a query vector.
+
+        ``mask`` optionally restricts the search to rows where it is True.
+        """
+        if self._n == 0:
+            return []
+        query = _normalize(query)
+        allowed = self._alive[:self._n] if mask is None else self._alive[:self._n] & mask[:self._n]
+        rows = self._candidates(query)
+        if rows is not None:
+            rows = rows[allowed[rows]]
+            if mask is not None and len(rows) < k:
+                # The probed clusters hold too few matching rows; scan all of them instead
+                rows = None
+        if rows is None and mask is None:
+            # One BLAS matvec over the whole matrix
+            scores = np.asarray(self._matrix[:self._n] @ query)
+            scores[~allowed] = -np.inf
+            rows = np.arange(self._n)
+        else:
+            if rows is None:
+                # Pre-filtered: only matching rows are scored, so filters never cost extra
+                rows = np.flatnonzero(allowed)
+            scores = np.asarray(self._matrix[rows] @ query)
+        valid = int(np.isfinite(scores).sum())
+        k = min(k, valid)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def search_vectors(
+        self, queries: np.ndarray, k: int = 4, mask: Optional[np.ndarray] = None, block: int = 256
+    ) -> List[List[Tuple[int, float]]]:
+        """Top-k ``(row, cosine score)`` pairs for each row of a query matrix.
+
+        Unfiltered exact search scores ``block`` queries per matrix-matrix
+        product; IVF mode and filtered searches go query by query.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self._n == 0:
+            return [[] for _ in queries]
+        if mask is not None or (self.mode == "ivf" and self._centroids is not None):
+            return [self.search_vector(query, k, mask) for query in queries]
+        alive = self._alive[:self._n]
+        k = min(k, int(alive.sum()))
+        if k <= 0:
+            return [[] for _ in queries]
+        results = []
+        for start in range(0, len(queries), block):
+            scores = np.asarray(_normalize(queries[start:start + block]) @ self._matrix[:self._n].T)
+            scores[:, ~alive] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            results.extend([list(zip(rows, values)) for rows, values in zip(top.tolist(), top_scores.tolist())])
+        return results
+
+    def similarity_search_by_vectors(
+        self, embeddings: np.ndarray, k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Document]]:
+        """Batched ``similarity_search_by_vector``: one list of documents per query vector."""
+        hits = self.search_vectors(embeddings, k, self._meta_index.mask(filter))
+        return [[self._document(row) for row, _ in query_hits] for query_hits in hits]
+
+    def _document(self, row: int) -> Document:
+        return Document(id=self._ids[row], page_content=self._texts[row], metadata=dict(self._metadatas[row]))
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """``filter`` uses Pinecone-style syntax, see ``metadata_filters``."""
+        mask = self._meta_index.mask(filter)
+        hits = self.search_vector(np.asarray(embedding, dtype=np.float32), k, mask)
+        return [(self._document(row), score) for row, score in hits]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Scores are already cosine similarities; clip float error into [0, 1]
+        return lambda score: min(1.0, max(0.0, score))
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    # --- IVF -------------------------------------------------------------
+
+    def _nearest_centroid(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, seed: int = 0):
+        """Cluster the rows with spherical k-means and switch to IVF search."""
+        self.compact()
+        if self._n == 0:
+            return
+        data = self._matrix[:self._n]
+        nlist = min(nlist or self.nlist or max(1, int(np.sqrt(self._n))), self._n)
+        rng = np.random.default_rng(seed)
+        sample = data[rng.choice(self._n, min(self._n, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = counts > 0
+            centroids[nonempty] = _normalize(sums[nonempty])
+        self._centroids = centroids
+        # Assign every row in blocks to bound the temporary score matrix
+        self._assign = np.concatenate([
+            self._nearest_centroid(data[i:i + 65536]) for i in range(0, self._n, 65536)
+        ])
+        self._lists = None
+        self._trained_rows = self._n
+        self.mode = "ivf"
+
+    def _ivf_stale(self) -> bool:
+        if self._centroids is None or len(self._assign) != self._n:
+            return True
+        return abs(self._n - self._trained_rows) > IVF_RETRAIN_DRIFT * max(self._trained_rows, 1)
+
+    # --- persistence -----------------------------------------------------
+
+    def compact(self):
+        """Drop deleted rows."""
+        if self._n == 0 or self._alive[:self._n].all():
+            return
+        keep = np.flatnonzero(self._alive[:self._n])
+        self._matrix = np.array(self._matrix[keep], dtype=np.float32)
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        if self._centroids is not None:
+            self._assign = self._assign[keep]
+            self._lists = None
+        self._n = len(keep)
+        self._alive = np.ones(self._n, dtype=bool)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._meta_index = MetadataIndex()
+        self._meta_index.add(self._metadatas)
+
+    def save(self, persist_directory: Optional[str] = None):
+        directory = persist_directory or self.persist_directory
+        if not directory:
+            raise ValueError("No persist_directory set for LocalVectorStore")
+        os.makedirs(directory, exist_ok=True)
+        self.compact()
+        if self.mode == "ivf" and self._ivf_stale():
+            # Rows added since training only joined the nearest existing cluster
+            self.build_ivf()
+        dim = self._matrix.shape[1] if self._matrix is not None else 0
+        path = lambda name: os.path.join(directory, name)
+        with open(path(VECTORS_FILE + ".tmp"), "wb") as f:
+            if self._n:
+                f.write(np.ascontiguousarray(self._matrix[:self._n]).tobytes())
+        with open(path(DOCS_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            for doc_id, text, meta in zip(self._ids, self._texts, self._metadatas):
+                f.write(json.dumps({"id": doc_id, "text": text, "metadata": meta}) + "\n")
+        os.replace(path(VECTORS_FILE + ".tmp"), path(VECTORS_FILE))
+        os.replace(path(DOCS_FILE + ".tmp"), path(DOCS_FILE))
+        if self._centroids is not None:
+            np.savez(path(IVF_FILE), centroids=self._centroids, assign=self._assign,
+                     trained_rows=self._trained_rows)
+        elif os.path.exists(path(IVF_FILE)):
+            os.remove(path(IVF_FILE))
+        with open(path(META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "count": self._n, "mode": self.mode}, f)
+
+    def _load(self):
+        path = lambda name: os.path.join(self.persist_directory, name)
+        with open(path(META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self._n = meta["count"]
+        if self._n:
+            # Memory-mapped; copied into a growable buffer on the first write
+            self._matrix = np.memmap(path(VECTORS_FILE), dtype=np.float32, mode="r",
+                                     shape=(self._n, meta["dim"]))
+        with open(path(DOCS_FILE), "r", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                record = json.loads(line)
+                self._ids.append(record["id"])
+                self._texts.append(record["text"])
+                self._metadatas.append(record["metadata"])
+                self._row_of[record["id"]] = row
+        self._meta_index.add(self._metadatas)
+        self._alive = np.ones(self._n, dtype=bool)
+        if self.mode != "ivf":
+            return
+        if os.path.exists(path(IVF_FILE)):
+            ivf = np.load(path(IVF_FILE))
+            self._centroids = ivf["centroids"]
+            self._assign = ivf["assign"]
+            self._trained_rows = int(ivf["trained_rows"]) if "trained_rows" in ivf else len(self._assign)
+        if self._ivf_stale():
+            # Saved in exact mode, or by an older run: train the clusters now
+            self.build_ivf()
+
+
+def get_local_vectorstore(index_name: str = DEFAULT_INDEX_NAME, mode: str = LOCAL_INDEX_MODE) -> LocalVectorStore:
+    """Opens (or creates) the persisted local index ``index_name`` in ``mode`` ("exact" or "ivf")."""
+    return LocalVectorStore(CustomEmbedding(), persist_directory=os.path.join(LOCAL_INDEX_DIR, index_name),
+                            mode=mode)
+
+
+def make_local_writer(store: LocalVectorStore):
+    """Returns a pipeline writer adding precomputed embeddings to ``store``."""
+    def write(batch: ChunkBatch, vectors) -> None:
+        store.add_embeddings(
+            batch.texts(),
+            vectors,
+            [simple_metadata(meta) for meta in batch.metadatas()],
+            [cid or str(uuid.uuid4()) for cid in batch.ids],
+        )
+    write.update_metadata = store.update_metadata
+    # Saved before the manifest commits, so the manifest never lists rows lost in a crash
+    write.persist = store.save
+    return write
+
+
+def build_local_index(chunks: Iterable[Dict[str, Any]], index_name: str = DEFAULT_INDEX_NAME) -> LocalVectorStore:
+    """Incrementally streams chunks into the local index and persists it."""
+    store = get_local_vectorstore(index_name)
+    manifest = IndexManifest.for_index("local", index_name)
+    index_chunks(chunks, manifest, make_local_writer(store), store.delete,
+                 BM25Index.for_index("local", index_name))
+    return store
+
+
+def index_files(paths: Iterable[Path], index_name: str = DEFAULT_INDEX_NAME,
+                failures: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Any]:
+    """Parses and indexes only the files that changed since the last run."""
+    store = get_local_vectorstore(index_name)
+    manifest = IndexManifest.for_index("local", index_name)
+    return run_index_files(paths, manifest, make_local_writer(store), store.delete, failures,
+                           BM25Index.for_index("local", index_name))
@@ -0,0 +1,137 @@
+"""Metadata filters pushed down into retrieval.
+
+Filters are expressed once in Pinecone's MongoDB-style syntax (which the
+local index and BM25 index also understand) and translated for Chroma, so
+every backend restricts candidates *before* the top-k cut instead of the UI
+dropping results afterwards.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Metadata fields with a posting-list index in the local vector store
+INDEXED_FIELDS = ("document_type", "source", "sheet")
+RANGE_FIELD = "page"
+
+
+def build_filter(
+    document_type: Optional[str] = None,
+    source: Optional[str] = None,
+    sheet: Optional[str] = None,
+    page_range: Optional[Tuple[int, int]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Filter dict for the given constraints, or None when unconstrained."""
+    flt: Dict[str, Any] = {}
+    if document_type:
+        flt["document_type"] = {"$eq": document_type}
+    if source:
+        flt["source"] = {"$eq": source}
+    if sheet:
+        flt["sheet"] = {"$eq": sheet}
+    if page_range:
+        lo, hi = page_range
+        flt["page"] = {"$gte": int(lo), "$lte": int(hi)}
+    return flt or None
+
+
+def _conditions(flt: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+    """Flatten a filter into ``(field, operator, value)`` conditions (all ANDed)."""
+    out = []
+    for key, cond in flt.items():
+        if key == "$and":
+            for sub in cond:
+                out.extend(_conditions(sub))
+        elif isinstance(cond, dict):
+            out.extend((key, op, value) for op, value in cond.items())
+        else:
+            out.append((key, "$eq", cond))
+    return out
+
+
+def to_chroma_filter(flt: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Chroma wants one operator per clause and an explicit $and for several
+    if not flt:
+        return None
+    clauses = [{field: {op: value}} for field, op, value in _conditions(flt)]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def search_kwargs_for(vectorstore: Any, k: int, flt: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """``as_retriever`` search kwargs with the filter in the store's native syntax."""
+    kwargs: Dict[str, Any] = {"k": k}
+    if flt:
+        kwargs["filter"] = to_chroma_filter(flt) if type(vectorstore).__name__ == "Chroma" else flt
+    return kwargs
+
+
+_OPS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$in": lambda a, b: a in b,
+    "$nin": lambda a, b: a not in b,
+    "$gt": lambda a, b: a is not None and a > b,
+    "$gte": lambda a, b: a is not None and a >= b,
+    "$lt": lambda a, b: a is not None and a < b,
+    "$lte": lambda a, b: a is not None and a <= b,
+}
+
+
+def matches(metadata: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a filter against one metadata dict."""
+    if not flt:
+        return True
+    return all(_OPS[op](metadata.get(field), value) for field, op, value in _conditions(flt))
+
+
+class MetadataIndex:
+    """Posting-list/bitmap index over chunk metadata for pre-filtering candidates.
+
+    Categorical fields map each value to the rows holding it; ``page`` is a
+    dense int array so page ranges become one vectorized comparison. Fields
+    without an index fall back to a per-row check.
+    """
+
+    def __init__(self):
+        self._n = 0
+        self._postings: Dict[str, Dict[Any, List[int]]] = {field: {} for field in INDEXED_FIELDS}
+        self._pages = np.zeros(0, dtype=np.int64)
+        self._metadatas: List[Dict[str, Any]] = []
+
+    def add(self, metadatas: List[Dict[str, Any]]):
+        start = self._n
+        for offset, meta in enumerate(metadatas):
+            for field in INDEXED_FIELDS:
+                value = meta.get(field)
+                if value is not None:
+                    self._postings[field].setdefault(value, []).append(start + offset)
+            self._metadatas.append(meta)
+        pages = np.array([meta.get(RANGE_FIELD, -1) if isinstance(meta.get(RANGE_FIELD), int) else -1
+                          for meta in metadatas], dtype=np.int64)
+        self._pages = np.concatenate([self._pages, pages])
+        self._n += len(metadatas)
+
+    def _rows(self, field: str, values) -> np.ndarray:
+        mask = np.zeros(self._n, dtype=bool)
+        for value in values:
+            rows = self._postings[field].get(value)
+            if rows:
+                mask[rows] = True
+        return mask
+
+    def mask(self, flt: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Boolean row mask for ``flt`` (None when there is nothing to filter)."""
+        if not flt:
+            return None
+        mask = np.ones(self._n, dtype=bool)
+        for field, op, value in _conditions(flt):
+            if field in INDEXED_FIELDS and op in ("$eq", "$in"):
+                mask &= self._rows(field, value if op == "$in" else [value])
+            elif field == RANGE_FIELD and op in ("$gt", "$gte", "$lt", "$lte", "$eq"):
+                has_page = self._pages >= 0
+                mask &= has_page & _OPS[op](self._pages, value)
+            else:
+                candidates = np.flatnonzero(mask)
+                keep = [row for row in candidates if _OPS[op](self._metadatas[row].get(field), value)]
+                mask[:] = False
+                mask[keep] = True
+        return mask
@@ -0,0 +1,334 @@
+"""Lightweight in-process metrics and tracing.
+
+- ``incr(name, **labels)``: monotonically increasing counters
+- ``observe(name, seconds, **labels)`` / ``timer(...)``: latency histograms
+  with fixed Prometheus-style buckets
+- ``span(name, **attrs)``: trace spans; nested spans share the trace ID of
+  the outermost one (tracked per thread/task via ``contextvars``) and each
+  span's duration also lands in the ``latency_seconds{stage=name}`` histogram
+
+Recording only touches in-memory structures under a lock. Finished spans go
+to a bounded queue that a daemon thread appends to ``METRICS_FILE`` as JSON
+lines (when set); if the queue is full, spans are dropped and counted rather
+than blocking the caller. ``prometheus_text()`` renders everything in the
+Prometheus text format, served on ``METRICS_HOST:METRICS_PORT`` when the port
+is set.
+"""
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Loopback only by default; set to 0.0.0.0 to let a Prometheus on another host scrape
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+EXPORT_QUEUE_SIZE = 10000
+EXPORT_INTERVAL = 1.0
+RECENT_SPANS = 200
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    # Label values in the Prometheus text format escape backslash, quote and newline
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(key: Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+
+class Registry:
+    """Thread-safe store of counters, histograms and recent spans."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Key, float] = {}
+        self._histograms: Dict[Key, Histogram] = {}
+        self.recent_spans: deque = deque(maxlen=RECENT_SPANS)
+
+    def incr(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def delta_since(self, before: Dict[str, Any]) -> Dict[str, Any]:
+        """Counter and histogram changes since ``before`` (an earlier ``dump()``)."""
+        now = self.dump()
+        counters = {k: v - before["counters"].get(k, 0) for k, v in now["counters"].items()
+                    if v != before["counters"].get(k, 0)}
+        histograms = {}
+        for key, (buckets, count, total) in now["histograms"].items():
+            old_buckets, old_count, old_total = before["histograms"].get(key, ([0] * len(buckets), 0, 0.0))
+            if count != old_count:
+                histograms[key] = ([a - b for a, b in zip(buckets, old_buckets)], count - old_count, total - old_total)
+        return {"counters": counters, "histograms": histograms}
+
+    def dump(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": {k: (list(h.buckets), h.count, h.sum) for k, h in self._histograms.items()},
+            }
+
+    def merge(self, delta: Dict[str, Any]):
+        """Add metrics recorded elsewhere, e.g. in a worker process (see ``capture``)."""
+        with self._lock:
+            for key, value in delta["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (buckets, count, total) in delta["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+                histogram.buckets = [a + b for a, b in zip(histogram.buckets, buckets)]
+                histogram.count += count
+                histogram.sum += total
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": {_format(k): v for k, v in sorted(self._counters.items())},
+                "histograms": {
+                    _format(k): {"labels": dict(k[1]), "count": h.count, "sum": h.sum,
+                                 "p50": h.quantile(0.5), "p95": h.quantile(0.95)}
+                    for k, h in sorted(self._histograms.items())
+                },
+            }
+
+    def prometheus_text(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for key, value in sorted(self._counters.items()):
+                lines.append(f"{_format((key[0] + '_total', key[1]))} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + (float("inf"),), h.buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{_format((name + '_bucket', labels + (('le', le),)))} {cumulative}")
+                lines.append(f"{_format((name + '_sum', labels))} {h.sum}")
+                lines.append(f"{_format((name + '_count', labels))} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonlExporter:
+    """Appends span records to a JSON-lines file from a background thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.Queue" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, record: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            registry.incr("metrics_dropped_spans")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            time.sleep(EXPORT_INTERVAL)
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(record) + "\n" for record in batch))
+            except OSError as e:
+                print(f"Could not write metrics to {self.path}: {e}")
+
+
+registry = Registry()
+_exporter: Optional[JsonlExporter] = None
+_exporter_lock = threading.Lock()
+_server_thread: Optional[threading.Thread] = None
+_server_lock = threading.Lock()
+_server_tried = False
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def _get_exporter() -> Optional[JsonlExporter]:
+    global _exporter
+    if METRICS_FILE and _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = JsonlExporter(METRICS_FILE)
+    return _exporter
+
+
+def incr(name: str, value: float = 1, **labels):
+    registry.incr(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+@contextlib.contextmanager
+def timer(stage: str, **labels) -> Iterator[None]:
+    """Time a block into ``latency_seconds{stage=...}`` without creating a span."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("latency_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def start_span(name: str, parent: Optional[Dict[str, Any]] = None, **attrs) -> Dict[str, Any]:
+    """Open a span without making it current; for code that yields while it runs.
+
+    Children pass it as ``parent``. Close it with ``finish_span``.
+    """
+    parent = parent or _current_span.get()
+    return {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start": time.time(),
+        "attrs": dict(attrs),
+        "_perf": time.perf_counter(),
+    }
+
+
+def finish_span(record: Dict[str, Any], error: Optional[BaseException] = None):
+    seconds = time.perf_counter() - record.pop("_perf")
+    record["duration_ms"] = seconds * 1000
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"
+    registry.observe("latency_seconds", seconds, stage=record["name"])
+    registry.recent_spans.append(record)
+    exporter = _get_exporter()
+    if exporter is not None:
+        exporter.export(record)
+
+
+@contextlib.contextmanager
+def span(name: str, parent: Optional[Dict[str, Any]] = None, **attrs) -> Iterator[Dict[str, Any]]:
+    """Trace a block. Yields the span record; add to ``record["attrs"]`` while it runs."""
+    record = start_span(name, parent, **attrs)
+    token = _current_span.set(record)
+    error = None
+    try:
+        yield record
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        finish_span(record, error)
+
+
+@contextlib.contextmanager
+def capture() -> Iterator[Dict[str, Any]]:
+    """Collect the metrics recorded inside the block, to ship them to another process."""
+    before = registry.dump()
+    delta: Dict[str, Any] = {}
+    try:
+        yield delta
+    finally:
+        delta.update(registry.delta_since(before))
+
+
+def merge(delta: Dict[str, Any]):
+    registry.merge(delta)
+
+
+def snapshot() -> Dict[str, Any]:
+    return registry.snapshot()
+
+
+def prometheus_text() -> str:
+    return registry.prometheus_text()
+
+
+def start_http_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[threading.Thread]:
+    """Serve ``/metrics`` in Prometheus text format from a daemon thread.
+
+    Safe to call on every Streamlit rerun: the server is started at most once
+    per process, and a port that is already taken is reported, not raised.
+    """
+    global _server_thread, _server_tried
+    with _server_lock:
+        if not port or _server_tried:
+            return _server_thread
+        _server_tried = True
+        _server_thread = _serve(host, port)
+        return _server_thread
+
+
+def _serve(host: str, port: int) -> Optional[threading.Thread]:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.end_headers()
+            if self.path == "/metrics":
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        print(f"Could not serve metrics on {host}:{port}: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return thread
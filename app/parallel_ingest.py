@@ -0,0 +1,178 @@
+"""Multi-process document loading.
+
+Files are parsed in a process pool, and PDFs with more than
+``pages_per_shard`` pages are split into page-range shards so a single large
+document uses every core. Results are yielded in input order (file by file,
+shard by shard), so the chunk stream is identical to ``iter_files``.
+
+Workers stream each task's chunks back through a small bounded queue, as
+columnar ``ChunkBatch`` objects of ``SUB_BATCH_CHUNKS`` chunks, and the parent
+yields views of them instead of unpickling a dict per chunk. A large DOCX or
+workbook therefore never sits in memory whole, in the worker or the parent.
+"""
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import metrics
+from chunk_batch import ChunkBatch
+from load_documents import LOADERS, PdfReader, iter_pdf
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_SHARD = 100
+# Chunks per batch a worker sends back, and batches each task may have waiting
+SUB_BATCH_CHUNKS = 512
+TASK_QUEUE_BATCHES = 2
+QUEUE_POLL_SECONDS = 0.5
+
+# (path, page_range) -- page_range is None for whole-file tasks
+Task = Tuple[str, Optional[Tuple[int, int]]]
+
+
+def _plan_tasks(paths: Iterable[Path], pages_per_shard: int) -> List[Task]:
+    tasks: List[Task] = []
+    for path in paths:
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix not in LOADERS:
+            print(f"Skipping unsupported file: {path}")
+            continue
+        if suffix == ".pdf" and PdfReader:
+            try:
+                total_pages = len(PdfReader(str(path)).pages)
+            except Exception:
+                # Let the worker hit (and report) the same error
+                total_pages = 0
+            if total_pages > pages_per_shard:
+                for start in range(0, total_pages, pages_per_shard):
+                    tasks.append((str(path), (start, min(start + pages_per_shard, total_pages))))
+                continue
+        tasks.append((str(path), None))
+    return tasks
+
+
+def _iter_task(task: Task) -> Iterator[Dict]:
+    """Stream the chunks of one file or PDF shard, timing only the loader itself."""
+    path, page_range = task
+    suffix = Path(path).suffix.lower()
+    if page_range is not None:
+        chunks = iter_pdf(Path(path), page_range, raise_errors=True)
+    else:
+        chunks = LOADERS[suffix](Path(path), raise_errors=True)
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        yield chunk
+    metrics.observe("latency_seconds", elapsed, stage="parse", document_type=suffix[1:])
+
+
+def _run_task(task: Task, out) -> None:
+    """Worker entry point: stream one task's chunks into ``out``, never raising.
+
+    Chunks go out as ``ChunkBatch`` objects of at most ``SUB_BATCH_CHUNKS``;
+    ``out`` is bounded, so a worker ahead of the consumer blocks instead of
+    holding a whole file. The last item is ``(error, recorded_metrics)``.
+    """
+    error = None
+    with metrics.capture() as recorded:
+        try:
+            chunks = _iter_task(task)
+            while True:
+                batch = list(islice(chunks, SUB_BATCH_CHUNKS))
+                if not batch:
+                    break
+                out.put(ChunkBatch.from_chunks(batch))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            metrics.incr("load_failures")
+    out.put((error, recorded))
+
+
+def _drain(out, future) -> Iterator:
+    """Items a worker sends through ``out``, ending with its ``(error, metrics)`` message."""
+    while True:
+        try:
+            item = out.get(timeout=QUEUE_POLL_SECONDS)
+        except queue.Empty:
+            if future.done():
+                # The worker died before its last message (e.g. killed by the OS)
+                e = future.exception()
+                yield (f"{type(e).__name__}: {e}" if e else "worker exited without a result", {})
+                return
+            continue
+        yield item
+        if not isinstance(item, ChunkBatch):
+            return
+
+
+def iter_files_parallel(
+    paths: Iterable[Path],
+    workers: int = INGEST_WORKERS,
+    pages_per_shard: int = PAGES_PER_SHARD,
+    failures: Optional[List[Tuple[str, str]]] = None,
+) -> Iterator[Mapping]:
+    """Stream chunks from ``paths`` using a pool of ``workers`` processes.
+
+    At most ``2 * workers`` tasks are in flight, each holding at most
+    ``TASK_QUEUE_BATCHES`` sub-batches, which keeps memory bounded when this
+    feeds ``ingest_pipeline.run_pipeline``. With ``workers <= 1`` the loaders
+    stream in this process. Files that fail are appended to ``failures`` as
+    ``(path, error)`` and the run continues; chunks a file yielded before
+    failing have already been passed on.
+    """
+    tasks = _plan_tasks(paths, pages_per_shard)
+    if failures is None:
+        failures = []
+    if workers <= 1:
+        for task in tasks:
+            try:
+                yield from _iter_task(task)
+            except Exception as e:
+                print(f"Failed to load {task[0]}: {e}")
+                failures.append((task[0], f"{type(e).__name__}: {e}"))
+                metrics.incr("load_failures")
+        if failures:
+            print(f"{len(failures)} file(s) or shard(s) failed to load")
+        return
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        remaining = iter(tasks)
+
+        def submit(task: Task):
+            out = manager.Queue(maxsize=TASK_QUEUE_BATCHES)
+            try:
+                pending.append((task, out, pool.submit(_run_task, task, out)))
+            except Exception as e:
+                # BrokenProcessPool: the pool is unusable for the remaining tasks
+                failures.append((task[0], f"{type(e).__name__}: {e}"))
+
+        for task in islice(remaining, 2 * workers):
+            submit(task)
+        while pending:
+            task, out, future = pending.popleft()
+            for item in _drain(out, future):
+                if isinstance(item, ChunkBatch):
+                    yield from item
+                    continue
+                error, recorded = item
+                metrics.merge(recorded)
+                if error:
+                    print(f"Failed to load {task[0]}: {error}")
+                    failures.append((task[0], error))
+            next_task = next(remaining, None)
+            if next_task is not None:
+                submit(next_task)
+    if failures:
+        print(f"{len(failures)} file(s) or shard(s) failed to load")
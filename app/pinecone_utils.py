@@ -1,45 +1,33 @@
-import os
-from typing import List, Dict, Any
-from pinecone import Pinecone, ServerlessSpec
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pinecone import ServerlessSpec
 from langchain_pinecone import PineconeVectorStore
 from langchain.docstore.document import Document
-from langchain_community.vectorstores.utils import filter_complex_metadata
-from embedding_utils import embed_texts
+from embedding_utils import CustomEmbedding
+from chunk_batch import ChunkBatch
+from index_manifest import IndexManifest
+from bm25_index import BM25Index
+from ingest_pipeline import index_chunks, index_files as run_index_files, simple_metadata
+from upsert_engine import UpsertEngine
 from dotenv import load_dotenv
+from resources import get_pinecone_client, get_pinecone_index
 
 # Load environment variables from .env file
 load_dotenv()
 
-# --- Pinecone Initialization ---
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY must be set as an environment variable.")
-
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# The Pinecone client is created on first use by resources.get_pinecone_client(),
+# so importing this module needs no API key or network access.
 
 # --- Constants ---
 DEFAULT_INDEX_NAME = "bank-kb"
 VECTOR_DIM = 384  # MiniLM-L6-v2 output size
 
-# --- Embedding Wrapper ---
-from langchain.embeddings.base import Embeddings
-
-class CustomEmbedding(Embeddings):
-    """Custom LangChain embedding wrapper for our embedding_utils."""
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        embeddings = embed_texts(texts)
-        # Convert numpy arrays to Python lists for Pinecone compatibility
-        return [emb.tolist() if hasattr(emb, 'tolist') else list(emb) for emb in embeddings]
-
-    def embed_query(self, text: str) -> List[float]:
-        embedding = embed_texts([text])[0]
-        # Convert numpy array to Python list for Pinecone compatibility
-        return embedding.tolist() if hasattr(embedding, 'tolist') else list(embedding)
-
 # --- Core Pinecone Functions ---
 
-def build_pinecone_index(chunks: List[Dict[str, Any]], index_name: str = DEFAULT_INDEX_NAME):
-    """Creates a Pinecone index if it doesn't exist and upserts document chunks."""
+def ensure_pinecone_index(index_name: str = DEFAULT_INDEX_NAME):
+    """Creates the serverless index if it doesn't exist and returns a handle to it."""
+    pc = get_pinecone_client()
     if index_name not in pc.list_indexes().names():
         print(f"Creating new serverless index: {index_name}")
         pc.create_index(
@@ -48,50 +36,74 @@ def build_pinecone_index(chunks: List[Dict[str, Any]], index_name: str = DEFAULT
             metric="cosine",
             spec=ServerlessSpec(cloud='aws', region='us-east-1')
         )
-    
-    index = pc.Index(index_name)
-    
-    # Convert chunk dicts to LangChain Documents
-    documents = []
-    valid_chunks = 0
-    
-    for i, chunk in enumerate(chunks):
-        try:
-            # Only process valid dictionary chunks with required keys
-            if isinstance(chunk, dict) and 'text' in chunk and 'metadata' in chunk:
-                text_content = chunk['text']
-                if text_content and text_content.strip():  # Ensure non-empty text
-                    documents.append(
-                        Document(
-                            page_content=text_content.strip(), 
-                            metadata=filter_complex_metadata(chunk['metadata'])
-                        )
-                    )
-                    valid_chunks += 1
-                else:
-                    print(f"Skipping chunk {i}: empty text content")
-            else:
-                print(f"Skipping chunk {i}: invalid format (type: {type(chunk)})")
-        except Exception as e:
-            print(f"Error processing chunk {i}: {e}")
-            continue
-    
-    print(f"Processed {valid_chunks} valid chunks out of {len(chunks)} total chunks")
-    
-    # Use LangChain's PineconeVectorStore to handle embedding and upserting
-    vectorstore = get_pinecone_vectorstore(index_name=index_name)
-    vectorstore.add_documents(documents, batch_size=100)
-    print(f"Successfully upserted {len(documents)} documents to index '{index_name}'.")
+    return get_pinecone_index(index_name)
+
+def make_pinecone_writer(index, manifest: Optional[IndexManifest] = None):
+    """Returns a pipeline writer that upserts precomputed embeddings into ``index``.
+
+    Upserts go through an ``UpsertEngine``: byte-bounded requests, several in
+    flight while the pipeline keeps embedding, and retries with backoff.
+    Acknowledged IDs are recorded in ``manifest`` so an interrupted run resumes.
+    """
+    engine = UpsertEngine(index, on_written=manifest.mark_written if manifest is not None else None)
+
+    def write(batch: ChunkBatch, vectors) -> None:
+        values = vectors.tolist()
+        engine.submit([
+            {
+                "id": cid or str(uuid.uuid4()),
+                "values": vec,
+                # PineconeVectorStore reads the page content from the "text" key
+                "metadata": {**simple_metadata(meta), "text": text.strip()},
+            }
+            for cid, text, meta, vec in zip(batch.ids, batch.texts(), batch.metadatas(), values)
+        ])
+    write.close = engine.close
+
+    def update_metadata(updates: Dict[str, Dict[str, Any]]) -> None:
+        # set_metadata merges the given fields into the stored metadata
+        for cid, fields in updates.items():
+            index.update(id=cid, set_metadata=fields)
+    write.update_metadata = update_metadata
+    return write
+
+def make_pinecone_deleter(index, batch_size: int = 1000):
+    """Returns a callable deleting vector IDs from ``index`` in batches."""
+    def delete(ids: List[str]) -> None:
+        for offset in range(0, len(ids), batch_size):
+            index.delete(ids=ids[offset:offset + batch_size])
+    return delete
+
+def build_pinecone_index(chunks: Iterable[Dict[str, Any]], index_name: str = DEFAULT_INDEX_NAME):
+    """Creates a Pinecone index if needed and incrementally streams document chunks into it.
+
+    ``chunks`` may be any iterable (e.g. ``load_documents.iter_files``); it is
+    embedded and upserted batch by batch rather than collected up front.
+    Chunks already in the index manifest are skipped, and chunks that a
+    source no longer produces are deleted. The BM25 index is kept in sync.
+    """
+    index = ensure_pinecone_index(index_name)
+    manifest = IndexManifest.for_index("pinecone", index_name)
+    stats = index_chunks(chunks, manifest, make_pinecone_writer(index, manifest), make_pinecone_deleter(index),
+                         BM25Index.for_index("pinecone", index_name))
+    print(f"Successfully upserted {stats['chunks']} documents to index '{index_name}'.")
     return index
 
+def index_files(paths: Iterable[Path], index_name: str = DEFAULT_INDEX_NAME,
+                failures: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Any]:
+    """Parses and indexes only the files that changed since the last run."""
+    index = ensure_pinecone_index(index_name)
+    manifest = IndexManifest.for_index("pinecone", index_name)
+    return run_index_files(paths, manifest, make_pinecone_writer(index, manifest), make_pinecone_deleter(index),
+                           failures, BM25Index.for_index("pinecone", index_name))
+
 def get_pinecone_vectorstore(index_name: str = DEFAULT_INDEX_NAME) -> PineconeVectorStore:
     """Initializes and returns a LangChain PineconeVectorStore object."""
     embedding = CustomEmbedding()
     vectorstore = PineconeVectorStore(
-        index_name=index_name,
+        index=get_pinecone_index(index_name),  # shared handle with a pooled HTTP connection
         embedding=embedding,
         namespace=None,  # You can specify a namespace if needed
-        pinecone_api_key=PINECONE_API_KEY
     )
     return vectorstore
 
@@ -0,0 +1,195 @@
+"""Process-wide clients, vector stores, LLM and chains shared across Streamlit sessions.
+
+Everything here is created on first use and then reused by every session
+and thread, so a question only pays for retrieval and generation. Remote
+backends are health-checked at most every ``HEALTH_CHECK_INTERVAL`` seconds
+when handed out; a failed check drops that backend's objects (client, index
+handles, vector stores, chains) and they are rebuilt on the spot.
+"""
+import importlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from index_manifest import index_epoch
+
+load_dotenv()
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "30"))
+# Connection-pool size of the shared Pinecone client (threads per index handle)
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "8"))
+# Distinct (backend, mode, filter) chains kept alive
+MAX_CHAINS = 32
+
+# backend -> (module, vectorstore getter)
+VECTORSTORES = {
+    "pinecone": ("pinecone_utils", "get_pinecone_vectorstore"),
+    "chroma": ("chroma_utils", "get_chroma_vectorstore"),
+    "local": ("local_index", "get_local_vectorstore"),
+}
+
+# Keys are tuples whose first element is the backend (or "llm"); reset() drops a whole group
+_lock = threading.RLock()
+_resources: "OrderedDict[Tuple, Any]" = OrderedDict()
+_checked: Dict[Tuple, float] = {}
+# Per-key locks held while a resource is built, so only callers of that key wait.
+# They are never removed: a caller still waiting on a lock after a failed build or
+# a reset must contend with new callers, not build alongside them under a new lock.
+_building: Dict[Tuple, threading.Lock] = {}
+_epoch = index_epoch()
+
+
+def _get(key: Tuple, factory: Callable[[], Any], check: Optional[Callable[[Any], Any]] = None) -> Any:
+    while True:
+        with _lock:
+            if key in _resources:
+                resource = _resources[key]
+                due = check is not None and time.monotonic() - _checked[key] >= HEALTH_CHECK_INTERVAL
+                if due:
+                    _checked[key] = time.monotonic()
+                break
+            build_lock = _building.setdefault(key, threading.Lock())
+        with build_lock:
+            with _lock:
+                if key in _resources:
+                    # Built by the thread we waited for
+                    continue
+            # Outside the global lock: connecting or loading an index can take seconds
+            resource = factory()
+            with _lock:
+                _resources[key] = resource
+                _checked[key] = time.monotonic()
+            return resource
+    if due:
+        try:
+            check(resource)
+        except Exception as e:
+            print(f"Health check failed for {key[0]} ({e}); reconnecting.")
+            reset(key[0])
+            return _get(key, factory)
+    return resource
+
+
+def reset(group: Optional[str] = None):
+    """Drop cached objects of one backend (or all of them); they are recreated on next use."""
+    with _lock:
+        for key in [k for k in _resources if group is None or k[0] == group]:
+            del _resources[key]
+            _checked.pop(key, None)
+
+
+def _sync_epoch():
+    # An index changed (possibly in another process): reload what is held in memory
+    global _epoch
+    epoch = index_epoch()
+    if epoch == _epoch:
+        return
+    with _lock:
+        _epoch = epoch
+        for key in [k for k in _resources if k[0] == "local" or k[1] in ("lexical", "chain")]:
+            del _resources[key]
+            _checked.pop(key, None)
+
+
+# --- Pinecone ----------------------------------------------------------------
+
+def get_pinecone_client():
+    """Shared ``Pinecone`` client; fails only when Pinecone is actually used without a key."""
+    def connect():
+        from pinecone import Pinecone
+        api_key = os.getenv("PINECONE_API_KEY")
+        if not api_key:
+            raise ValueError("PINECONE_API_KEY must be set as an environment variable.")
+        return Pinecone(api_key=api_key, pool_threads=PINECONE_POOL_THREADS)
+    return _get(("pinecone", "client"), connect)
+
+
+def get_pinecone_index(index_name: str):
+    """Shared index handle; its HTTP connection pool is reused by every query and upsert."""
+    return _get(("pinecone", "index", index_name),
+                lambda: get_pinecone_client().Index(index_name, pool_threads=PINECONE_POOL_THREADS))
+
+
+# --- vector stores, LLM and chains ------------------------------------------
+
+def _check_vectorstore(backend: str, index_name: str) -> Optional[Callable[[Any], Any]]:
+    if backend == "pinecone":
+        return lambda vectorstore: get_pinecone_index(index_name).describe_index_stats()
+    if backend == "chroma":
+        return lambda vectorstore: vectorstore._collection.count()
+    # The local index lives in this process
+    return None
+
+
+def get_vectorstore(backend: str, index_name: str = "bank-kb"):
+    module, getter = VECTORSTORES[backend]
+    _sync_epoch()
+
+    def create():
+        return getattr(importlib.import_module(module), getter)(index_name)
+    return _get((backend, "vectorstore", index_name), create, _check_vectorstore(backend, index_name))
+
+
+def get_lexical_index(backend: str, index_name: str = "bank-kb"):
+    from bm25_index import BM25Index
+    _sync_epoch()
+    return _get((backend, "lexical", index_name), lambda: BM25Index.for_index(backend, index_name))
+
+
+def get_llm():
+    """Shared Gemini client (None when GOOGLE_API_KEY is missing; retried on next call)."""
+    from retrieval_chain_utils import make_llm
+    llm = _get(("llm", "gemini"), make_llm)
+    if llm is None:
+        reset("llm")
+    return llm
+
+
+def get_chain(backend: str, index_name: str = "bank-kb", hybrid: bool = True,
+              filter: Optional[Dict[str, Any]] = None, answer_cache=None, diverse: bool = False):
+    """Shared conversational chain for one backend, retrieval mode, filter and cache setting.
+
+    ``diverse`` adds MMR reordering, neighbour merging and context packing (see diverse_retriever).
+
+    Returns None when no LLM is configured.
+    """
+    from diverse_retriever import MMR_FETCH_K
+    from hybrid_retriever import build_hybrid_retriever
+    from retrieval_chain_utils import build_conversational_chain
+
+    llm = get_llm()
+    if llm is None:
+        return None
+
+    def create():
+        vectorstore = get_vectorstore(backend, index_name)
+        retriever = None
+        if hybrid:
+            # With MMR the fused list is the candidate pool, so it keeps fetch_k documents
+            k = MMR_FETCH_K if diverse else 4
+            retriever = build_hybrid_retriever(vectorstore, get_lexical_index(backend, index_name), k=k,
+                                               fetch_k=max(k, 20), filter=filter)
+        mode = f"{'hybrid' if hybrid else 'vector'}{'-mmr' if diverse else ''}"
+        return build_conversational_chain(
+            vectorstore=vectorstore, llm=llm, retriever=retriever, filter=filter,
+            answer_cache=answer_cache, cache_scope=f"{backend}-{index_name}-{mode}", diverse=diverse,
+        )
+
+    key = (backend, "chain", index_name, hybrid, json.dumps(filter, sort_keys=True), answer_cache is not None,
+           diverse)
+    # Health of the backend is checked through its vector store before handing out a chain
+    get_vectorstore(backend, index_name)
+    chain = _get(key, create)
+    with _lock:
+        if key in _resources:
+            _resources.move_to_end(key)
+        chains = [k for k in _resources if k[1:2] == ("chain",)]
+        for old in chains[:max(0, len(chains) - MAX_CHAINS)]:
+            del _resources[old]
+            _checked.pop(old, None)
+    return chain
@@ -1,51 +1,196 @@
 import os
+import time
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain_google_genai import ChatGoogleGenerativeAI
-from pinecone_utils import get_pinecone_vectorstore
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import format_document
 from dotenv import load_dotenv
+import json
+import metrics
+from answer_cache import CachedChain
+from diverse_retriever import MMR_FETCH_K, build_diverse_retriever
+from metadata_filters import search_kwargs_for
 
 # Load environment variables
 load_dotenv()
 
-# Set up memory with output key specification
-memory = ConversationBufferMemory(
-    memory_key="chat_history", 
-    return_messages=True,
-    output_key="answer"  # Specify which output to store in memory
-)
+def make_llm():
+    # Gemini 2.0 Flash client; resources.get_llm() shares one per process
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        print("Warning: GOOGLE_API_KEY not found. Please set it in your .env file.")
+        print("For now, returning None LLM - you'll need to provide one manually.")
+        return None
+    try:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model="gemini-2.0-flash", 
+            temperature=0.3,
+            google_api_key=google_api_key
+        )
+    except Exception as e:
+        print(f"Error initializing Google LLM: {e}")
+        return None
 
-def build_conversational_chain(vectorstore=None, llm=None, k=4, **kwargs):
-    if vectorstore is None:
+def build_conversational_chain(vectorstore=None, llm=None, k=4, retriever=None, filter=None,
+                               answer_cache=None, cache_scope="", memory=None, diverse=False, **kwargs):
+    # Without memory the chain is stateless and can be shared across sessions: callers pass
+    # "chat_history" themselves (e.g. from conversation_memory.SessionMemory.chat_history())
+    # filter: metadata filter pushed into the vector search (see metadata_filters.build_filter)
+    # answer_cache: optional answer_cache.AnswerCache; cache_scope names the index, and the
+    # filter is added to it so answers are only reused for the same index and filter
+    # A prebuilt retriever (e.g. hybrid_retriever.HybridRetriever) takes precedence over vectorstore
+    # diverse: over-fetch, reorder with MMR and pack a token budget (see diverse_retriever); a
+    # prebuilt retriever should then return diverse_retriever.MMR_FETCH_K candidates
+    if vectorstore is None and retriever is None:
+        from pinecone_utils import get_pinecone_vectorstore
         vectorstore = get_pinecone_vectorstore()
     if llm is None:
-        # Gemini 2.0 Flash LLM with explicit API key loading
-        google_api_key = os.getenv("GOOGLE_API_KEY")
-        if not google_api_key:
-            print("Warning: GOOGLE_API_KEY not found. Please set it in your .env file.")
-            print("For now, returning None LLM - you'll need to provide one manually.")
+        llm = make_llm()
+        if llm is None:
             return None
-        try:
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.0-flash", 
-                temperature=0.3,
-                google_api_key=google_api_key
-            )
-        except Exception as e:
-            print(f"Error initializing Google LLM: {e}")
-            return None
-    retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+    if retriever is None:
+        fetch_k = max(k, MMR_FETCH_K) if diverse else k
+        retriever = vectorstore.as_retriever(search_kwargs=search_kwargs_for(vectorstore, fetch_k, filter))
+    if diverse:
+        retriever = build_diverse_retriever(retriever)
     chain = ConversationalRetrievalChain.from_llm(
         llm,
         retriever,
         memory=memory,
         return_source_documents=True,
-        verbose=True,  # Add verbose for debugging
-        **kwargs
+        **{"verbose": True, **kwargs}  # verbose by default for debugging
     )
+    if answer_cache is not None:
+        scope = f"{cache_scope}|{json.dumps(filter, sort_keys=True)}"
+        return CachedChain(chain, answer_cache, scope)
     return chain
 
+def answer_messages(chain, docs, question, chat_history=""):
+    """Messages the chain's "stuff" step sends to the LLM for ``docs`` and ``question``."""
+    combine = chain.combine_docs_chain
+    prompt = combine.llm_chain.prompt
+    inputs = {key: value for key, value in {"question": question, "chat_history": chat_history}.items()
+              if key in prompt.input_variables}
+    inputs[combine.document_variable_name] = combine.document_separator.join(
+        format_document(doc, combine.document_prompt) for doc in docs
+    )
+    return prompt.format_prompt(**inputs).to_messages()
+
+def limit_documents(chain, docs):
+    """Leading ``docs`` that fit the chain's ``max_tokens_limit`` (all of them when unset)."""
+    if not chain.max_tokens_limit:
+        return docs
+    llm = chain.combine_docs_chain.llm_chain.llm
+    total = 0
+    for count, doc in enumerate(docs):
+        total += llm.get_num_tokens(doc.page_content)
+        if total > chain.max_tokens_limit:
+            return docs[:count]
+    return docs
+
+def stream_conversational_chain(chain, question, chat_history=(), callbacks=None):
+    """Run ``chain`` step by step, yielding ``(event, value)`` pairs as results become available.
+
+    Events: ``("sources", docs)`` once retrieval finishes, ``("token", text)`` for
+    each answer chunk as Gemini generates it, and finally ``("done", info)`` with
+    the full answer, source documents, ``ttft`` (seconds to the first token),
+    ``retrieval_seconds`` and ``seconds`` (total). Works on a plain
+    ``ConversationalRetrievalChain`` or one wrapped in an answer cache.
+    """
+    trace = metrics.start_span("query")
+    error = None
+    try:
+        yield from _stream_steps(chain, question, chat_history, callbacks, trace)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        metrics.finish_span(trace, error)
+
+def format_history(chain, chat_history):
+    """``chat_history`` as the string the chain's prompts receive ("" when empty)."""
+    if chain.get_chat_history is not None:
+        return chain.get_chat_history(list(chat_history))
+    # Same layout as ConversationalRetrievalChain's default formatting
+    roles = {"human": "Human: ", "ai": "Assistant: "}
+    lines = []
+    for turn in chat_history:
+        if isinstance(turn, BaseMessage):
+            if turn.content:
+                lines.append(f"{roles.get(turn.type, f'{turn.type}: ')}{turn.content}")
+        else:
+            question, answer = turn
+            lines.extend([f"Human: {question}", f"Assistant: {answer}"])
+    return "".join(f"\n{line}" for line in lines)
+
+def condense_question(chain, question, history, callbacks=None):
+    """Standalone question the chain retrieves with, given formatted ``history``."""
+    if not history:
+        return question
+    return chain.question_generator.invoke(
+        {"question": question, "chat_history": history}, config={"callbacks": callbacks}
+    )[chain.question_generator.output_key]
+
+def _stream_steps(chain, question, chat_history, callbacks, trace):
+    start = time.perf_counter()
+    cached_chain = None
+    if isinstance(chain, CachedChain):
+        cached_chain, chain = chain, chain.chain
+
+    config = {"callbacks": callbacks}
+    history = format_history(chain, chat_history)
+    new_question = question
+    if history:
+        with metrics.span("condense", parent=trace):
+            new_question = condense_question(chain, question, history, callbacks)
+    # Looked up after condensing: a follow-up only means something together with its history
+    if cached_chain is not None and not cached_chain.cacheable(history):
+        cached_chain = None
+    if cached_chain is not None:
+        with metrics.span("answer_cache", parent=trace) as lookup:
+            cached = cached_chain.cache.get(new_question, cached_chain.scope)
+            lookup["attrs"]["match"] = cached["match"] if cached is not None else None
+        if cached is not None:
+            elapsed = time.perf_counter() - start
+            trace["attrs"]["cached"] = cached["match"]
+            yield "sources", cached["source_documents"]
+            yield "token", cached["answer"]
+            yield "done", {"answer": cached["answer"], "source_documents": cached["source_documents"],
+                           "cached": cached["match"], "ttft": elapsed, "retrieval_seconds": 0.0,
+                           "seconds": elapsed}
+            return
+    with metrics.span("retrieve", parent=trace) as retrieve:
+        docs = limit_documents(chain, chain.retriever.invoke(new_question, config=config))
+        retrieve["attrs"]["documents"] = len(docs)
+    retrieval_seconds = time.perf_counter() - start
+    yield "sources", docs
+
+    # Same prompt the chain's "stuff" step would send, streamed instead of awaited
+    messages = answer_messages(chain, docs, new_question if chain.rephrase_question else question, history)
+    parts, ttft = [], None
+    generate = metrics.start_span("generate", parent=trace)
+    try:
+        for chunk in chain.combine_docs_chain.llm_chain.llm.stream(messages, config=config):
+            text = getattr(chunk, "content", chunk)
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+                metrics.observe("latency_seconds", ttft, stage="first_token")
+            parts.append(text)
+            yield "token", text
+    finally:
+        generate["attrs"]["characters"] = sum(len(p) for p in parts)
+        metrics.finish_span(generate)
+    info = {"answer": "".join(parts), "source_documents": docs, "cached": None,
+            "ttft": ttft if ttft is not None else time.perf_counter() - start,
+            "retrieval_seconds": retrieval_seconds, "seconds": time.perf_counter() - start}
+    if cached_chain is not None:
+        cached_chain.cache.put(new_question, info["answer"], docs, info["seconds"], cached_chain.scope)
+    yield "done", info
+
 def example_rag_flow():
+    from pinecone_utils import get_pinecone_vectorstore
     vectorstore = get_pinecone_vectorstore()
     chain = build_conversational_chain(vectorstore=vectorstore)
     chat_history = []
@@ -1,48 +1,70 @@
 import streamlit as st
-from load_documents import load_pdf, load_docx, load_excel
-from pinecone_utils import build_pinecone_index, get_pinecone_vectorstore
-from retrieval_chain_utils import build_conversational_chain
+import resources
+from retrieval_chain_utils import stream_conversational_chain
+from index_manifest import IndexManifest
+from metadata_filters import build_filter
+from answer_cache import get_answer_cache
+from conversation_memory import PromptTokenCounter, SessionMemory
+import metrics
 from langchain.prompts import PromptTemplate
+import importlib
 import os
+from pathlib import Path
+
+# Vector store backends: module providing index_files(). Modules are imported on
+# demand so e.g. the local index works without Pinecone keys.
+BACKENDS = {
+    "Pinecone": "pinecone_utils",
+    "Chroma": "chroma_utils",
+    "Local": "local_index",
+}
 
 st.set_page_config(page_title="Banking RAG Chatbot", layout="wide")
+# Prometheus endpoint when METRICS_PORT is set
+metrics.start_http_server()
 st.title("Banking Knowledge Base Chatbot")
 
-# Sidebar: File uploader
+# Sidebar: backend and file uploader
+backend = st.sidebar.selectbox("Vector store backend", list(BACKENDS))
+backend_module = importlib.import_module(BACKENDS[backend])
+use_hybrid = st.sidebar.checkbox("Hybrid retrieval (BM25 + vector)", value=True)
+use_diverse = st.sidebar.checkbox("Diverse context (MMR + token budget)", value=False)
+use_answer_cache = st.sidebar.checkbox("Reuse answers to repeated questions", value=True)
+if use_answer_cache:
+    cache_stats = get_answer_cache().stats()
+    st.sidebar.caption(
+        f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate ({cache_stats['hits']} hits, "
+        f"{cache_stats['semantic_hits']} semantic) | {cache_stats['saved_seconds']:.1f} s saved"
+    )
+
 doc_files = st.sidebar.file_uploader(
     "Upload documents (PDF, DOCX, XLSX)",
     type=["pdf", "docx", "xlsx", "xls"],
     accept_multiple_files=True
 )
 if st.sidebar.button("Process Documents") and doc_files:
-    all_chunks = []
+    temp_dir = os.path.join(os.path.dirname(__file__), "..", "temp_files")
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+    paths = []
     for file in doc_files:
-        suffix = file.name.lower().split(".")[-1]
-        temp_dir = os.path.join(os.path.dirname(__file__), "..", "temp_files")
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
         path = os.path.join(temp_dir, file.name)
         with open(path, "wb") as f:
             f.write(file.getvalue())
-        from pathlib import Path as PathLib
-        path_obj = PathLib(path)
-        if suffix == "pdf":
-            all_chunks.extend(load_pdf(path_obj))
-        elif suffix == "docx":
-            all_chunks.extend(load_docx(path_obj))
-        elif suffix in ["xls", "xlsx"]:
-            all_chunks.extend(load_excel(path_obj))
-    if all_chunks:
-        print(f"Total chunks to index: {len(all_chunks)}")
-        # Filter out any non-dict chunks before processing
-        valid_chunks = [chunk for chunk in all_chunks if isinstance(chunk, dict) and 'text' in chunk and 'metadata' in chunk]
-        print(f"Valid chunks: {len(valid_chunks)} out of {len(all_chunks)}")
-        
-        if valid_chunks:
-            build_pinecone_index(valid_chunks)
-            st.sidebar.success(f"Processed and indexed {len(valid_chunks)} valid chunks.")
-        else:
-            st.sidebar.error("No valid chunks found. Check document processing.")
+        paths.append(Path(path))
+    failures = []
+    # Only changed files are parsed; unchanged chunks are neither re-embedded nor re-upserted
+    stats = backend_module.index_files(paths, failures=failures)
+    for path, error in failures:
+        st.sidebar.error(f"Failed to load {os.path.basename(path)}: {error}")
+    if stats["files"] == 0:
+        st.sidebar.info("All documents are already indexed.")
+    elif stats["chunks"] or stats["deleted"]:
+        st.sidebar.success(f"Indexed {stats['chunks']} new chunks and removed {stats['deleted']} stale chunks.")
+        if stats.get("dedup", {}).get("embeddings_saved"):
+            dedup = stats["dedup"]
+            st.sidebar.caption(f"Skipped {dedup['exact_duplicates']} exact and {dedup['near_duplicates']} "
+                               f"near-duplicate chunks ({dedup['saved_ratio']:.0%} of the embedding work).")
     else:
         st.sidebar.warning("No valid chunks extracted.")
 
@@ -50,39 +72,90 @@ if st.sidebar.button("Process Documents") and doc_files:
 st.subheader("Chat with your banking documents")
 if "chat_history" not in st.session_state:
     st.session_state["chat_history"] = []
+# What the chain sees: this session's recent turns within a token budget (the full
+# transcript above is for display only)
+if "memory" not in st.session_state:
+    st.session_state["memory"] = SessionMemory()
+memory = st.session_state["memory"]
+memory.summarize = st.sidebar.checkbox("Summarize older turns", value=False)
 
-# Optional filters
-col1, col2 = st.columns(2)
+# Optional filters, pushed down into retrieval so k matching chunks always come back
+known_sources = sorted(IndexManifest.for_index(backend.lower(), "bank-kb").files)
+col1, col2, col3, col4 = st.columns(4)
 with col1:
     doc_type_filter = st.selectbox("Filter by document type", ["All", "pdf", "docx", "excel"])
 with col2:
-    topic_filter = st.text_input("Filter by topic (optional)")
+    source_filter = st.selectbox("Filter by source", ["All"] + known_sources,
+                                 format_func=lambda s: s if s == "All" else os.path.basename(s))
+with col3:
+    sheet_filter = st.text_input("Filter by sheet (optional)")
+with col4:
+    page_filter = st.text_input("Page range, e.g. 3-10 (optional)")
+page_range = None
+if page_filter.strip():
+    lo, _, hi = page_filter.partition("-")
+    try:
+        page_range = (int(lo), int(hi or lo))
+    except ValueError:
+        st.warning("Page range must look like 3 or 3-10.")
+metadata_filter = build_filter(
+    document_type=None if doc_type_filter == "All" else doc_type_filter,
+    source=None if source_filter == "All" else source_filter,
+    sheet=sheet_filter.strip() or None,
+    page_range=page_range,
+)
 
 user_input = st.text_input("Ask a question:")
 if st.button("Send") and user_input:
     try:
-        vectorstore = get_pinecone_vectorstore()
-        chain = build_conversational_chain(vectorstore=vectorstore)
+        # Vector store, LLM client and chain are created once per process and shared by all sessions
+        chain = resources.get_chain(
+            backend.lower(), hybrid=use_hybrid, filter=metadata_filter,
+            answer_cache=get_answer_cache() if use_answer_cache else None, diverse=use_diverse,
+        )
         if chain is None:
             st.error("❌ Cannot create conversational chain. Please check your GOOGLE_API_KEY in the .env file.")
             st.info("💡 Make sure you have a .env file with: GOOGLE_API_KEY=your_api_key_here")
         else:
-            # Optionally filter docs before retrieval (not implemented here)
-            result = chain({"question": user_input, "chat_history": st.session_state["chat_history"]})
+            counter = PromptTokenCounter()
+            answer_box = st.empty()
+            timing_box = st.empty()
+            tokens_box = st.empty()
+            answer, result = "", {}
+            # Sources render as soon as retrieval is done; the answer fills in token by token
+            for event, value in stream_conversational_chain(chain, user_input, memory.chat_history(), [counter]):
+                if event == "sources":
+                    st.markdown("### Top Matching Chunks:")
+                    for doc in value[:4]:
+                        meta = doc.metadata
+                        st.info(f"**Source:** {meta.get('source')} | **Type:** {meta.get('document_type')} | **Page:** {meta.get('page', 'N/A')}")
+                        st.text(doc.page_content[:300] + "...")
+                elif event == "token":
+                    answer += value
+                    answer_box.markdown(f"**Bot:** {answer}▌")
+                else:
+                    result = value
+            answer_box.markdown(f"**Bot:** {result['answer']}")
             st.session_state["chat_history"].append((user_input, result["answer"]))
-            
-            # Display the result
-            st.markdown(f"**Bot:** {result['answer']}")
-            # Show top chunks
-            st.markdown("### Top Matching Chunks:")
-            for doc in result.get("source_documents", [])[:4]:
-                meta = doc.metadata
-                if doc_type_filter != "All" and meta.get("document_type") != doc_type_filter:
-                    continue
-                if topic_filter and topic_filter.lower() not in doc.page_content.lower():
-                    continue
-                st.info(f"**Source:** {meta.get('source')} | **Type:** {meta.get('document_type')} | **Page:** {meta.get('page', 'N/A')}")
-                st.text(doc.page_content[:300] + "...")
+            memory.llm = resources.get_llm()
+            memory.add_turn(user_input, result["answer"])
+
+            if result["cached"]:
+                timing_box.caption(f"Answered from cache ({result['cached']} match) in {result['seconds'] * 1000:.0f} ms")
+            else:
+                timing = (f"First token after {result['ttft']:.2f} s | total {result['seconds']:.1f} s | "
+                          f"retrieval {result['retrieval_seconds'] * 1000:.0f} ms")
+                t = getattr(chain.retriever, "last_timings", {})
+                if use_hybrid and "vector_ms" in t:
+                    timing += (f" (vector {t['vector_ms']:.0f} ms, BM25 {t['lexical_ms']:.0f} ms, "
+                               f"fusion {t['fusion_ms']:.1f} ms)")
+                if "mmr_ms" in t:
+                    timing += f" | MMR {t['mmr_ms']:.1f} ms, packing {t['pack_ms']:.1f} ms"
+                timing_box.caption(timing)
+            if counter.calls:
+                approx = "" if all(call["exact"] for call in counter.calls) else "~"
+                tokens_box.caption(f"Prompt tokens: {approx}{counter.prompt_tokens} over {len(counter.calls)} LLM call(s) | "
+                                   f"history: ~{memory.tokens()} / {memory.max_tokens}")
     except Exception as e:
         st.error(f"❌ Error: {str(e)}")
         st.info("💡 Please check your API keys and try again.")
@@ -96,3 +169,15 @@ if st.session_state["chat_history"]:
     for q, a in st.session_state["chat_history"]:
         st.markdown(f"**You:** {q}")
         st.markdown(f"**Bot:** {a}")
+
+# Stats panel, rendered last so it includes this run's question
+with st.sidebar.expander("Pipeline stats"):
+    snapshot = metrics.snapshot()
+    stages = [
+        {"stage": " ".join([h["labels"].pop("stage")] + list(h["labels"].values())), "count": h["count"],
+         "p50 (ms)": h["p50"] * 1000, "p95 (ms)": h["p95"] * 1000}
+        for key, h in snapshot["histograms"].items() if key.startswith("latency_seconds{")
+    ]
+    if stages:
+        st.dataframe(stages, hide_index=True)
+    st.json(snapshot["counters"], expanded=False)
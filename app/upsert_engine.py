@@ -0,0 +1,222 @@
+"""Concurrent, retrying upserts for remote vector indexes such as Pinecone.
+
+``UpsertEngine`` packs records into requests bounded by both record count
+and estimated payload bytes, sends up to ``max_in_flight`` requests at once
+from a thread pool, and retries transient failures with exponential backoff
+and jitter. ``submit`` blocks only while ``max_in_flight`` requests are
+outstanding, so the ingest pipeline keeps parsing and embedding while
+earlier batches are on the wire. Acknowledged record IDs are reported
+through ``on_written`` so an interrupted run can resume (see
+``IndexManifest.mark_written``).
+
+``FakeIndex`` stands in for a Pinecone index with configurable latency and
+injected failures; ``python upsert_engine.py`` benchmarks the engine against it.
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+UPSERT_IN_FLIGHT = int(os.getenv("UPSERT_IN_FLIGHT", "4"))
+# Pinecone caps a request at 1000 vectors and 2 MB
+MAX_BATCH_RECORDS = 100
+MAX_BATCH_BYTES = 2 * 1024 * 1024 - 64 * 1024
+UPSERT_RETRIES = 5
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+# Upper bound for one float in a JSON request body ("-0.012345678901234567,")
+VALUE_BYTES = 24
+
+
+def record_bytes(record: Dict[str, Any]) -> int:
+    """Estimated serialized size of one ``{"id", "values", "metadata"}`` record."""
+    return (len(record["id"]) + VALUE_BYTES * len(record["values"])
+            + len(json.dumps(record.get("metadata", {}))) + 64)
+
+
+def is_retryable(error: BaseException) -> bool:
+    # Client errors other than rate limiting will fail the same way again
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return False
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+class UpsertEngine:
+    """Size-aware, concurrent, retrying upserter for an index with ``upsert(vectors=...)``."""
+
+    def __init__(
+        self,
+        index,
+        max_in_flight: int = UPSERT_IN_FLIGHT,
+        max_batch_records: int = MAX_BATCH_RECORDS,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+        retries: int = UPSERT_RETRIES,
+        backoff: float = BACKOFF_SECONDS,
+        on_written: Optional[Callable[[List[str]], None]] = None,
+    ):
+        self.index = index
+        self.max_batch_records = max_batch_records
+        self.max_batch_bytes = max_batch_bytes
+        self.retries = retries
+        self.backoff = backoff
+        self.on_written = on_written
+        self._max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="upsert")
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_bytes = 0
+        self._futures: List[Future] = []
+        # First failure, set by worker threads and raised to the submitting thread
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+        self.stats = {"records": 0, "requests": 0, "retries": 0}
+        self._stats_lock = threading.Lock()
+
+    def submit(self, records: List[Dict[str, Any]]):
+        """Queue records; full requests are sent as soon as a slot is free."""
+        self._raise_error()
+        for record in records:
+            size = record_bytes(record)
+            if self._buffer and (len(self._buffer) >= self.max_batch_records
+                                 or self._buffer_bytes + size > self.max_batch_bytes):
+                self._send()
+            self._buffer.append(record)
+            self._buffer_bytes += size
+
+    def close(self):
+        """Send what is buffered, wait for every request and raise the first failure.
+
+        The engine can keep being used afterwards; its worker threads start again on demand.
+        A failure is reported once: records it left unsent are dropped, not written later.
+        """
+        try:
+            if self._buffer and self._first_error() is None:
+                self._send()
+            for future in self._futures:
+                future.exception()
+            self._raise_error()
+        finally:
+            self._buffer, self._buffer_bytes = [], 0
+            with self._error_lock:
+                self._error = None
+            self._executor.shutdown(wait=True)
+            self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight, thread_name_prefix="upsert")
+            self._futures = []
+
+    def _first_error(self) -> Optional[BaseException]:
+        with self._error_lock:
+            return self._error
+
+    def _fail(self, error: BaseException):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+
+    def _raise_error(self):
+        error = self._first_error()
+        if error is not None:
+            raise error
+
+    def _send(self):
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        self._slots.acquire()
+        error = self._first_error()
+        if error is not None:
+            self._slots.release()
+            raise error
+        self._futures = [f for f in self._futures if not f.done()]
+        self._futures.append(self._executor.submit(self._upsert, batch))
+
+    def _upsert(self, batch: List[Dict[str, Any]]):
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.index.upsert(vectors=batch)
+                    break
+                except Exception as e:
+                    if attempt == self.retries or not is_retryable(e):
+                        print(f"Upsert of {len(batch)} records failed after {attempt + 1} attempts: {e}")
+                        self._fail(e)
+                        return
+                    with self._stats_lock:
+                        self.stats["retries"] += 1
+                    metrics.incr("upsert_retries")
+                    # Full jitter keeps concurrent retries from hitting the service in lockstep
+                    time.sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** attempt)))
+            with self._stats_lock:
+                self.stats["records"] += len(batch)
+                self.stats["requests"] += 1
+            metrics.observe("latency_seconds", time.perf_counter() - start, stage="upsert_request")
+            if self.on_written is not None:
+                self.on_written([record["id"] for record in batch])
+        finally:
+            self._slots.release()
+
+
+class FakeIndex:
+    """In-memory stand-in for a Pinecone index.
+
+    Each upsert sleeps ``latency`` seconds and fails with probability
+    ``failure_rate`` (raising an error with HTTP status 503), which is enough
+    to exercise batching, concurrency and retries offline.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.vectors: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors: List[Dict[str, Any]], **kwargs):
+        with self._lock:
+            self.requests += 1
+            self._concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self._concurrent)
+            fail = self._random.random() < self.failure_rate
+        try:
+            time.sleep(self.latency)
+            if fail:
+                error = ConnectionError("Service unavailable")
+                error.status = 503
+                raise error
+            with self._lock:
+                for record in vectors:
+                    self.vectors[record["id"]] = record
+            return {"upserted_count": len(vectors)}
+        finally:
+            with self._lock:
+                self._concurrent -= 1
+
+    def delete(self, ids: List[str], **kwargs):
+        with self._lock:
+            for vid in ids:
+                self.vectors.pop(vid, None)
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        return {"total_vector_count": len(self.vectors)}
+
+
+if __name__ == "__main__":
+    # Sequential vs. concurrent upserts against a fake index with 50 ms latency and 10% failures
+    records = [{"id": str(i), "values": [0.1] * 384, "metadata": {"text": "x" * 800}} for i in range(2000)]
+    for in_flight in (1, UPSERT_IN_FLIGHT):
+        index = FakeIndex(latency=0.05, failure_rate=0.1, seed=in_flight)
+        engine = UpsertEngine(index, max_in_flight=in_flight, backoff=0.01)
+        start = time.perf_counter()
+        for offset in range(0, len(records), 100):
+            engine.submit(records[offset:offset + 100])
+        engine.close()
+        print(f"in_flight={in_flight}: {len(index.vectors)} vectors in {time.perf_counter() - start:.2f}s "
+              f"({engine.stats['requests']} requests, {engine.stats['retries']} retries, "
+              f"max concurrency {index.max_concurrent})")
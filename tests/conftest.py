@@ -0,0 +1,99 @@
+import hashlib
+import os
+import sys
+from typing import List
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+from langchain_core.retrievers import BaseRetriever
+
+# The app modules import each other by bare name (``import metrics``), as Streamlit runs them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+DIM = 16
+
+
+def hash_vectors(texts):
+    """Deterministic unit vectors: same text, same vector."""
+    out = np.empty((len(texts), DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        out[i] = np.random.default_rng(seed).standard_normal(DIM)
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+class FakeModel:
+    """Stands in for the SentenceTransformer and records every encode call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        self.calls.append(list(texts))
+        return hash_vectors(texts)
+
+
+@pytest.fixture
+def fake_model(tmp_path, monkeypatch):
+    """``embedding_utils`` with a fake model and an empty cache under ``tmp_path``."""
+    import embedding_utils
+
+    model = FakeModel()
+    monkeypatch.setattr(embedding_utils, "_model", model)
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_CACHE_DIR", str(tmp_path / "embedding_cache"))
+    monkeypatch.setattr(embedding_utils, "_cache", None)
+    return model
+
+
+@pytest.fixture
+def documents(tmp_path):
+    """A small generated PDF, DOCX and XLSX (the benchmark suite's fixtures)."""
+    from benchmark import make_fixtures
+
+    return make_fixtures(tmp_path, scale=1, seed=7)
+
+
+class MemoryStore:
+    """Vector store stand-in for the ingest writers: chunk ID -> (text, metadata, vector)."""
+
+    def __init__(self):
+        self.docs = {}
+        self.writes = 0
+        self.deleted = []
+
+    def write(self, batch, vectors):
+        self.writes += 1
+        for chunk, vector in zip(batch, vectors):
+            self.docs[chunk["id"]] = (chunk["text"], chunk["metadata"], vector)
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        for cid in ids:
+            self.docs.pop(cid, None)
+
+    def texts(self):
+        return sorted(text for text, _, _ in self.docs.values())
+
+
+class ListRetriever(BaseRetriever):
+    """Returns fixed documents and records the queries it was asked."""
+
+    docs: List[Document]
+    queries: List[str] = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.queries.append(query)
+        return list(self.docs)
+
+
+def make_chain(responses, docs=(), **kwargs):
+    """Conversational chain over ``docs`` whose LLM replies with ``responses`` in turn."""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from retrieval_chain_utils import build_conversational_chain
+
+    llm = FakeListChatModel(responses=list(responses))
+    return build_conversational_chain(retriever=ListRetriever(docs=list(docs)), llm=llm, verbose=False, **kwargs)
@@ -0,0 +1,101 @@
+import answer_cache
+from answer_cache import AnswerCache, CachedChain, normalize_question
+from conftest import hash_vectors, make_chain
+from langchain.docstore.document import Document
+from retrieval_chain_utils import stream_conversational_chain
+
+DOCS = [Document(page_content="Card payments cost 5 EUR; wire transfers cost 10 EUR.", metadata={"source": "fees.pdf"})]
+
+
+def embed(question):
+    return hash_vectors([question])[0]
+
+
+def test_normalized_exact_hit_within_scope():
+    cache = AnswerCache(embed=embed)
+    cache.put("What is the KYC limit (12.3.4)?", "1000", [], 2.0, scope="pinecone")
+    assert normalize_question("What is the KYC limit (12.3.4)?") == "what is the kyc limit 12.3.4"
+    assert cache.get("what is the kyc limit 12.3.4", scope="pinecone")["match"] == "exact"
+    assert cache.get("What is the KYC limit (12.3.4)?", scope="local") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_semantic_hit_above_threshold():
+    vectors = {"how high is the kyc limit": [1.0, 0.0], "what is the kyc limit": [0.96, 0.28],
+               "what is the wire fee": [0.0, 1.0]}
+    cache = AnswerCache(embed=lambda q: vectors[normalize_question(q)], similarity=0.9)
+    cache.put("How high is the KYC limit?", "1000", [], 1.0)
+    assert cache.get("What is the KYC limit?")["match"] == "semantic"
+    assert cache.get("What is the wire fee?") is None
+    assert cache.semantic_hits == 1
+
+
+def test_ttl_lru_and_epoch(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: clock[0])
+    cache = AnswerCache(max_entries=2, ttl=60, embed=embed, similarity=2.0)
+    for question in ("a one", "b two", "c three"):
+        cache.put(question, question.upper(), [], 1.0)
+    assert cache.get("a one") is None and cache.get("c three") is not None
+    clock[0] += 61
+    assert cache.get("c three") is None
+    cache.put("d four", "D FOUR", [], 1.0)
+    monkeypatch.setattr(answer_cache, "index_epoch", lambda: 42)
+    assert cache.get("d four") is None and len(cache) == 0
+
+
+def test_question_is_embedded_outside_the_lock():
+    held = []
+
+    def checking_embed(question):
+        held.append(cache._lock.locked())
+        return embed(question)
+
+    cache = AnswerCache(embed=checking_embed)
+    cache.put("first question", "answer", [], 1.0)
+    cache.get("second question")
+    assert held == [False, False]
+
+
+def conversation_chain(cache):
+    # Responses in call order: condensed question, then answer, per uncached turn
+    chain = make_chain(["What is the card fee?", "Cards cost 5 EUR.",
+                        "What is the card loan rate?", "Card loans are 9%."],
+                       DOCS, answer_cache=cache, cache_scope="test")
+    assert isinstance(chain, CachedChain)
+    return chain
+
+
+def test_follow_ups_are_keyed_on_the_condensed_question():
+    cache = AnswerCache(embed=embed)
+    chain = conversation_chain(cache)
+    first = chain({"question": "And for cards?", "chat_history": [("What is the wire fee?", "10 EUR.")]})
+    assert first["answer"] == "Cards cost 5 EUR." and first["question"] == "And for cards?"
+    # Same words, different conversation: must not reuse the fee answer
+    second = chain({"question": "And for cards?", "chat_history": [("What is the loan rate?", "3%.")]})
+    assert second["answer"] == "Card loans are 9%."
+    third = chain({"question": "What is the card fee?", "chat_history": []})
+    assert third["cached"] == "exact" and third["answer"] == "Cards cost 5 EUR."
+    # One condense call per follow-up: the chain answers the standalone question directly
+    assert chain.chain.retriever.queries == ["What is the card fee?", "What is the card loan rate?"]
+
+
+def test_streaming_looks_up_after_condensing():
+    cache = AnswerCache(embed=embed)
+    chain = conversation_chain(cache)
+
+    def ask(question, history):
+        return dict(stream_conversational_chain(chain, question, history))["done"]
+
+    assert ask("And for cards?", [("What is the wire fee?", "10 EUR.")])["answer"] == "Cards cost 5 EUR."
+    assert ask("And for cards?", [("What is the loan rate?", "3%.")])["answer"] == "Card loans are 9%."
+    hit = ask("What is the card fee?", [])
+    assert hit["cached"] == "exact" and hit["answer"] == "Cards cost 5 EUR."
+
+
+def test_follow_ups_skip_the_cache_when_the_answer_sees_the_history():
+    cache = AnswerCache(embed=embed)
+    chain = make_chain(["What is the card fee?", "Cards cost 5 EUR."], DOCS, answer_cache=cache,
+                       rephrase_question=False)
+    chain({"question": "And for cards?", "chat_history": [("What is the wire fee?", "10 EUR.")]})
+    assert len(cache) == 0 and cache.misses == 0
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+from langchain_core.messages import AIMessage
+
+import batch_qa
+from benchmark import HashEmbedding
+from conftest import DIM, hash_vectors, make_chain
+from local_index import LocalVectorStore
+
+TOPICS = ["wire fee", "card fee", "overdraft rate", "savings rate", "loan term", "mortgage term"]
+
+
+def make_store():
+    texts = [f"The {topic} is listed in section {i}." for i, topic in enumerate(TOPICS)]
+    store = LocalVectorStore(HashEmbedding())
+    store.add_embeddings(texts, hash_vectors(TOPICS), [{"source": f"{i % 2}.pdf", "page": i} for i in range(6)],
+                         [f"id-{i}" for i in range(6)])
+    return store
+
+
+class ScriptedLLM:
+    """Echoes the question; raises the errors queued for a question before answering it."""
+
+    def __init__(self, failures=None):
+        self.failures = {question: list(errors) for question, errors in (failures or {}).items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def invoke(self, messages):
+        question = messages[-1].content
+        with self._lock:
+            self.calls.append(question)
+            errors = self.failures.get(question)
+            if errors:
+                raise errors.pop(0)
+        # The retrieved context is in the system message
+        return AIMessage(content=f"{question}: {messages[0].content.splitlines()[-1]}")
+
+
+def answerer(llm, **kwargs):
+    return batch_qa.BatchAnswerer(make_chain([]), llm, **{"backoff": 0.0, "rpm": 0, **kwargs})
+
+
+def read(path):
+    return {record["id"]: record for record in map(json.loads, path.read_text().splitlines())}
+
+
+def test_questions_load_from_jsonl_and_text(tmp_path):
+    jsonl = tmp_path / "q.jsonl"
+    jsonl.write_text('{"id": 7, "question": "wire fee"}\n\n{"question": "card fee", "team": "ops"}\n')
+    text = tmp_path / "q.txt"
+    text.write_text("wire fee\n\ncard fee\n")
+    assert batch_qa.load_questions(str(jsonl)) == [{"id": "7", "question": "wire fee"},
+                                                   {"id": "3", "question": "card fee", "team": "ops"}]
+    assert batch_qa.load_questions(str(text)) == [{"id": "1", "question": "wire fee"},
+                                                  {"id": "3", "question": "card fee"}]
+
+
+def test_batched_search_matches_single_searches():
+    rng = np.random.default_rng(0)
+    store = LocalVectorStore(HashEmbedding())
+    store.add_embeddings([f"doc {i}" for i in range(500)], rng.standard_normal((500, DIM)).astype(np.float32),
+                         ids=[f"id-{i}" for i in range(500)])
+    store.delete(["id-3", "id-250"])
+    queries = rng.standard_normal((40, DIM)).astype(np.float32)
+    batched = store.search_vectors(queries, k=7, block=16)
+    for query, hits in zip(queries, batched):
+        single = store.search_vector(query, 7)
+        assert [row for row, _ in hits] == [row for row, _ in single]
+        np.testing.assert_allclose([score for _, score in hits], [score for _, score in single], rtol=1e-5)
+        assert not {3, 250} & {row for row, _ in hits}
+
+
+def test_remote_stores_are_queried_per_question():
+    class Remote:
+        def __init__(self, store):
+            self.store = store
+
+        def similarity_search_by_vector(self, vector, k=4, filter=None):
+            return self.store.similarity_search_by_vector(vector, k=k, filter=filter)
+
+    store = make_store()
+    vectors = hash_vectors(TOPICS[:3])
+    flt = {"source": "1.pdf"}
+    assert batch_qa.retrieve_batch(Remote(store), vectors, TOPICS[:3], k=2, filter=flt) == \
+        batch_qa.retrieve_batch(store, vectors, TOPICS[:3], k=2, filter=flt)
+
+
+def test_run_answers_every_question_and_resumes(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    questions = [{"id": str(i), "question": topic} for i, topic in enumerate(TOPICS)]
+    llm = ScriptedLLM({"loan term": [ConnectionError("reset")] * 3})
+    stats = batch_qa.run_batch(questions, make_store(), answerer(llm, retries=2), str(output), k=1,
+                               embed=hash_vectors)
+    assert (stats["answered"], stats["failed"], stats["skipped"]) == (5, 1, 0)
+    records = read(output)
+    assert records["0"]["answer"] == "wire fee: The wire fee is listed in section 0."
+    assert records["0"]["sources"] == [{"source": "0.pdf", "page": 0}] and records["0"]["attempts"] == 1
+    assert set(records["0"]["timings"]) == {"embed_ms", "retrieve_ms", "wait_ms", "generate_ms"}
+    assert records["4"]["answer"] is None and records["4"]["error"] == "ConnectionError: reset"
+    assert llm.calls.count("loan term") == 3
+
+    # An interrupted run can leave half a line; only the failed question is asked again
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"id": "5", "ans')
+    llm.calls.clear()
+    stats = batch_qa.run_batch(questions, make_store(), answerer(llm), str(output), k=1, embed=hash_vectors)
+    assert (stats["answered"], stats["skipped"]) == (1, 5)
+    assert llm.calls == ["loan term"]
+
+
+def test_client_errors_are_not_retried():
+    llm = ScriptedLLM({"card fee": [ValueError("bad request")], "wire fee": [TimeoutError()] * 2})
+    qa = answerer(llm, retries=3)
+    docs = make_store().similarity_search_by_vector(hash_vectors(["wire fee"])[0].tolist(), k=1)
+    assert qa.answer("wire fee", docs)["attempts"] == 3
+    with pytest.raises(ValueError):
+        qa.answer("card fee", docs)
+    assert llm.calls.count("card fee") == 1
+
+
+def test_rate_limit_spaces_calls_across_threads():
+    limiter = batch_qa.RateLimiter(per_minute=1200)
+    starts = []
+
+    def call():
+        limiter.acquire()
+        starts.append(time.monotonic())
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gaps = np.diff(sorted(starts))
+    assert len(gaps) == 5 and gaps.min() >= 0.045
+    assert batch_qa.RateLimiter(0).acquire() == 0.0
@@ -0,0 +1,43 @@
+import numpy as np
+
+import benchmark
+import embedding_utils
+
+CONFIG = {"seed": 1, "scale": 1, "embed_texts": 30, "corpus_sizes": [200], "queries": 5}
+
+
+def test_embedding_stage_starts_cold_even_after_the_cache_was_opened(tmp_path, fake_model):
+    # Another stage or module already opened the default cache and filled it
+    texts = benchmark._sentences(np.random.default_rng(CONFIG["seed"]), CONFIG["embed_texts"], words=40)
+    embedding_utils.embed_texts(texts)
+    default_cache = embedding_utils.get_cache()
+    fake_model.calls.clear()
+
+    result = benchmark.bench_embeddings(CONFIG, tmp_path / "work")
+    assert [len(call) for call in fake_model.calls] == [len(texts)]
+    assert result["texts"] == len(texts) and {"cold", "warm"} <= set(result)
+    assert (tmp_path / "work" / "embedding_cache").is_dir()
+    assert embedding_utils.get_cache() is default_cache
+
+
+def test_query_stage_times_semantic_query(tmp_path, monkeypatch):
+    import chroma_utils
+
+    calls = []
+    real = chroma_utils.semantic_query
+
+    def counted(*args, **kwargs):
+        calls.append(args[0])
+        return real(*args, **kwargs)
+    monkeypatch.setattr(chroma_utils, "semantic_query", counted)
+    results = benchmark.bench_query(CONFIG, tmp_path)["200"]
+    assert set(results) == {"exact", "bm25", "ivf"}
+    assert all(results[name]["n"] == CONFIG["queries"] for name in results)
+    # Warm-up plus every query, for the exact and IVF runs
+    assert len(calls) == 2 * (CONFIG["queries"] + 1)
+
+
+def test_chain_stage_reports_ttft(tmp_path):
+    results = benchmark.bench_chain(CONFIG, tmp_path)
+    for label in ("first_turn", "follow_up"):
+        assert results[label]["ttft"]["p50_ms"] <= results[label]["total"]["p50_ms"]
@@ -0,0 +1,70 @@
+import pickle
+
+import pytest
+
+from chunk_batch import ChunkBatch, ChunkView
+
+CHUNKS = [
+    {"text": "Wire transfers cost 10 EUR.", "metadata": {"source": "fees.pdf", "document_type": "pdf", "page": 1,
+                                                          "chunk": 0, "total_pages": 3}},
+    {"text": "Café fees: 2 €", "metadata": {"source": "fees.pdf", "document_type": "pdf", "page": 2, "chunk": 0}},
+    {"text": "Savings | 1.5%", "metadata": {"source": "rates.xlsx", "document_type": "excel", "sheet": "Rates",
+                                           "row": 4, "row_end": 5, "currency": "EUR", "page": 2 ** 40}},
+    {"text": "", "metadata": {"source": "empty.docx", "element": 0, "page": -1, "title": None}, "id": "given"},
+]
+
+
+def test_round_trip_keeps_text_metadata_and_ids():
+    batch = ChunkBatch.from_chunks(CHUNKS)
+    assert len(batch) == 4
+    assert batch.to_dicts() == CHUNKS
+    assert batch.texts() == [c["text"] for c in CHUNKS]
+    assert batch.metadatas() == [batch.metadata(row) for row in range(4)] == [c["metadata"] for c in CHUNKS]
+    assert batch.sources() == ["fees.pdf", "fees.pdf", "rates.xlsx", "empty.docx"]
+    # Values that do not fit a column are kept exactly, in the row's extras
+    assert batch.extras[2] == {"currency": "EUR", "page": 2 ** 40}
+    assert batch.tables["source"] == ["fees.pdf", "rates.xlsx", "empty.docx"]
+    assert pickle.loads(pickle.dumps(batch)).to_dicts() == CHUNKS
+
+
+def test_views_read_like_chunk_dicts():
+    batch = ChunkBatch.from_chunks(CHUNKS)
+    view = batch[1]
+    assert dict(view) == CHUNKS[1] and "id" not in view and view.get("id") is None
+    assert batch[-1]["id"] == "given" and len(batch[-1]) == 3
+    view["id"] = "abc"
+    assert batch.ids[1] == "abc" and view["id"] == "abc" and list(view) == ["text", "metadata", "id"]
+    with pytest.raises(TypeError):
+        view["text"] = "changed"
+    with pytest.raises(IndexError):
+        batch[4]
+    assert [v["text"] for v in batch] == batch.texts()
+
+
+def test_slice_shares_buffers_but_not_ids():
+    batch = ChunkBatch.from_chunks(CHUNKS)
+    part = batch.slice(1, 10)
+    assert part.to_dicts() == CHUNKS[1:]
+    assert part._text is batch._text and part.ints["page"].base is batch.ints["page"]
+    # The ID list is copied: IDs set before slicing are kept, later ones stay on the slice
+    assert part[2]["id"] == "given"
+    part[0]["id"] = "x"
+    assert batch.ids[1] is None and part.ids[0] == "x"
+
+
+def test_take_selects_rows_and_views_reuse_their_batch():
+    batch = ChunkBatch.from_chunks(CHUNKS)
+    picked = batch.take([3, 0, 2])
+    assert picked.to_dicts() == [CHUNKS[3], CHUNKS[0], CHUNKS[2]]
+    assert batch.take([1, 2]).to_dicts() == CHUNKS[1:3]
+    views = [batch[2], batch[0]]
+    assert ChunkBatch.from_chunks(views).to_dicts() == [CHUNKS[2], CHUNKS[0]]
+    mixed = ChunkBatch.from_chunks([batch[0], ChunkBatch.from_chunks(CHUNKS[1:2])[0], dict(CHUNKS[2])])
+    assert mixed.to_dicts() == CHUNKS[:3]
+    assert isinstance(mixed[0], ChunkView)
+
+
+def test_documents_are_built_on_demand():
+    docs = ChunkBatch.from_chunks(CHUNKS[:2]).documents()
+    assert [(d.page_content, d.metadata) for d in docs] == [(c["text"], c["metadata"]) for c in CHUNKS[:2]]
+    assert ChunkBatch.from_chunks([]).to_dicts() == []
@@ -0,0 +1,67 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from conftest import make_chain
+from conversation_memory import PromptTokenCounter, SessionMemory, count_tokens
+
+
+class FailingLLM:
+    def invoke(self, prompt):
+        raise ConnectionError("quota exceeded")
+
+
+def test_count_tokens_rounds_up():
+    assert [count_tokens(text) for text in ("", "abc", "abcd", "abcde")] == [0, 1, 1, 2]
+
+
+def test_window_keeps_recent_turns_within_budget():
+    memory = SessionMemory(max_tokens=9)
+    for i in range(5):
+        memory.add_turn(f"question {i}", f"answer {i}")
+    assert memory.tokens() <= 9
+    assert memory.turns == [("question 4", "answer 4")]
+    memory.add_turn("q", "a")
+    assert memory.turns == [("question 4", "answer 4"), ("q", "a")]
+
+
+def test_newest_turn_stays_even_when_over_budget():
+    memory = SessionMemory(max_tokens=5)
+    memory.add_turn("a long question " * 10, "a long answer " * 10)
+    assert len(memory.turns) == 1 and memory.tokens() > 5
+
+
+def test_evicted_turns_are_summarized():
+    llm = FakeListChatModel(responses=["User asked about wire fees (10 EUR)."])
+    memory = SessionMemory(max_tokens=20, summarize=True, llm=llm)
+    memory.add_turn("What is the wire fee?", "10 EUR per transfer, charged on the sending account.")
+    memory.add_turn("And for cards?", "5 EUR.")
+    assert memory.summary == "User asked about wire fees (10 EUR)."
+    assert memory.chat_history() == [
+        SystemMessage(content="Summary of earlier conversation: User asked about wire fees (10 EUR)."),
+        HumanMessage(content="And for cards?"),
+        AIMessage(content="5 EUR."),
+    ]
+    memory.clear()
+    assert memory.chat_history() == [] and memory.tokens() == 0
+
+
+def test_summary_is_capped_and_failures_drop_turns():
+    memory = SessionMemory(max_tokens=8, summarize=True, llm=FakeListChatModel(responses=["s" * 100]))
+    memory.add_turn("first question", "first answer")
+    memory.add_turn("second question", "second answer")
+    assert memory.summary == "s" * 16
+    memory = SessionMemory(max_tokens=8, summarize=True, llm=FailingLLM())
+    memory.add_turn("first question", "first answer")
+    memory.add_turn("second question", "second answer")
+    assert memory.summary == "" and memory.turns == [("second question", "second answer")]
+
+
+def test_prompt_token_counter_sees_each_llm_call():
+    chain = make_chain(["What is the card fee?", "Cards cost 5 EUR."])
+    memory = SessionMemory()
+    memory.add_turn("What is the wire fee?", "10 EUR.")
+    counter = PromptTokenCounter()
+    chain({"question": "And for cards?", "chat_history": memory.chat_history()}, callbacks=[counter])
+    # Condense-question prompt, then the answer prompt
+    assert len(counter.calls) == 2
+    assert counter.prompt_tokens == sum(call["prompt_tokens"] for call in counter.calls) > 0
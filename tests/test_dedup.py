@@ -0,0 +1,153 @@
+import sys
+
+import ingest_pipeline
+import metrics
+from bm25_index import BM25Index
+from chunk_batch import ChunkBatch
+from conftest import MemoryStore
+from dedup import Deduplicator, duplicate_metadata
+from index_manifest import IndexManifest, chunk_id
+from local_index import LocalVectorStore, make_local_writer
+
+DISCLAIMER = ("This document is provided for information only and does not constitute an offer. "
+              "Terms and conditions apply and may change without notice at the bank's discretion.")
+# Long enough that one changed word keeps the estimated Jaccard similarity above 0.95
+CLAUSE = " ".join(f"term{chr(97 + i // 26)}{chr(97 + i % 26)}" for i in range(300))
+
+
+def chunk(text, source="policy.pdf", page=1, document_type="pdf"):
+    meta = {"source": source, "document_type": document_type, "page": page, "chunk": 0}
+    return {"text": text, "metadata": meta, "id": chunk_id({"text": text, "metadata": meta})}
+
+
+def kept(deduplicator, chunks):
+    return [c["text"] for c in deduplicator.filter(chunks)]
+
+
+def test_exact_and_near_duplicates_are_dropped():
+    deduplicator = Deduplicator()
+    chunks = [chunk(CLAUSE, page=1), chunk("  " + CLAUSE.upper(), page=2), chunk(CLAUSE + ".", page=3),
+              chunk(DISCLAIMER, page=3)]
+    assert kept(deduplicator, chunks) == [CLAUSE, DISCLAIMER]
+    report = deduplicator.report()
+    assert (report["exact_duplicates"], report["near_duplicates"], report["embeddings_saved"]) == (1, 1, 2)
+    rep_id = chunks[0]["id"]
+    assert deduplicator.duplicates[chunks[1]["id"]] == (rep_id, "policy.pdf", "policy.pdf p.2", "policy.pdf p.1")
+    assert deduplicator.duplicates[chunks[2]["id"]][0] == rep_id
+
+
+def test_different_numbers_and_excel_rows_stay_separate():
+    deduplicator = Deduplicator()
+    old = "Fee schedule: international wire transfers cost 25 EUR per transfer for all personal accounts."
+    rows = ["Account | Savings | 1.5 | monthly interest credited", "Account | Savings | 1.5 | monthly interest credited."]
+    chunks = [chunk(old), chunk(old.replace("25", "30"), page=2)] + \
+        [chunk(row, source="rates.xlsx", document_type="excel") for row in rows]
+    assert len(kept(deduplicator, chunks)) == 4
+
+
+def test_no_chunk_is_retained():
+    deduplicator = Deduplicator()
+    batch = ChunkBatch.from_chunks([chunk(text, page=page) for page, text in enumerate([CLAUSE, CLAUSE, DISCLAIMER])])
+    references = sys.getrefcount(batch)
+    assert len(list(deduplicator.filter(iter(batch)))) == 2
+    # A kept ChunkView would pin the whole batch (text buffer and columns included)
+    assert sys.getrefcount(batch) == references
+
+
+def test_duplicate_metadata_caps_the_listing():
+    assert duplicate_metadata("a.pdf p.1", ["b.pdf p.2", "a.pdf p.9"]) == \
+        {"duplicates": 2, "locations": "a.pdf p.1; a.pdf p.9; b.pdf p.2"}
+    capped = duplicate_metadata("a.pdf p.1", [f"b.pdf p.{i}" for i in range(100)])
+    assert capped["duplicates"] == 100 and capped["locations"].endswith("; +51 more")
+
+
+def test_dedup_metrics_are_recorded():
+    with metrics.capture() as delta:
+        kept(Deduplicator(), [chunk(DISCLAIMER, page=page) for page in (1, 2, 3)])
+    assert delta["counters"][metrics._key("dedup_chunks", {"kind": "exact"})] == 2
+    assert delta["counters"][metrics._key("dedup_chunks", {"kind": "unique"})] == 1
+
+
+class Stores:
+    """Local vector store and BM25 index behind one writer, as the app wires them."""
+
+    def __init__(self, directory):
+        self.vectors = LocalVectorStore(embedding=None)
+        self.lexical = BM25Index(str(directory / "bm25"))
+        self.memory = MemoryStore()
+
+    def index(self, manifest, chunks):
+        write = make_local_writer(self.vectors)
+
+        def writer(batch, vectors):
+            write(batch, vectors)
+            self.memory.write(batch, vectors)
+        writer.update_metadata = write.update_metadata
+
+        def delete(ids):
+            self.vectors.delete(ids)
+            self.memory.delete(ids)
+        return ingest_pipeline.index_chunks([dict(c) for c in chunks], manifest, writer, delete,
+                                            self.lexical, dedup=True)
+
+    def metadata(self, cid):
+        row = self.vectors._row_of[cid]
+        assert self.lexical.document(self.lexical._row_of[cid]).metadata == self.vectors._metadatas[row]
+        return self.vectors._metadatas[row]
+
+
+def test_representative_lists_duplicate_locations(tmp_path, fake_model):
+    stores = Stores(tmp_path)
+    chunks = [chunk(DISCLAIMER, page=page) for page in (1, 2, 3)]
+    stats = stores.index(IndexManifest(str(tmp_path / "manifest.json")), chunks)
+    assert stats["dedup"]["embeddings_saved"] == 2
+    assert list(stores.memory.docs) == [chunks[0]["id"]]
+    # Metadata only: the representative is written once
+    assert stores.memory.writes == 1
+    assert stores.metadata(chunks[0]["id"]) == {
+        "source": "policy.pdf", "document_type": "pdf", "page": 1, "chunk": 0,
+        "duplicates": 2, "locations": "policy.pdf p.1; policy.pdf p.2; policy.pdf p.3"}
+
+
+def test_later_runs_are_compared_with_indexed_representatives(tmp_path, fake_model):
+    path = str(tmp_path / "manifest.json")
+    stores = Stores(tmp_path)
+    stores.index(IndexManifest(path), [chunk(DISCLAIMER, "policy-2024.pdf"), chunk("Old rate 2%.", "policy-2024.pdf", 2)])
+    rep_id = chunk(DISCLAIMER, "policy-2024.pdf")["id"]
+    stats = stores.index(IndexManifest(path), [chunk(DISCLAIMER, "policy-2025.pdf"),
+                                               chunk("New rate 3%.", "policy-2025.pdf", 2)])
+    assert stats["dedup"]["exact_duplicates"] == 1 and stats["added"] == 2
+    assert stores.memory.texts() == sorted([DISCLAIMER, "Old rate 2%.", "New rate 3%."])
+    assert stores.metadata(rep_id)["locations"] == "policy-2024.pdf p.1; policy-2025.pdf p.1"
+
+    # Deleting the representative re-indexes the file that relied on it
+    manifest = IndexManifest(path)
+    stores.index(manifest, [chunk("Old rate 2%.", "policy-2024.pdf", 2)])
+    assert rep_id not in stores.memory.docs
+    assert manifest.files["policy-2025.pdf"]["sha256"] is None
+    stats = stores.index(IndexManifest(path), [chunk(DISCLAIMER, "policy-2025.pdf"),
+                                               chunk("New rate 3%.", "policy-2025.pdf", 2)])
+    assert stats["dedup"]["unique"] == 1
+    assert chunk(DISCLAIMER, "policy-2025.pdf")["id"] in stores.memory.docs
+
+
+def test_reindexed_file_is_not_matched_against_its_own_old_chunks(tmp_path, fake_model):
+    path = str(tmp_path / "manifest.json")
+    stores = Stores(tmp_path)
+    stores.index(IndexManifest(path), [chunk(DISCLAIMER, page=1)])
+    # The disclaimer moves to page 2: the old copy is deleted, so the new one must be stored
+    stats = stores.index(IndexManifest(path), [chunk(DISCLAIMER, page=2)])
+    assert stats["dedup"]["unique"] == 1 and stats["deleted"] == 1
+    assert stores.memory.texts() == [DISCLAIMER]
+    assert len(stores.vectors) == 1
+
+
+def test_duplicate_removal_updates_the_count(tmp_path, fake_model):
+    path = str(tmp_path / "manifest.json")
+    stores = Stores(tmp_path)
+    stores.index(IndexManifest(path), [chunk(DISCLAIMER, "a.pdf"), chunk(DISCLAIMER, "b.pdf")])
+    rep_id = chunk(DISCLAIMER, "a.pdf")["id"]
+    assert stores.metadata(rep_id)["duplicates"] == 1
+    stores.index(IndexManifest(path), [chunk("Rewritten.", "b.pdf")])
+    assert stores.metadata(rep_id)["duplicates"] == 0
+    assert stores.metadata(rep_id)["locations"] == "a.pdf p.1"
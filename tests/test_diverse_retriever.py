@@ -0,0 +1,98 @@
+import numpy as np
+from langchain.docstore.document import Document
+
+from bm25_index import BM25Index
+from conftest import DIM, ListRetriever, hash_vectors
+from diverse_retriever import DiverseRetriever, join_overlapping, mmr_order, pack_documents
+from embedding_utils import CustomEmbedding
+from hybrid_retriever import HybridRetriever
+from local_index import LocalVectorStore
+
+# Consecutive chunks of one page overlapping by 30 characters, as the splitter produces them
+PAGE = "".join(f"Clause {i:02d}: transfers above the limit need a second approval. " for i in range(12))
+SPANS = [(0, 250), (220, 470), (440, 690)]
+
+
+def reference_mmr(query, candidates, lambda_mult):
+    candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    query = query / np.linalg.norm(query)
+    order = []
+    while len(order) < len(candidates):
+        def score(i):
+            redundancy = max((candidates[i] @ candidates[j] for j in order), default=0.0)
+            return lambda_mult * (candidates[i] @ query) - (1 - lambda_mult) * redundancy
+        order.append(max((i for i in range(len(candidates)) if i not in order), key=score))
+    return order
+
+
+def chunk_doc(n, page=1, source="limits.pdf", **metadata):
+    start, end = SPANS[n]
+    return Document(page_content=PAGE[start:end], metadata={"source": source, "page": page, "chunk": n, **metadata})
+
+
+def test_mmr_matches_the_greedy_definition():
+    rng = np.random.default_rng(1)
+    for _ in range(5):
+        query, candidates = rng.standard_normal(DIM), rng.standard_normal((15, DIM))
+        for lambda_mult in (1.0, 0.7, 0.3):
+            assert mmr_order(query, candidates, lambda_mult) == reference_mmr(query, candidates, lambda_mult)
+
+
+def test_mmr_demotes_near_copies():
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = np.array([[0.9, 0.1, 0.0], [0.9, 0.1, 0.001], [0.6, 0.0, 0.8]])
+    assert mmr_order(query, candidates, 1.0) == [0, 1, 2]
+    assert mmr_order(query, candidates, 0.5) == [0, 2, 1]
+
+
+def test_neighbours_are_merged_without_repeating_the_overlap():
+    assert join_overlapping(PAGE[0:250], PAGE[220:470]) == PAGE[0:470]
+    assert join_overlapping("no overlap here", "at all") == "no overlap here\nat all"
+    packed = pack_documents([chunk_doc(1), chunk_doc(0, page=2), chunk_doc(2), chunk_doc(0)], max_tokens=1000)
+    assert [doc.page_content for doc in packed] == [PAGE[0:690], PAGE[0:250]]
+    assert packed[0].metadata == {"source": "limits.pdf", "page": 1, "chunk": 0, "chunk_end": 2, "merged_chunks": 3}
+
+
+def test_pinecone_float_positions_still_merge():
+    docs = [Document(page_content=doc.page_content, metadata={**doc.metadata, "page": 1.0, "chunk": float(n)})
+            for n, doc in enumerate(chunk_doc(n) for n in range(3))]
+    packed = pack_documents(docs, max_tokens=1000)
+    assert len(packed) == 1 and packed[0].page_content == PAGE[0:690]
+    assert packed[0].metadata["chunk_end"] == 2 and packed[0].metadata["merged_chunks"] == 3
+    rows = [Document(page_content=f"Savings | {row}%", metadata={"source": "r.xlsx", "sheet": "R", "row": float(row)})
+            for row in (4, 5)]
+    assert pack_documents(rows)[0].metadata["row_end"] == 5
+
+
+def test_budget_skips_what_does_not_fit():
+    long = Document(page_content="x" * 400, metadata={"source": "a.pdf", "page": 1})
+    short = Document(page_content="y" * 40, metadata={"source": "b.pdf", "page": 1})
+    assert [d.page_content for d in pack_documents([chunk_doc(0), long, short], max_tokens=80)] == \
+        [PAGE[0:250], "y" * 40]
+    # The top chunk is always kept, cut to the budget
+    assert pack_documents([long, short], max_tokens=10)[0].page_content == "x" * 40
+
+
+def test_local_candidates_use_stored_vectors(fake_model):
+    texts = [PAGE[start:end] for start, end in SPANS] + ["Card fees are 5 EUR.", "Savings pay 2%."]
+    store = LocalVectorStore(CustomEmbedding())
+    store.add_embeddings(texts, hash_vectors(texts), [{"source": "s.pdf", "page": i} for i in range(5)],
+                         [f"id-{i}" for i in range(5)])
+    retriever = DiverseRetriever(base=store.as_retriever(search_kwargs={"k": 5}), max_tokens=1000)
+    docs = retriever.invoke("second approval")
+    assert len(docs) == 5 and set(retriever.last_timings) >= {"mmr_ms", "pack_ms"}
+    # One encode for the search query; the candidates are never re-embedded
+    assert fake_model.calls == [["second approval"]]
+
+    # Behind hybrid search the BM25 hits carry the same chunk IDs
+    lexical = BM25Index()
+    lexical.add_chunks([{"id": f"id-{i}", "text": text, "metadata": {}} for i, text in enumerate(texts)])
+    hybrid = HybridRetriever(vector_retriever=store.as_retriever(search_kwargs={"k": 5}), lexical=lexical, k=5)
+    assert len(DiverseRetriever(base=hybrid, max_tokens=1000).invoke("second approval")) == 5
+    assert fake_model.calls == [["second approval"]]
+
+    # A store that cannot return vectors falls back to embedding the candidate texts
+    fake_model.calls.clear()
+    remote = DiverseRetriever(base=ListRetriever(docs=[Document(page_content=t) for t in texts[3:]]))
+    assert len(remote.invoke("second approval")) == 2
+    assert [sorted(call) for call in fake_model.calls] == [sorted(texts[3:])]
@@ -0,0 +1,121 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from embedding_cache import KEYS_FILE, VECTORS_FILE, EmbeddingCache, cache_key, content_digest
+
+DIM = 8
+
+
+def key(i):
+    return cache_key("test-model", content_digest(f"text {i}"))
+
+
+def vector(i):
+    return np.full(DIM, i, dtype=np.float32)
+
+
+def lookup(cache, ids):
+    out = np.zeros((len(ids), DIM), dtype=np.float32)
+    misses = cache.get_many([key(i) for i in ids], out)
+    return out, misses
+
+
+def test_vectors_survive_reopen(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many([key(i) for i in range(5)], np.stack([vector(i) for i in range(5)]))
+    reopened = EmbeddingCache(str(tmp_path))
+    out, misses = lookup(reopened, [4, 0, 9])
+    assert misses == [2]
+    np.testing.assert_array_equal(out[:2], [vector(4), vector(0)])
+
+
+def test_interleaved_writers_keep_keys_and_rows_aligned(tmp_path):
+    first = EmbeddingCache(str(tmp_path), lru_size=0)
+    second = EmbeddingCache(str(tmp_path), lru_size=0)
+    first.put_many([key(1)], vector(1)[None])
+    second.put_many([key(2)], vector(2)[None])
+    first.put_many([key(3)], vector(3)[None])
+    for cache in (first, second, EmbeddingCache(str(tmp_path))):
+        out, misses = lookup(cache, [1, 2, 3])
+        assert misses == []
+        np.testing.assert_array_equal(out, [vector(1), vector(2), vector(3)])
+
+
+def _append(cache_dir, start):
+    cache = EmbeddingCache(cache_dir, lru_size=0)
+    for i in range(start, start + 200, 4):
+        cache.put_many([key(j) for j in range(i, i + 4)], np.stack([vector(j) for j in range(i, i + 4)]))
+
+
+def test_concurrent_processes_do_not_corrupt_the_cache(tmp_path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_append, args=(str(tmp_path), start)) for start in (0, 1000, 2000)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    ids = [i for start in (0, 1000, 2000) for i in range(start, start + 200)]
+    cache = EmbeddingCache(str(tmp_path))
+    assert len(cache) == len(ids)
+    out, misses = lookup(cache, ids)
+    assert misses == []
+    np.testing.assert_array_equal(out[:, 0], ids)
+
+
+def test_one_call_larger_than_the_cap_is_clamped(tmp_path, capsys):
+    cache = EmbeddingCache(str(tmp_path), max_rows=3)
+    cache.put_many([key(i) for i in range(5)], np.stack([vector(i) for i in range(5)]))
+    assert len(cache) == 3
+    out, misses = lookup(EmbeddingCache(str(tmp_path)), [2, 3, 4])
+    assert misses == []
+    np.testing.assert_array_equal(out, [vector(2), vector(3), vector(4)])
+    assert capsys.readouterr().out == ""
+
+
+def test_eviction_keeps_recently_used_rows(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_rows=10, lru_size=0)
+    cache.put_many([key(i) for i in range(10)], np.stack([vector(i) for i in range(10)]))
+    lookup(cache, [0, 1])
+    cache.put_many([key(10)], vector(10)[None])
+    assert len(cache) <= 10
+    out, misses = lookup(cache, [0, 1, 10])
+    assert misses == []
+    np.testing.assert_array_equal(out[:, 0], [0, 1, 10])
+
+
+def test_reader_reloads_after_another_process_compacts(tmp_path):
+    reader = EmbeddingCache(str(tmp_path), lru_size=0)
+    writer = EmbeddingCache(str(tmp_path), max_rows=10, lru_size=0)
+    writer.put_many([key(i) for i in range(10)], np.stack([vector(i) for i in range(10)]))
+    lookup(reader, range(10))
+    # Compaction keeps writer's most recently used rows and renumbers them
+    lookup(writer, [7, 8, 9])
+    writer.put_many([key(20), key(21)], np.stack([vector(20), vector(21)]))
+    out, misses = lookup(reader, [7, 8, 9, 20, 21, 0])
+    assert misses == [5]
+    np.testing.assert_array_equal(out[:5, 0], [7, 8, 9, 20, 21])
+
+
+def test_torn_tail_is_cut_on_open(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many([key(1), key(2)], np.stack([vector(1), vector(2)]))
+    with open(tmp_path / VECTORS_FILE, "ab") as f:
+        f.write(vector(3).tobytes())
+    with open(tmp_path / KEYS_FILE, "ab") as f:
+        f.write(key(3)[:5])
+    reopened = EmbeddingCache(str(tmp_path))
+    assert len(reopened) == 2
+    reopened.put_many([key(4)], vector(4)[None])
+    out, misses = lookup(EmbeddingCache(str(tmp_path)), [1, 2, 4])
+    assert misses == []
+    np.testing.assert_array_equal(out[:, 0], [1, 2, 4])
+
+
+def test_dimension_mismatch_is_rejected(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many([key(1)], vector(1)[None])
+    with pytest.raises(ValueError):
+        cache.put_many([key(2)], np.zeros((1, DIM + 1), dtype=np.float32))
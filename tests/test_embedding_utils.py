@@ -0,0 +1,67 @@
+import numpy as np
+
+import embedding_utils
+from conftest import DIM, hash_vectors
+
+
+def test_embed_texts_returns_float32_matrix_in_input_order(fake_model):
+    texts = ["a much longer chunk of banking text", "short", "medium length"]
+    out = embedding_utils.embed_texts(texts)
+    assert out.dtype == np.float32
+    assert out.shape == (3, DIM)
+    assert out.flags["C_CONTIGUOUS"]
+    np.testing.assert_allclose(out, hash_vectors(texts), rtol=1e-6)
+
+
+def test_misses_are_encoded_together_in_length_sorted_batches(fake_model):
+    texts = [f"text {'x' * n}" for n in (9, 1, 5, 3, 7)]
+    embedding_utils.embed_texts(texts, batch_size=2)
+    assert [len(batch) for batch in fake_model.calls] == [2, 2, 1]
+    flat = [text for batch in fake_model.calls for text in batch]
+    assert flat == sorted(texts, key=len)
+
+
+def test_cached_texts_are_not_encoded_again(fake_model):
+    embedding_utils.embed_texts(["kyc limit", "overdraft fee"])
+    fake_model.calls.clear()
+    out = embedding_utils.embed_texts(["overdraft fee", "new text", "kyc limit"])
+    assert fake_model.calls == [["new text"]]
+    np.testing.assert_allclose(out, hash_vectors(["overdraft fee", "new text", "kyc limit"]), rtol=1e-6)
+
+
+def test_custom_embedding_wraps_the_matrix_path(fake_model):
+    embedding = embedding_utils.CustomEmbedding()
+    docs = embedding.embed_documents(["one", "two"])
+    assert isinstance(docs, list) and isinstance(docs[0], list) and len(docs[0]) == DIM
+    np.testing.assert_allclose(embedding.embed_query("two"), docs[1], rtol=1e-6)
+
+
+def test_switching_models_uses_a_separate_cache(fake_model, monkeypatch):
+    texts = ["kyc limit", "overdraft fee"]
+    name = embedding_utils.EMBEDDING_MODEL_NAME
+    embedding_utils.embed_texts(texts)
+
+    class WideModel:
+        calls = []
+
+        def get_sentence_embedding_dimension(self):
+            return 2 * DIM
+
+        def encode(self, batch, **kwargs):
+            self.calls.append(list(batch))
+            return np.hstack([hash_vectors(batch)] * 2)
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_MODEL_NAME", "sentence-transformers/wide-model")
+    monkeypatch.setattr(embedding_utils, "_model", WideModel())
+    monkeypatch.setattr(embedding_utils, "_cache", None)
+    out = embedding_utils.embed_texts(texts)
+    assert out.shape == (2, 2 * DIM) and sorted(WideModel.calls[0]) == sorted(texts)
+    assert embedding_utils.get_cache().dim == 2 * DIM
+    assert embedding_utils.cache_dir().endswith("sentence-transformers_wide-model")
+
+    # Switching back finds the first model's vectors untouched
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_MODEL_NAME", name)
+    monkeypatch.setattr(embedding_utils, "_model", fake_model)
+    monkeypatch.setattr(embedding_utils, "_cache", None)
+    fake_model.calls.clear()
+    np.testing.assert_allclose(embedding_utils.embed_texts(texts), hash_vectors(texts), rtol=1e-6)
+    assert fake_model.calls == []
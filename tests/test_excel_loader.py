@@ -0,0 +1,68 @@
+import pytest
+from openpyxl import Workbook
+
+import load_documents
+from load_documents import iter_excel
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / "fees.xlsx"
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Fees"
+    ws.append(["Product", "Fee", "Notes"])
+    ws.append(["Savings", 0, "No   monthly fee"])
+    ws.append(["Checking", 5.5, None])
+    ws.append([None, None, None])
+    ws.append(["Business", 25, "x" * 1500])
+    ws.append(["Student", None, "Free"])
+    other = wb.create_sheet("Limits")
+    other.append(["Account", "Limit"])
+    other.append(["KYC basic", 1000])
+    wb.save(path)
+    return path
+
+
+def test_one_chunk_per_row_with_sheet_and_row_metadata(workbook):
+    # Mixed int/float columns read as floats, as pandas.read_excel did before streaming
+    chunks = list(iter_excel(workbook, rows_per_chunk=1))
+    short = [c for c in chunks if c["metadata"]["row"] != 4]
+    assert [(c["text"], c["metadata"]["sheet"], c["metadata"]["row"]) for c in short] == [
+        ("Savings | 0.0 | No monthly fee", "Fees", 1),
+        ("Checking | 5.5", "Fees", 2),
+        ("Student | Free", "Fees", 5),
+        ("KYC basic | 1000", "Limits", 1),
+    ]
+    # The long row goes through the splitter into several chunks of the same row
+    long_row = [c for c in chunks if c["metadata"]["row"] == 4]
+    assert len(long_row) > 1
+    assert [c["metadata"]["chunk"] for c in long_row] == list(range(1, len(long_row) + 1))
+    assert all(c["metadata"]["document_type"] == "excel" for c in chunks)
+
+
+def test_block_boundaries_do_not_change_the_output(workbook, monkeypatch):
+    expected = list(iter_excel(workbook, rows_per_chunk=1))
+    monkeypatch.setattr(load_documents, "EXCEL_BLOCK_ROWS", 2)
+    assert list(iter_excel(workbook, rows_per_chunk=1)) == expected
+
+
+def test_packed_rows_share_the_header_line(workbook):
+    chunks = [c for c in iter_excel(workbook, rows_per_chunk=2) if c["metadata"]["sheet"] == "Fees"]
+    first = chunks[0]
+    assert first["text"] == "Product | Fee | Notes\nSavings | 0.0 | No monthly fee\nChecking | 5.5"
+    assert (first["metadata"]["row"], first["metadata"]["row_end"]) == (1, 2)
+
+
+def test_loader_is_lazy(workbook, monkeypatch):
+    blocks = []
+    original = load_documents._iter_blocks
+
+    def counting(rows, block_rows):
+        for block in original(rows, block_rows):
+            blocks.append(len(block))
+            yield block
+    monkeypatch.setattr(load_documents, "_iter_blocks", counting)
+    monkeypatch.setattr(load_documents, "EXCEL_BLOCK_ROWS", 1)
+    next(iter_excel(workbook, rows_per_chunk=1))
+    assert blocks == [1]
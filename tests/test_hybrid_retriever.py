@@ -0,0 +1,97 @@
+from langchain.docstore.document import Document
+
+from bm25_index import BM25Index, tokenize
+from conftest import ListRetriever
+from hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+from index_manifest import chunk_id
+
+CHUNKS = [
+    {"text": "KYC refresh is required under regulation 12.3.4 every two years.",
+     "metadata": {"source": "kyc.pdf", "document_type": "pdf", "page": 3, "chunk": 0}},
+    {"text": "Savings accounts pay interest monthly.",
+     "metadata": {"source": "rates.pdf", "document_type": "pdf", "page": 1, "chunk": 0}},
+    {"text": "Regulation 12.3.5 covers dormant accounts.",
+     "metadata": {"source": "kyc.pdf", "document_type": "pdf", "page": 4, "chunk": 0}},
+    {"text": "Loan amortization follows the annuity schedule.",
+     "metadata": {"source": "loans.xlsx", "document_type": "excel", "sheet": "Terms", "row": 2}},
+]
+
+
+def with_ids(chunks):
+    return [{**chunk, "id": chunk_id(chunk)} for chunk in chunks]
+
+
+def pinecone_style(chunk, with_id=True):
+    # Pinecone stores numbers as floats and returns the vector ID as Document.id
+    metadata = {key: float(value) if isinstance(value, int) else value for key, value in chunk["metadata"].items()}
+    return Document(id=chunk["id"] if with_id else None, page_content=chunk["text"], metadata=metadata)
+
+
+def test_tokenizer_keeps_codes_whole():
+    assert tokenize("See Reg 12.3.4 and KYC-2, reg/5.") == ["see", "reg", "12.3.4", "and", "kyc-2", "reg/5"]
+
+
+def test_bm25_ranks_exact_code_first_and_returns_stored_ids():
+    chunks = with_ids(CHUNKS)
+    index = BM25Index()
+    index.add_chunks(chunks)
+    docs = index.similarity_search("regulation 12.3.4", k=2)
+    assert docs[0].id == chunks[0]["id"]
+    assert docs[1].id == chunks[2]["id"]
+
+
+def test_bm25_filter_and_delete():
+    chunks = with_ids(CHUNKS)
+    index = BM25Index()
+    index.add_chunks(chunks)
+    docs = index.similarity_search("regulation", k=4, filter={"page": {"$gte": 4}})
+    assert [doc.id for doc in docs] == [chunks[2]["id"]]
+    index.delete([chunks[2]["id"]])
+    assert [doc.id for doc in index.similarity_search("regulation", k=4)] == [chunks[0]["id"]]
+    assert len(index) == 3
+
+
+def test_bm25_save_and_reload(tmp_path):
+    chunks = with_ids(CHUNKS)
+    index = BM25Index(str(tmp_path))
+    index.add_chunks(chunks)
+    index.delete([chunks[1]["id"]])
+    index.save()
+    reopened = BM25Index(str(tmp_path))
+    assert len(reopened) == 3
+    assert [doc.id for doc in reopened.similarity_search("amortization", k=1)] == [chunks[3]["id"]]
+    assert reopened.similarity_search("savings", k=1) == []
+
+
+def test_rrf_scores_documents_found_by_both_legs_first():
+    a, b, c = (Document(id=name, page_content=name) for name in "abc")
+    assert [doc.id for doc in reciprocal_rank_fusion([[a, b], [c, b]], k=3)] == ["b", "a", "c"]
+
+
+def test_rrf_fuses_pinecone_floats_with_local_ints():
+    chunks = with_ids(CHUNKS)
+    index = BM25Index()
+    index.add_chunks(chunks)
+    lexical = index.similarity_search("regulation 12.3.4", k=2)
+    for with_id in (True, False):
+        vector = [pinecone_style(chunks[0], with_id), pinecone_style(chunks[1], with_id)]
+        fused = reciprocal_rank_fusion([vector, lexical], k=4)
+        assert len(fused) == 3
+        assert fused[0].page_content == chunks[0]["text"]
+
+
+def test_chunk_id_ignores_float_positions():
+    chunk = CHUNKS[3]
+    assert chunk_id({"text": chunk["text"], "metadata": {**chunk["metadata"], "row": 2.0}}) == chunk_id(chunk)
+    assert chunk_id({"text": chunk["text"], "metadata": {**chunk["metadata"], "row": 2.5}}) != chunk_id(chunk)
+
+
+def test_hybrid_retriever_fuses_both_legs():
+    chunks = with_ids(CHUNKS)
+    index = BM25Index()
+    index.add_chunks(chunks)
+    vector = ListRetriever(docs=[pinecone_style(chunks[1]), pinecone_style(chunks[0])])
+    retriever = HybridRetriever(vector_retriever=vector, lexical=index, k=2)
+    docs = retriever.invoke("regulation 12.3.4")
+    assert [doc.id for doc in docs] == [chunks[0]["id"], chunks[1]["id"]]
+    assert set(retriever.last_timings) == {"vector_ms", "lexical_ms", "fusion_ms"}
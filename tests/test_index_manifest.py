@@ -0,0 +1,114 @@
+import ingest_pipeline
+from conftest import MemoryStore
+from index_manifest import IndexManifest, chunk_id
+
+
+def chunk(text, source="policy.pdf", page=1, n=1):
+    return {"text": text, "metadata": {"source": source, "document_type": "pdf", "page": page, "chunk": n}}
+
+
+def index(manifest, store, chunks):
+    return ingest_pipeline.index_chunks(chunks, manifest, store.write, store.delete, dedup=False)
+
+
+def test_chunk_id_depends_on_source_position_and_text():
+    base = chunk("KYC limit is 1000")
+    assert chunk_id(base) == chunk_id(chunk("KYC limit is 1000"))
+    assert chunk_id(base) != chunk_id(chunk("KYC limit is 2000"))
+    assert chunk_id(base) != chunk_id(chunk("KYC limit is 1000", page=2))
+    assert chunk_id(base) != chunk_id(chunk("KYC limit is 1000", source="other.pdf"))
+
+
+def test_reindex_upserts_only_new_chunks_and_deletes_stale_ones(tmp_path, fake_model):
+    path = str(tmp_path / "manifest.json")
+    store = MemoryStore()
+    index(IndexManifest(path), store, [chunk("one", n=1), chunk("two", n=2), chunk("three", n=3)])
+    writes = store.writes
+    stats = index(IndexManifest(path), store, [chunk("one", n=1), chunk("TWO", n=2)])
+    assert stats["added"] == 1 and stats["deleted"] == 2
+    assert store.texts() == ["TWO", "one"]
+    assert store.writes == writes + 1
+    # A re-run over identical input writes nothing
+    writes = store.writes
+    stats = index(IndexManifest(path), store, [chunk("one", n=1), chunk("TWO", n=2)])
+    assert (stats["added"], stats["deleted"], store.writes) == (0, 0, writes)
+
+
+def test_unchanged_files_are_skipped_before_parsing(tmp_path):
+    doc = tmp_path / "a.pdf"
+    doc.write_bytes(b"v1")
+    manifest = IndexManifest(str(tmp_path / "manifest.json"))
+    assert manifest.changed_files([doc]) == [doc]
+    manifest.commit(lambda ids: None)
+    manifest = IndexManifest(str(tmp_path / "manifest.json"))
+    assert manifest.changed_files([doc]) == []
+    doc.write_bytes(b"v2")
+    assert manifest.changed_files([doc]) == [doc]
+
+
+def test_interrupted_run_resumes_without_rewriting_acknowledged_chunks(tmp_path, fake_model):
+    path = str(tmp_path / "manifest.json")
+    manifest = IndexManifest(path)
+    chunks = [chunk(f"text {i}", n=i) for i in range(4)]
+    manifest.mark_written([chunk_id(c) for c in chunks[:2]])
+    # The process dies here; the next run starts from the progress file
+    store = MemoryStore()
+    resumed_manifest = IndexManifest(path)
+    stats = index(resumed_manifest, store, [dict(c) for c in chunks])
+    assert store.texts() == ["text 2", "text 3"]
+    assert stats["added"] == 4
+    assert set(IndexManifest(path).files["policy.pdf"]["chunk_ids"]) == {chunk_id(c) for c in chunks}
+
+
+def test_chunks_written_before_a_failure_stay_tracked(tmp_path, fake_model, monkeypatch):
+    doc = tmp_path / "big.pdf"
+    doc.write_bytes(b"v1")
+    path = str(tmp_path / "manifest.json")
+    store = MemoryStore()
+    source = str(doc)
+
+    def shards(texts, fail):
+        def iter_files_parallel(paths, failures):
+            for i, text in enumerate(texts):
+                yield chunk(text, source=source, page=i + 1)
+            if fail:
+                failures.append((source, "RuntimeError: shard 2 failed"))
+        return iter_files_parallel
+
+    monkeypatch.setattr(ingest_pipeline, "iter_files_parallel", shards(["old 1", "old 2"], fail=False))
+    ingest_pipeline.index_files([doc], IndexManifest(path), store.write, store.delete, dedup=False)
+    doc.write_bytes(b"v2")
+    monkeypatch.setattr(ingest_pipeline, "iter_files_parallel", shards(["new 1"], fail=True))
+    failures = []
+    ingest_pipeline.index_files([doc], IndexManifest(path), store.write, store.delete, failures=failures,
+                                dedup=False)
+    # The old version is kept and the partial new chunk is tracked, not orphaned
+    assert store.texts() == ["new 1", "old 1", "old 2"]
+    manifest = IndexManifest(path)
+    assert {chunk_id(chunk(t, source=source, page=p)) for t, p in (("old 1", 1), ("old 2", 2), ("new 1", 1))} \
+        == set(manifest.files[source]["chunk_ids"])
+    # The file is re-parsed next time, and whatever that parse no longer produces is deleted
+    assert manifest.changed_files([doc]) == [doc]
+    monkeypatch.setattr(ingest_pipeline, "iter_files_parallel", shards(["new 1", "new 2"], fail=False))
+    ingest_pipeline.index_files([doc], IndexManifest(path), store.write, store.delete, dedup=False)
+    assert store.texts() == ["new 1", "new 2"]
+
+
+def test_deleted_files_lose_their_chunks(tmp_path, fake_model, monkeypatch):
+    docs = [tmp_path / name for name in ("a.pdf", "b.pdf", "c.pdf")]
+    for doc in docs:
+        doc.write_bytes(doc.name.encode())
+    path = str(tmp_path / "manifest.json")
+    store = MemoryStore()
+
+    def iter_files_parallel(paths, failures):
+        for p in paths:
+            yield chunk(f"text of {p.name}", source=str(p))
+    monkeypatch.setattr(ingest_pipeline, "iter_files_parallel", iter_files_parallel)
+    ingest_pipeline.index_files(docs, IndexManifest(path), store.write, store.delete, dedup=False)
+    docs[0].unlink()
+    # b.pdf is not part of this run but still exists, so it stays indexed
+    stats = ingest_pipeline.index_files(docs[2:], IndexManifest(path), store.write, store.delete, dedup=False)
+    assert (stats["files"], stats["deleted"]) == (0, 1)
+    assert store.texts() == ["text of b.pdf", "text of c.pdf"]
+    assert sorted(IndexManifest(path).files) == [str(docs[1]), str(docs[2])]
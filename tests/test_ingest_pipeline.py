@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import ingest_pipeline
+from conftest import hash_vectors
+
+
+def make_chunks(n, produced=None, source="a.pdf"):
+    for i in range(n):
+        if produced is not None:
+            produced.append(i)
+        yield {"text": f"chunk number {i}", "metadata": {"source": source, "page": i // 10 + 1, "chunk": i % 10}}
+
+
+class RecordingWriter:
+    def __init__(self, produced=None):
+        self.produced = produced
+        self.batches = []
+        self.produced_at_first_write = None
+        self.closed = False
+
+    def __call__(self, batch, vectors):
+        if self.produced_at_first_write is None and self.produced is not None:
+            self.produced_at_first_write = len(self.produced)
+        assert len(batch) == len(vectors)
+        self.batches.append((batch.texts(), np.array(vectors)))
+
+    def close(self):
+        self.closed = True
+
+
+def test_every_chunk_is_written_once_with_its_vector():
+    writer = RecordingWriter()
+    stats = ingest_pipeline.run_pipeline(make_chunks(25), writer, embed_batch_size=8, upsert_batch_size=3,
+                                         embed=hash_vectors)
+    texts = [t for batch, _ in writer.batches for t in batch]
+    assert texts == [f"chunk number {i}" for i in range(25)]
+    vectors = np.concatenate([v for _, v in writer.batches])
+    np.testing.assert_allclose(vectors, hash_vectors(texts))
+    assert max(len(batch) for batch, _ in writer.batches) <= 3
+    assert stats["chunks"] == 25
+    assert writer.closed
+
+
+def test_first_write_happens_before_the_input_is_exhausted():
+    produced = []
+    writer = RecordingWriter(produced)
+    ingest_pipeline.run_pipeline(make_chunks(2000, produced), writer, embed_batch_size=10, upsert_batch_size=10,
+                                 queue_size=2, embed=hash_vectors)
+    # Bounded queues: only a few batches can be read ahead of the writer
+    assert writer.produced_at_first_write < 200
+
+
+def test_invalid_and_empty_chunks_are_skipped():
+    chunks = [{"text": "kept", "metadata": {}}, {"text": "   ", "metadata": {}}, "not a chunk", {"text": "x"}]
+    writer = RecordingWriter()
+    stats = ingest_pipeline.run_pipeline(chunks, writer, embed=hash_vectors)
+    assert [t for batch, _ in writer.batches for t in batch] == ["kept"]
+    assert stats["chunks"] == 1
+
+
+def test_stage_failure_is_raised_in_the_caller():
+    def broken_embed(texts):
+        raise RuntimeError("model exploded")
+    with pytest.raises(RuntimeError, match="model exploded"):
+        ingest_pipeline.run_pipeline(make_chunks(50), RecordingWriter(), embed_batch_size=5, embed=broken_embed)
+
+
+def test_writer_failure_stops_the_pipeline():
+    produced = []
+
+    def writer(batch, vectors):
+        raise ConnectionError("store down")
+    with pytest.raises(ConnectionError):
+        ingest_pipeline.run_pipeline(make_chunks(10000, produced), writer, embed_batch_size=10, embed=hash_vectors)
+    assert len(produced) < 10000
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import threading
+
+import embedding_utils
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def test_import_does_not_load_sentence_transformers():
+    code = "import sys, embedding_utils; print('sentence_transformers' in sys.modules, embedding_utils._model)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "None"]
+
+
+def test_fully_cached_texts_never_load_the_model(fake_model, monkeypatch):
+    embedding_utils.embed_texts(["cached question"])
+
+    def fail():
+        raise AssertionError("model loaded for a cache hit")
+    monkeypatch.setattr(embedding_utils, "_model", None)
+    monkeypatch.setattr(embedding_utils, "_load_model", fail)
+    assert embedding_utils.embed_texts(["cached question"]).shape[0] == 1
+
+
+def test_model_is_loaded_once_across_threads(monkeypatch):
+    loads = []
+
+    def load():
+        loads.append(1)
+        return object()
+    monkeypatch.setattr(embedding_utils, "_model", None)
+    monkeypatch.setattr(embedding_utils, "_load_model", load)
+    monkeypatch.setitem(embedding_utils.timings, "model_load_seconds", None)
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(embedding_utils.get_model())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert len({id(model) for model in models}) == 1
+    assert embedding_utils.timings["model_load_seconds"] is not None
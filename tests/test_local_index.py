@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+import local_index
+from benchmark import HashEmbedding
+from local_index import LocalVectorStore
+
+
+def make_store(n=300, directory=None, mode="exact", seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, 32)).astype(np.float32)
+    store = LocalVectorStore(HashEmbedding(), persist_directory=directory, mode=mode)
+    store.add_embeddings([f"doc {i}" for i in range(n)], vectors,
+                         [{"source": f"{'a' if i % 2 else 'b'}.pdf", "document_type": "pdf", "page": i % 7 + 1}
+                          for i in range(n)],
+                         [f"id-{i}" for i in range(n)])
+    return store, vectors
+
+
+def brute_force(vectors, query, k):
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(np.argsort(-(normed @ (query / np.linalg.norm(query))))[:k])
+
+
+def rows(docs):
+    return [int(doc.page_content.split()[1]) for doc in docs]
+
+
+def test_exact_search_matches_brute_force():
+    store, vectors = make_store()
+    query = vectors[5] + 0.1
+    assert rows(store.similarity_search_by_vector(query.tolist(), k=5)) == brute_force(vectors, query, 5)
+
+
+def test_filter_is_applied_before_the_top_k_cut():
+    store, vectors = make_store()
+    docs = store.similarity_search_by_vector(vectors[0].tolist(), k=10, filter={"source": {"$eq": "a.pdf"}})
+    assert len(docs) == 10
+    assert all(doc.metadata["source"] == "a.pdf" for doc in docs)
+
+
+def test_replace_and_delete_by_id():
+    store, vectors = make_store(10)
+    store.add_embeddings(["replaced"], vectors[3:4], [{}], ["id-3"])
+    store.delete(["id-4"])
+    assert len(store) == 9
+    texts = [doc.page_content for doc in store.similarity_search_by_vector(vectors[3].tolist(), k=10)]
+    assert texts[0] == "replaced" and "doc 4" not in texts and "doc 3" not in texts
+
+
+def test_persisted_index_is_memory_mapped_on_load(tmp_path):
+    store, vectors = make_store(50, directory=str(tmp_path))
+    store.save()
+    reopened = LocalVectorStore(HashEmbedding(), persist_directory=str(tmp_path))
+    assert isinstance(reopened._matrix, np.memmap)
+    assert rows(reopened.similarity_search_by_vector(vectors[7].tolist(), k=3)) == brute_force(vectors, vectors[7], 3)
+
+
+def test_ivf_mode_is_selected_by_config_and_trained_on_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_DIR", str(tmp_path))
+    store, vectors = make_store(400, directory=str(tmp_path / "bank-kb"))
+    store.save()
+    # Saved in exact mode; opening it in IVF mode trains the clusters
+    ivf = local_index.get_local_vectorstore("bank-kb", mode="ivf")
+    assert ivf.mode == "ivf" and ivf._centroids is not None
+    assert len(ivf._centroids) == 20
+    ivf.nprobe = len(ivf._centroids)
+    # Probing every cluster is exact
+    assert rows(ivf.similarity_search_by_vector(vectors[9].tolist(), k=5)) == brute_force(vectors, vectors[9], 5)
+    ivf.save()
+    reopened = local_index.get_local_vectorstore("bank-kb", mode="ivf")
+    np.testing.assert_array_equal(reopened._centroids, ivf._centroids)
+    assert local_index.get_local_vectorstore("bank-kb", mode="exact")._centroids is None
+
+
+def test_ivf_is_retrained_after_the_index_grows(tmp_path):
+    store, _ = make_store(100, directory=str(tmp_path), mode="ivf")
+    store.save()
+    assert store._trained_rows == 100
+    rng = np.random.default_rng(1)
+    store.add_embeddings([f"doc {i}" for i in range(100, 110)], rng.standard_normal((10, 32)), None,
+                         [f"id-{i}" for i in range(100, 110)])
+    store.save()
+    assert store._trained_rows == 100
+    store.add_embeddings([f"doc {i}" for i in range(110, 150)], rng.standard_normal((40, 32)), None,
+                         [f"id-{i}" for i in range(110, 150)])
+    store.save()
+    assert store._trained_rows == 150
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        LocalVectorStore(HashEmbedding(), mode="hnsw")
+
+
+def test_store_is_saved_before_the_manifest(tmp_path, fake_model, monkeypatch):
+    import bm25_index
+    import index_manifest
+    import ingest_pipeline
+
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_DIR", str(tmp_path / "local"))
+    monkeypatch.setattr(bm25_index, "LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setattr(index_manifest, "MANIFEST_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setattr(index_manifest, "EPOCH_FILE", str(tmp_path / "manifests" / "index.epoch"))
+    doc = tmp_path / "fees.pdf"
+    doc.write_bytes(b"v1")
+
+    def iter_files_parallel(paths, failures):
+        for page in (1, 2):
+            yield {"text": f"Fee table page {page}", "metadata": {"source": str(doc), "page": page, "chunk": 0}}
+    monkeypatch.setattr(ingest_pipeline, "iter_files_parallel", iter_files_parallel)
+
+    def disk_full(self, persist_directory=None):
+        raise OSError("No space left on device")
+    real_save = LocalVectorStore.save
+    monkeypatch.setattr(LocalVectorStore, "save", disk_full)
+    with pytest.raises(OSError):
+        local_index.index_files([doc], "kb")
+    # Nothing was recorded, so the next run indexes the file again
+    monkeypatch.setattr(LocalVectorStore, "save", real_save)
+    stats = local_index.index_files([doc], "kb")
+    assert stats["added"] == 2 and stats["files"] == 1
+    assert len(local_index.get_local_vectorstore("kb")) == 2
+    assert index_manifest.index_epoch() > 0
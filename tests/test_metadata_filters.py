@@ -0,0 +1,62 @@
+import numpy as np
+
+from metadata_filters import MetadataIndex, build_filter, matches, search_kwargs_for, to_chroma_filter
+
+METADATAS = [
+    {"source": "kyc.pdf", "document_type": "pdf", "page": 1},
+    {"source": "kyc.pdf", "document_type": "pdf", "page": 5},
+    {"source": "rates.xlsx", "document_type": "excel", "sheet": "Fees", "row": 3},
+    {"source": "policy.docx", "document_type": "docx", "element": 2},
+    {"source": "kyc.pdf", "document_type": "pdf", "page": 9},
+]
+
+
+def brute_force(flt):
+    return [row for row, meta in enumerate(METADATAS) if matches(meta, flt)]
+
+
+def test_build_filter():
+    assert build_filter() is None
+    assert build_filter(document_type="pdf", page_range=(2, "7")) == {
+        "document_type": {"$eq": "pdf"}, "page": {"$gte": 2, "$lte": 7}}
+
+
+def test_to_chroma_filter():
+    assert to_chroma_filter(None) is None
+    assert to_chroma_filter({"source": "a.pdf"}) == {"source": {"$eq": "a.pdf"}}
+    assert to_chroma_filter(build_filter(document_type="pdf", page_range=(2, 7))) == {"$and": [
+        {"document_type": {"$eq": "pdf"}}, {"page": {"$gte": 2}}, {"page": {"$lte": 7}}]}
+
+
+def test_search_kwargs_use_the_native_syntax():
+    class Chroma:
+        pass
+
+    flt = build_filter(document_type="pdf", source="kyc.pdf")
+    assert search_kwargs_for(object(), 4, None) == {"k": 4}
+    assert search_kwargs_for(object(), 4, flt) == {"k": 4, "filter": flt}
+    assert search_kwargs_for(Chroma(), 4, flt)["filter"] == to_chroma_filter(flt)
+
+
+def test_matches_missing_fields_never_satisfy_ranges():
+    assert matches({"page": 3}, {"page": {"$gte": 3, "$lt": 4}})
+    assert not matches({"sheet": "Fees"}, {"page": {"$gte": 1}})
+    assert matches({"sheet": "Fees"}, {"$and": [{"sheet": {"$in": ["Fees", "Rates"]}}, {"row": {"$ne": 1}}]})
+
+
+def test_metadata_index_mask_agrees_with_matches():
+    index = MetadataIndex()
+    index.add(METADATAS[:2])
+    index.add(METADATAS[2:])
+    assert index.mask(None) is None
+    for flt in (
+        build_filter(document_type="pdf"),
+        build_filter(source="kyc.pdf", page_range=(2, 9)),
+        build_filter(sheet="Fees"),
+        {"page": {"$eq": 5}},
+        {"document_type": {"$in": ["excel", "docx"]}},
+        # Not indexed: checked row by row
+        {"element": {"$eq": 2}},
+        {"source": {"$ne": "kyc.pdf"}},
+    ):
+        assert list(np.flatnonzero(index.mask(flt))) == brute_force(flt), flt
@@ -0,0 +1,145 @@
+import json
+import socket
+import threading
+import urllib.request
+import time
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    fresh = metrics.Registry()
+    monkeypatch.setattr(metrics, "registry", fresh)
+    return fresh
+
+
+def test_counters_are_keyed_by_labels():
+    metrics.incr("pages", document_type="pdf", status="ok")
+    metrics.incr("pages", 2, status="ok", document_type="pdf")
+    metrics.incr("pages", document_type="excel", status="ok")
+    counters = metrics.snapshot()["counters"]
+    assert counters == {'pages{document_type="excel",status="ok"}': 1,
+                        'pages{document_type="pdf",status="ok"}': 3}
+    assert 'pages_total{document_type="pdf",status="ok"} 3' in metrics.prometheus_text().splitlines()
+
+
+def test_label_values_are_escaped():
+    metrics.incr("files", source='C:\\docs\\"q1"\nfinal.pdf')
+    assert metrics.prometheus_text() == 'files_total{source="C:\\\\docs\\\\\\"q1\\"\\nfinal.pdf"} 1\n'
+
+
+def test_histogram_quantiles_and_prometheus_buckets():
+    for seconds in (0.002, 0.003, 0.004, 0.2, 40.0):
+        metrics.observe("latency_seconds", seconds, stage="embed")
+    histogram = metrics.snapshot()["histograms"]['latency_seconds{stage="embed"}']
+    assert histogram["count"] == 5 and histogram["sum"] == pytest.approx(40.209)
+    assert histogram["p50"] == 0.005 and histogram["p95"] == float("inf")
+    lines = metrics.prometheus_text().splitlines()
+    assert 'latency_seconds_bucket{stage="embed",le="0.005"} 3' in lines
+    assert 'latency_seconds_bucket{stage="embed",le="30.0"} 4' in lines
+    assert 'latency_seconds_bucket{stage="embed",le="+Inf"} 5' in lines
+    assert 'latency_seconds_count{stage="embed"} 5' in lines
+
+
+def test_nested_spans_share_the_trace(registry):
+    with pytest.raises(ValueError):
+        with metrics.span("query", backend="local"):
+            with metrics.span("retrieve") as inner:
+                inner["attrs"]["docs"] = 4
+            raise ValueError("no answer")
+    retrieve, query = list(registry.recent_spans)
+    assert retrieve["trace_id"] == query["trace_id"] and retrieve["parent_id"] == query["span_id"]
+    assert retrieve["attrs"] == {"docs": 4} and query["attrs"] == {"backend": "local"}
+    assert query["error"] == "ValueError: no answer" and "error" not in retrieve
+    assert query["duration_ms"] >= retrieve["duration_ms"]
+    assert set(metrics.snapshot()["histograms"]) == {'latency_seconds{stage="query"}',
+                                                      'latency_seconds{stage="retrieve"}'}
+    with metrics.span("next"):
+        pass
+    assert registry.recent_spans[-1]["trace_id"] != query["trace_id"]
+
+
+def test_open_span_can_be_parented_explicitly(registry):
+    # The streaming path keeps a span open across yields and parents children on it
+    stream = metrics.start_span("stream")
+    with metrics.span("generate", parent=stream):
+        pass
+    metrics.finish_span(stream)
+    generate, finished = list(registry.recent_spans)
+    assert generate["parent_id"] == finished["span_id"] and "_perf" not in finished
+
+
+def test_capture_and_merge_ship_worker_metrics(registry):
+    metrics.incr("chunks", 5)
+    with metrics.capture() as delta:
+        metrics.incr("chunks", 2)
+        metrics.observe("latency_seconds", 0.01, stage="parse")
+    assert delta["counters"] == {("chunks", ()): 2}
+    parent = metrics.Registry()
+    parent.merge(delta)
+    parent.merge(delta)
+    snapshot = parent.snapshot()
+    assert snapshot["counters"] == {"chunks": 4}
+    assert snapshot["histograms"]['latency_seconds{stage="parse"}']["count"] == 2
+
+
+def test_recording_is_thread_safe():
+    def work():
+        for _ in range(1000):
+            metrics.incr("requests")
+            metrics.observe("latency_seconds", 0.001, stage="x")
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["requests"] == 8000
+    assert snapshot["histograms"]['latency_seconds{stage="x"}']["count"] == 8000
+
+
+def test_exporter_appends_jsonl_and_drops_when_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "EXPORT_INTERVAL", 0.0)
+    path = tmp_path / "spans.jsonl"
+    exporter = metrics.JsonlExporter(str(path))
+    for i in range(3):
+        exporter.export({"name": f"span-{i}"})
+    deadline = time.time() + 5
+    while time.time() < deadline and (not path.exists() or len(path.read_text().splitlines()) < 3):
+        time.sleep(0.01)
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["span-0", "span-1", "span-2"]
+
+    stalled = metrics.JsonlExporter.__new__(metrics.JsonlExporter)
+    stalled._queue = metrics.queue.Queue(maxsize=1)
+    stalled.export({"name": "kept"})
+    stalled.export({"name": "dropped"})
+    assert metrics.snapshot()["counters"] == {"metrics_dropped_spans": 1}
+
+
+def test_http_server_starts_once_and_survives_a_taken_port(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "_server_thread", None)
+    monkeypatch.setattr(metrics, "_server_tried", False)
+    taken = socket.socket()
+    taken.bind(("127.0.0.1", 0))
+    taken.listen()
+    port = taken.getsockname()[1]
+    assert metrics.start_http_server(port) is None
+    assert "Could not serve metrics on 127.0.0.1" in capsys.readouterr().out
+    taken.close()
+    # Not retried on the next Streamlit rerun
+    assert metrics.start_http_server(port) is None
+
+    monkeypatch.setattr(metrics, "_server_tried", False)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(metrics.start_http_server(port))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 1 and results[0].is_alive()
+    metrics.incr("requests")
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        assert b"requests_total 1" in response.read()
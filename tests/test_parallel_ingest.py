@@ -0,0 +1,55 @@
+import queue
+import threading
+
+import parallel_ingest
+from chunk_batch import ChunkBatch
+from load_documents import iter_files
+
+
+def as_records(chunks):
+    return [(chunk["text"], chunk["metadata"]) for chunk in chunks]
+
+
+def test_serial_and_pool_modes_match_the_plain_loaders(documents, monkeypatch):
+    # DOCX goes through unstructured, which may download NLP data on first use; keep tests offline
+    paths = [documents["pdf"], documents["excel"]]
+    expected = as_records(iter_files(paths))
+    monkeypatch.setattr(parallel_ingest, "SUB_BATCH_CHUNKS", 64)
+    assert as_records(parallel_ingest.iter_files_parallel(paths, workers=1)) == expected
+    assert as_records(parallel_ingest.iter_files_parallel(paths, workers=2)) == expected
+
+
+def test_pdf_shards_keep_page_order_and_absolute_page_numbers(documents):
+    chunks = list(parallel_ingest.iter_files_parallel([documents["pdf"]], workers=2, pages_per_shard=3))
+    assert as_records(chunks) == as_records(iter_files([documents["pdf"]]))
+    assert [c["metadata"]["page"] for c in chunks] == sorted(c["metadata"]["page"] for c in chunks)
+
+
+def test_worker_sends_bounded_sub_batches(documents, monkeypatch):
+    monkeypatch.setattr(parallel_ingest, "SUB_BATCH_CHUNKS", 50)
+    out = queue.Queue(maxsize=2)
+    worker = threading.Thread(target=parallel_ingest._run_task, args=((str(documents["excel"]), None), out),
+                              daemon=True)
+    worker.start()
+    worker.join(timeout=2)
+    # Nobody is consuming: the worker waits with at most two sub-batches queued
+    assert worker.is_alive()
+    assert out.qsize() == 2
+    items = []
+    while worker.is_alive() or not out.empty():
+        items.append(out.get(timeout=5))
+    batches, (error, recorded) = items[:-1], items[-1]
+    assert error is None and recorded
+    assert all(isinstance(b, ChunkBatch) and len(b) <= 50 for b in batches)
+    assert sum(len(b) for b in batches) == len(list(iter_files([documents["excel"]])))
+
+
+def test_broken_file_is_reported_and_the_rest_still_loads(documents, tmp_path):
+    broken = tmp_path / "broken.xlsx"
+    broken.write_bytes(b"not a workbook")
+    for workers in (1, 2):
+        failures = []
+        chunks = list(parallel_ingest.iter_files_parallel([broken, documents["pdf"]], workers=workers,
+                                                          failures=failures))
+        assert [path for path, _ in failures] == [str(broken)]
+        assert as_records(chunks) == as_records(iter_files([documents["pdf"]]))
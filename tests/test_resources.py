@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+
+import local_index
+import resources
+
+
+@pytest.fixture(autouse=True)
+def fresh_resources(monkeypatch):
+    monkeypatch.setattr(resources, "_resources", OrderedDict())
+    monkeypatch.setattr(resources, "_checked", {})
+    monkeypatch.setattr(resources, "_building", {})
+
+
+def test_resource_is_built_once_under_concurrency():
+    calls = []
+    started = threading.Barrier(8)
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    def use(out):
+        started.wait()
+        out.append(resources._get(("test", "client"), factory))
+
+    out = []
+    threads = [threading.Thread(target=use, args=(out,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len({id(resource) for resource in out}) == 1
+
+
+def test_slow_build_does_not_block_other_keys():
+    release = threading.Event()
+    building = threading.Event()
+    existing = resources._get(("local", "vectorstore", "a"), object)
+
+    def slow():
+        building.set()
+        assert release.wait(5)
+        return "slow"
+
+    thread = threading.Thread(target=resources._get, args=(("pinecone", "client"), slow))
+    thread.start()
+    assert building.wait(5)
+    try:
+        assert resources._get(("local", "vectorstore", "a"), object) is existing
+        assert resources._get(("llm", "gemini"), lambda: "llm") == "llm"
+    finally:
+        release.set()
+        thread.join()
+    assert resources._get(("pinecone", "client"), object) == "slow"
+
+
+def test_failed_build_is_retried():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("down")
+        return "up"
+
+    with pytest.raises(ConnectionError):
+        resources._get(("pinecone", "client"), flaky)
+    assert resources._get(("pinecone", "client"), flaky) == "up"
+
+
+def test_waiters_of_a_failed_build_do_not_build_concurrently():
+    running, overlaps, attempts = [], [], []
+    entered = threading.Event()
+
+    def slow():
+        attempts.append(1)
+        if running:
+            overlaps.append(1)
+        running.append(1)
+        entered.set()
+        time.sleep(0.05)
+        running.pop()
+        if len(attempts) == 1:
+            raise ConnectionError("down")
+        return "up"
+
+    def call():
+        try:
+            resources._get(("pinecone", "client"), slow)
+        except ConnectionError:
+            pass
+    first = threading.Thread(target=call)
+    first.start()
+    entered.wait()
+    # These queue on the first build's lock; one more arrives after it failed
+    waiters = [threading.Thread(target=call) for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    first.join()
+    late = threading.Thread(target=call)
+    late.start()
+    for thread in waiters + [late]:
+        thread.join()
+    assert not overlaps and len(attempts) == 2
+
+
+def test_failed_health_check_rebuilds_the_backend(monkeypatch):
+    monkeypatch.setattr(resources, "HEALTH_CHECK_INTERVAL", 0)
+    client = resources._get(("pinecone", "client"), object)
+    handle = resources._get(("pinecone", "index", "kb"), object)
+
+    def failing(resource):
+        raise ConnectionError("gone")
+
+    rebuilt = resources._get(("pinecone", "index", "kb"), object, failing)
+    assert rebuilt is not handle
+    # The whole backend group was dropped, client included
+    assert resources._get(("pinecone", "client"), object) is not client
+
+
+def test_local_vectorstore_is_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_DIR", str(tmp_path))
+    store = resources.get_vectorstore("local", "kb")
+    assert resources.get_vectorstore("local", "kb") is store
+    assert resources.get_lexical_index("local", "kb") is resources.get_lexical_index("local", "kb")
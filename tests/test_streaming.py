@@ -0,0 +1,66 @@
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.docstore.document import Document
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from conftest import ListRetriever, make_chain
+from retrieval_chain_utils import (build_conversational_chain, format_history, limit_documents,
+                                   stream_conversational_chain)
+
+DOCS = [Document(page_content=f"Fee schedule part {i}: item {i} costs {i} EUR.", metadata={"source": "fees.pdf"})
+        for i in range(4)]
+HISTORY = [HumanMessage(content="What is the wire fee?"), AIMessage(content="10 EUR."),
+           SystemMessage(content="Summary: wires"), AIMessage(content="")]
+RESPONSES = ["What is the card fee?", "Cards cost 5 EUR."]
+
+
+class PromptLog(BaseCallbackHandler):
+    def __init__(self):
+        self.prompts = []
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompts.append([(m.type, m.content) for batch in messages for m in batch])
+
+
+class WordCountLLM(FakeListChatModel):
+    # Offline token count; the default needs a tokenizer download
+    def get_num_tokens(self, text):
+        return len(text.split())
+
+
+def test_stream_yields_sources_tokens_and_done():
+    events = list(stream_conversational_chain(make_chain(RESPONSES, DOCS), "And for cards?", HISTORY))
+    assert events[0] == ("sources", DOCS)
+    tokens = [value for event, value in events if event == "token"]
+    assert len(tokens) > 1
+    event, info = events[-1]
+    assert event == "done" and info["answer"] == "".join(tokens) == "Cards cost 5 EUR."
+    assert info["ttft"] <= info["seconds"] and info["retrieval_seconds"] <= info["seconds"]
+
+
+def test_stream_sends_the_same_prompts_as_the_chain():
+    # Guards the step-by-step path against LangChain changing its chain internals
+    invoked, streamed = PromptLog(), PromptLog()
+    result = make_chain(RESPONSES, DOCS)({"question": "And for cards?", "chat_history": HISTORY},
+                                         callbacks=[invoked])
+    done = dict(stream_conversational_chain(make_chain(RESPONSES, DOCS), "And for cards?", HISTORY,
+                                            callbacks=[streamed]))["done"]
+    assert len(invoked.prompts) == 2
+    assert streamed.prompts == invoked.prompts
+    assert done["answer"] == result["answer"]
+
+
+def test_history_formatting_matches_langchain():
+    chain = make_chain(RESPONSES)
+    tuples = [("What is the wire fee?", "10 EUR."), ("And for cards?", "5 EUR.")]
+    assert format_history(chain, HISTORY) == _get_chat_history(HISTORY)
+    assert format_history(chain, tuples) == _get_chat_history(tuples)
+    assert format_history(chain, []) == ""
+
+
+def test_document_limit_matches_langchain():
+    for limit in (None, 0, 5, 17, 100):
+        chain = build_conversational_chain(retriever=ListRetriever(docs=DOCS), llm=WordCountLLM(responses=["x"]),
+                                           max_tokens_limit=limit, verbose=False)
+        assert limit_documents(chain, DOCS) == chain._reduce_tokens_below_limit(DOCS), limit
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from index_manifest import IndexManifest, chunk_id
+from ingest_pipeline import index_chunks
+from upsert_engine import FakeIndex, UpsertEngine, is_retryable, record_bytes
+
+
+def records(n, text_bytes=100, dim=8):
+    return [{"id": f"id-{i}", "values": [0.123456789] * dim, "metadata": {"text": "x" * text_bytes}}
+            for i in range(n)]
+
+
+class RequestLog(FakeIndex):
+    """FakeIndex that keeps the records of every request, and fails on IDs in ``reject``."""
+
+    def __init__(self, reject=(), **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.reject = set(reject)
+
+    def upsert(self, vectors, **kwargs):
+        if self.reject.intersection(record["id"] for record in vectors):
+            error = ValueError("Invalid vector")
+            error.status = 400
+            raise error
+        result = super().upsert(vectors, **kwargs)
+        with self._lock:
+            self.batches.append(list(vectors))
+        return result
+
+
+def test_record_bytes_bounds_the_json_size():
+    for record in records(3, text_bytes=5000, dim=384):
+        assert record_bytes(record) >= len(json.dumps(record))
+
+
+def test_requests_are_bounded_by_count_and_bytes():
+    index = RequestLog()
+    engine = UpsertEngine(index, max_batch_records=10, max_batch_bytes=4000)
+    batch = records(25) + records(5, text_bytes=3000)
+    for offset in range(0, len(batch), 7):
+        engine.submit(batch[offset:offset + 7])
+    engine.close()
+    assert sorted(record["id"] for sent in index.batches for record in sent) == sorted(r["id"] for r in batch)
+    for sent in index.batches:
+        assert len(sent) <= 10
+        assert len(sent) == 1 or sum(record_bytes(record) for record in sent) <= 4000
+    assert engine.stats["requests"] == len(index.batches)
+
+
+def test_transient_failures_are_retried():
+    index = FakeIndex(failure_rate=0.4, seed=3)
+    engine = UpsertEngine(index, max_batch_records=5, retries=30, backoff=0.0)
+    engine.submit(records(100))
+    engine.close()
+    assert len(index.vectors) == 100
+    assert engine.stats["retries"] == index.requests - engine.stats["requests"] > 0
+
+
+def test_client_errors_are_not_retried_and_surface_on_close():
+    index = RequestLog(reject={"id-7"})
+    engine = UpsertEngine(index, max_batch_records=5, max_in_flight=1, backoff=0.0)
+    engine.submit(records(5))
+    engine.submit(records(10)[5:])
+    with pytest.raises(ValueError):
+        engine.close()
+    assert engine.stats["retries"] == 0
+    assert not is_retryable(ValueError()) and is_retryable(ConnectionError())
+    # The failure is reported once; the engine is usable again afterwards
+    engine.submit(records(15)[10:])
+    engine.close()
+    assert len(index.vectors) == 10
+
+
+def test_concurrency_is_capped():
+    index = FakeIndex(latency=0.02)
+    engine = UpsertEngine(index, max_in_flight=3, max_batch_records=2)
+    engine.submit(records(40))
+    engine.close()
+    assert index.max_concurrent == 3
+    assert len(index.vectors) == 40
+
+
+def test_interrupted_run_resumes_from_acknowledged_ids(tmp_path, fake_model):
+    chunks = [{"text": f"Clause {i}: fees are waived for account type {i}.",
+               "metadata": {"source": "terms.pdf", "page": i // 4 + 1, "chunk": i % 4}} for i in range(40)]
+    path = str(tmp_path / "manifest.json")
+
+    def run(index):
+        manifest = IndexManifest(path)
+        engine = UpsertEngine(index, max_in_flight=1, max_batch_records=4, backoff=0.0,
+                              on_written=manifest.mark_written)
+
+        def write(batch, vectors):
+            engine.submit([{"id": chunk["id"], "values": vector.tolist(), "metadata": {"text": chunk["text"]}}
+                           for chunk, vector in zip(batch, vectors)])
+        write.close = engine.close
+        return index_chunks([dict(chunk) for chunk in chunks], manifest, write, index.delete, dedup=False)
+
+    failed = RequestLog(reject={chunk_id(chunks[21])})
+    with pytest.raises(ValueError):
+        run(failed)
+    written = set(failed.vectors)
+    assert written and len(written) < 40
+
+    resumed = RequestLog()
+    assert run(resumed)["added"] == 40
+    assert not written & set(resumed.vectors)
+    assert written | set(resumed.vectors) == {chunk_id(chunk) for chunk in chunks}